@@ -0,0 +1,126 @@
+// Bulk delivery actions and live inventory updates for the admin dashboard
+//
+// Selected deliveries are approved / dispatched / cancelled with one JSON request
+// (POST /admin/api/deliveries/bulk). Rows are patched in place from the
+// 'deliveries_updated' and 'resources_updated' Socket.IO events, so other admins'
+// changes show up without a page reload too. 'stock_alert' events (an item went
+// Low / Out of Stock, see stock_forecast.py) are shown above the resource list.
+
+const OPEN_DELIVERY_STATUSES = ['pending', 'approved'];
+
+function selectedDeliveryIds() {
+    return Array.from(document.querySelectorAll('.delivery-select:checked'))
+        .map(function(box) { return parseInt(box.value, 10); });
+}
+
+function bulkDeliveryAction(action) {
+    const ids = selectedDeliveryIds();
+    const resultEl = document.getElementById('delivery-bulk-result');
+    if (ids.length === 0) {
+        resultEl.textContent = 'Select at least one delivery.';
+        return;
+    }
+    if (action === 'cancel' && !confirm('Cancel ' + ids.length + ' deliveries and return their stock?')) {
+        return;
+    }
+
+    fetch('/admin/api/deliveries/bulk', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({action: action, ids: ids})
+    })
+        .then(function(response) { return response.json(); })
+        .then(function(data) {
+            if (data.error) {
+                resultEl.textContent = 'Error: ' + data.error;
+                return;
+            }
+            // Apply our own results right away; the socket event may arrive later (or not at all)
+            data.results.forEach(function(result) {
+                if (result.ok) {
+                    updateDeliveryRow({id: result.id, status: result.status});
+                }
+            });
+            const failures = data.results.filter(function(result) { return !result.ok; });
+            resultEl.textContent = data.updated + ' updated' + (failures.length
+                ? ', ' + failures.length + ' failed (' + failures.map(function(f) { return '#' + f.id + ': ' + f.error; }).join('; ') + ')'
+                : '');
+        })
+        .catch(function(error) {
+            console.error('Bulk delivery action failed:', error);
+            resultEl.textContent = 'Request failed, please retry.';
+        });
+}
+
+function updateDeliveryRow(delivery) {
+    const row = document.getElementById('delivery-' + delivery.id);
+    if (!row) {
+        return;
+    }
+    if (OPEN_DELIVERY_STATUSES.indexOf(delivery.status) === -1) {
+        row.remove(); // Dispatched / delivered / cancelled leave the pending list
+        return;
+    }
+    const badge = row.querySelector('.delivery-status');
+    badge.textContent = delivery.status;
+    badge.className = 'badge delivery-status ' + (delivery.status === 'approved' ? 'badge-info' : 'badge-warning');
+}
+
+function updateResourceCard(resource) {
+    const card = document.getElementById('resource-' + resource.id);
+    if (!card) {
+        return;
+    }
+    card.querySelector('.resource-qty').textContent = resource.quantity;
+    card.querySelector('.resource-status').textContent = resource.status;
+    const qtyInput = card.querySelector('input[name="quantity"]');
+    if (qtyInput && document.activeElement !== qtyInput) {
+        qtyInput.value = resource.quantity;
+    }
+}
+
+function showStockAlert(alert) {
+    const container = document.getElementById('stock-alerts');
+    if (!container) {
+        return;
+    }
+    const div = document.createElement('div');
+    div.className = 'alert alert-dismissible ' + (alert.status === 'Out of Stock' ? 'alert-danger' : 'alert-warning');
+    div.textContent = '⚠️ ' + alert.resource_name + ' is ' + alert.status + ' (qty ' + alert.quantity +
+        (alert.hours_to_stockout !== null ? ', ~' + alert.rate_per_hour + '/h, stockout in ' + alert.hours_to_stockout + 'h' : '') + ')';
+    const close = document.createElement('button');
+    close.type = 'button';
+    close.className = 'close';
+    close.innerHTML = '&times;';
+    close.onclick = function() { div.remove(); };
+    div.appendChild(close);
+    container.prepend(div);
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const selectAll = document.getElementById('delivery-select-all');
+    if (selectAll) {
+        selectAll.addEventListener('change', function() {
+            document.querySelectorAll('.delivery-select').forEach(function(box) {
+                box.checked = selectAll.checked;
+            });
+        });
+    }
+
+    if (typeof socket !== 'undefined') {
+        socket.on('deliveries_updated', function(data) {
+            console.log('Deliveries updated via SocketIO:', data.deliveries.length);
+            data.deliveries.forEach(updateDeliveryRow);
+        });
+
+        socket.on('resources_updated', function(data) {
+            console.log('Resources updated via SocketIO:', data.resources.length);
+            data.resources.forEach(updateResourceCard);
+        });
+
+        socket.on('stock_alert', function(data) {
+            console.log('Stock alert via SocketIO:', data.alerts);
+            data.alerts.forEach(showStockAlert);
+        });
+    }
+});
@@ -4,6 +4,7 @@
 let adminMap = null;
 let adminMarkers = {};
 let adminMapInitialized = false;
+let volunteerPositionMarkers = {}; // username -> marker, moved by 'volunteer_positions' deltas
 
 // Initialize the map for admin dashboard
 function initAdminMap() {
@@ -17,7 +18,7 @@ function initAdminMap() {
     adminMap = L.map('admin-live-map').setView(defaultCenter, defaultZoom);
     
     // Add OpenStreetMap tiles
-    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    L.tileLayer('/map/tiles/{z}/{x}/{y}.png', {
         attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
         maxZoom: 19
     }).addTo(adminMap);
@@ -27,6 +28,7 @@ function initAdminMap() {
     
     // Load initial SOS markers
     loadAdminSOSMarkers();
+    loadVolunteerPositions();
 }
 
 // Load and display SOS markers on admin map
@@ -36,14 +38,8 @@ function loadAdminSOSMarkers() {
         return;
     }
     
-    fetch('/admin/api/sos_map_data')
-        .then(response => {
-            if (!response.ok) {
-                console.error(`Error fetching admin SOS data: ${response.status} ${response.statusText}`);
-                throw new Error('Failed to fetch SOS data');
-            }
-            return response.json();
-        })
+    // Binary columnar payload (see sos_wire.js); descriptions load lazily per popup
+    fetchSOSMapData('/admin/api/sos_map_data')
         .then(sosData => {
             console.log(`Loaded ${sosData.length} SOS alerts for admin map`);
             
@@ -112,7 +108,7 @@ function addAdminSOSMarker(sos) {
     const marker = L.marker([lat, lng], { icon: markerIcon }).addTo(adminMap);
     
     // Create popup content
-    const popupContent = `
+    const buildPopupContent = () => `
         <div style="min-width: 200px;">
             <h4 style="margin: 0 0 10px 0; color: #333;">SOS Alert #${sos.id}</h4>
             <p style="margin: 5px 0;"><strong>User:</strong> ${sos.username}</p>
@@ -124,7 +120,17 @@ function addAdminSOSMarker(sos) {
         </div>
     `;
     
-    marker.bindPopup(popupContent);
+    if (sos.description !== undefined) {
+        marker.bindPopup(buildPopupContent());
+    } else {
+        // Compact format: fetch popup details on first open
+        marker.bindPopup('<div style="min-width: 200px;">Loading SOS #' + sos.id + '...</div>');
+        marker.once('popupopen', () => {
+            loadSOSDetails(`/admin/api/sos/${sos.id}`, sos)
+                .then(() => marker.setPopupContent(buildPopupContent()))
+                .catch(error => console.error(`Error loading details for SOS #${sos.id}:`, error));
+        });
+    }
     
     // Store marker reference
     adminMarkers[sos.id] = marker;
@@ -146,10 +152,75 @@ function updateAdminSOSMarker(sos) {
     addAdminSOSMarker(sos);
 }
 
+// Full set of tracked volunteer positions; socket deltas keep it current afterwards
+function loadVolunteerPositions() {
+    fetch('/admin/api/volunteer_positions')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Failed to fetch volunteer positions: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            const seen = new Set(data.positions.map(position => position[0]));
+            Object.keys(volunteerPositionMarkers).forEach(username => {
+                if (!seen.has(username)) {
+                    removeVolunteerPosition(username);
+                }
+            });
+            data.positions.forEach(setVolunteerPosition);
+            console.log(`Loaded ${data.positions.length} volunteer positions`);
+        })
+        .catch(error => {
+            console.error('Error loading volunteer positions:', error);
+        });
+}
+
+// position = [username, latitude, longitude, timestamp, accuracy]
+function setVolunteerPosition(position) {
+    const [username, lat, lng, timestamp] = position;
+    const tooltip = `${username} (${new Date(timestamp * 1000).toLocaleTimeString()})`;
+    const marker = volunteerPositionMarkers[username];
+    if (marker) {
+        marker.setLatLng([lat, lng]).setTooltipContent(tooltip);
+        return;
+    }
+    volunteerPositionMarkers[username] = L.circleMarker([lat, lng], {
+        radius: 7, color: 'white', weight: 2, fillColor: '#198754', fillOpacity: 0.9
+    }).bindTooltip(tooltip).addTo(adminMap);
+}
+
+function removeVolunteerPosition(username) {
+    if (volunteerPositionMarkers[username]) {
+        adminMap.removeLayer(volunteerPositionMarkers[username]);
+        delete volunteerPositionMarkers[username];
+    }
+}
+
+// Banner for an escalated SOS (shares the dashboard alert area with stock alerts)
+function showEscalationAlert(sos) {
+    const container = document.getElementById('stock-alerts');
+    if (!container) {
+        return;
+    }
+    const div = document.createElement('div');
+    div.className = 'alert alert-dismissible alert-danger';
+    div.textContent = '🚨 SOS #' + sos.id + ' still unassigned: risk raised from ' + sos.previous_risk_level +
+        ' to ' + sos.risk_level + ' (escalation ' + sos.escalation_level + ')';
+    const close = document.createElement('button');
+    close.type = 'button';
+    close.className = 'close';
+    close.innerHTML = '&times;';
+    close.onclick = function() { div.remove(); };
+    div.appendChild(close);
+    container.prepend(div);
+}
+
 // Refresh map data periodically (fallback if SocketIO fails)
 function startAdminMapPolling() {
     setInterval(() => {
         loadAdminSOSMarkers();
+        loadVolunteerPositions();
     }, 30000); // Refresh every 30 seconds
 }
 
@@ -175,12 +246,39 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
         
+        // Store-and-forward batch uploads arrive as one coalesced event
+        socket.on('new_sos_alerts', function(data) {
+            console.log('SOS batch received via SocketIO:', data.alerts.length, 'alerts');
+            if (adminMap) {
+                data.alerts.forEach(function(alert) {
+                    addAdminSOSMarker(alert);
+                });
+            }
+        });
+        
         socket.on('sos_status_updated', function(data) {
             console.log('SOS status updated via SocketIO:', data);
             if (adminMap) {
                 updateAdminSOSMarker(data);
             }
         });
+        
+        // Pending SOS left unattended past its deadline: risk raised, re-broadcast
+        socket.on('sos_escalated', function(data) {
+            console.log('SOS escalated via SocketIO:', data);
+            if (adminMap) {
+                updateAdminSOSMarker(data);
+            }
+            showEscalationAlert(data);
+        });
+        
+        // Throttled deltas: volunteers that moved since the last push, and those gone offline
+        socket.on('volunteer_positions', function(data) {
+            if (adminMap) {
+                data.positions.forEach(setVolunteerPosition);
+                data.offline.forEach(removeVolunteerPosition);
+            }
+        });
     }
 });
 
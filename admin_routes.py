@@ -1,5 +1,25 @@
 from flask import Blueprint, render_template, session, flash, redirect, url_for, request, jsonify
 from db_config import get_db_connection
+from shard_router import connect_sos
+from sos_wire import requested_format, compact_response
+from sos_read_model import read_model, bump_sos_version
+from sos_archive import fetch_sos_history
+from db_backup import list_snapshots, last_run as last_backup_run
+from sos_clustering import all_active_incidents
+from sos_triage import triage_queue
+from ai_predict import get_model, prediction_cache
+from reverse_geocoder import region_names
+from inventory_ops import (bulk_update_deliveries, bulk_adjust_resources, emit_inventory_changes, refresh_stock,
+                           DELIVERY_ACTIONS, OPEN_DELIVERY_STATUSES, BULK_MAX_ITEMS)
+from stock_forecast import stock_forecaster
+from search_index import search_all_sos, SearchError, DEFAULT_LIMIT
+from response_cache import (response_cache, cache_key, cached_response, cached_serve, approx_size, SOS_TOPIC,
+                            INVENTORY_TOPIC)
+from volunteer_tracking import tracker
+from sla_metrics import sla_metrics, record_transition, SLICES, DEFAULT_QUANTILES
+from sos_escalation import escalation_scheduler
+from degradation import stale_notice, stats as degradation_stats
+from extensions import run_blocking
 import logging
 from datetime import datetime
 
@@ -25,6 +45,9 @@ def dashboard():
     alerts = []
     resources = []
     deliveries = []
+    incidents = []
+    regions = []
+    region_filter = request.args.get('region', '').strip() or None
 
     if request.method == 'POST':
         # Handle assign volunteer to SOS
@@ -34,15 +57,10 @@ def dashboard():
         if sos_id and volunteer_name:
             try:
                 sos_id_int = int(sos_id)
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("UPDATE sos_requests SET status = 'assigned', assigned_to = ? WHERE id = ?", 
-                               (volunteer_name, sos_id_int))
-                affected_rows = cursor.rowcount
-                conn.commit()
-                conn.close()
+                version, updated_sos = run_blocking(_assign_sos, sos_id_int, volunteer_name, session['username'])
                 
-                if affected_rows > 0:
+                if version is not None:
+                    read_model.apply_change(sos_id_int, version)
                     flash(f"SOS {sos_id} assigned to {volunteer_name}!", "success")
                     logger.info(f"SOS {sos_id} assigned to volunteer: {volunteer_name}")
                     
@@ -50,21 +68,7 @@ def dashboard():
                     try:
                         from app import socketio
                         if socketio:
-                            conn_socket = get_db_connection()
-                            cursor_socket = conn_socket.cursor()
-                            cursor_socket.execute("""
-                                SELECT sr.id, u.username, sr.latitude, sr.longitude, sr.description, sr.status, sr.assigned_to, sr.risk_level, sr.timestamp
-                                FROM sos_requests sr JOIN users u ON sr.user_id = u.id
-                                WHERE sr.id = ?
-                            """, (sos_id_int,))
-                            updated_sos_raw = cursor_socket.fetchone()
-                            conn_socket.close()
-                            
-                            if updated_sos_raw:
-                                updated_sos = dict(zip([
-                                    'id', 'username', 'latitude', 'longitude', 'description', 
-                                    'status', 'assigned_to', 'risk_level', 'timestamp'
-                                ], updated_sos_raw))
+                            if updated_sos:
                                 logger.debug(f"Emitting sos_status_updated: {updated_sos}")
                                 
                                 socketio.emit('sos_status_updated', updated_sos, 
@@ -97,71 +101,137 @@ def dashboard():
         else:
             flash("SOS ID and volunteer name are required.", "danger")
     
-    # Fetch data for dashboard
+    # Fetch data for dashboard (the same for every admin: cached until the next SOS / inventory event;
+    # while the database is locked or slow, the last complete copy is shown marked as stale)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        key = cache_key('admin_dashboard', params=(region_filter,))
+        data, stale_since = cached_serve(key, (SOS_TOPIC, INVENTORY_TOPIC), lambda: _dashboard_data(region_filter),
+                                         good=lambda d: d['complete'],
+                                         size_of=lambda d: approx_size(d) if d['complete'] else None)
+        if stale_since:
+            flash(stale_notice(stale_since), "warning")
+        alerts, resources, deliveries = data['alerts'], data['resources'], data['deliveries']
+        incidents, regions = data['incidents'], data['regions']
+    except Exception as db_e:
+        logger.error(f"Database error fetching dashboard data: {db_e}")
+        flash("Error loading dashboard data. Please try again.", "danger")
+        alerts = []
+        resources = []
+        deliveries = []
+        incidents = []
+    
+    logger.info(f"Admin dashboard loaded for {session.get('username')}: {len(alerts)} alerts, {len(resources)} resources, {len(deliveries)} deliveries")
+    return render_template('admin_dashboard.html', alerts=alerts, resources=resources, deliveries=deliveries, incidents=incidents, regions=regions, region_filter=region_filter, username=session.get('username'), role=session.get('role'))
+
+def _dashboard_data(region_filter):
+    """Alerts, resources, open deliveries, incidents and region rollup for the admin dashboard."""
+    # Alerts come from the in-memory read model (kept in sync by the write paths)
+    alerts = read_model.alerts_in_region(region_filter) if region_filter else read_model.all_alerts()
+    names = region_names()
+    for alert in alerts:
+        alert['region_name'] = names.get(alert.get('region_id'))
+    regions = _region_rollup(names)
+    
+    logger.info(f"Admin dashboard fetch: {len(alerts)} alerts from read model (version {read_model.version})")
+    for alert in alerts[:3]:
+        lat = float(alert.get('latitude', 0)) if alert.get('latitude') else None
+        lng = float(alert.get('longitude', 0)) if alert.get('longitude') else None
+        logger.info(f"Sample alert ID {alert.get('id')}: lat={lat}, lng={lng}, status={alert.get('status')}, desc='{alert.get('description', '')[:50]}...'")
+        if lat is None or lng is None or lat == 0 or lng == 0:
+            logger.warning(f"⚠️ Invalid coords for alert ID {alert.get('id')}: lat={alert.get('latitude')}, lng={alert.get('longitude')} - Marker will be skipped in JS")
+
+    # Resources and open deliveries come from SQLite on a native thread; complete is False if a
+    # section fell back to empty / stored data: don't cache that
+    resources, deliveries, complete = run_blocking(_inventory_rows)
 
-        # Fetch all alerts with proper coordinate casting
+    # Consumption rate and projected stockout (the forecaster loads its own history)
+    try:
+        resources = stock_forecaster.forecast_rows(resources)
+    except Exception as fc_e:
+        logger.warning(f"Error forecasting stock: {fc_e}. Showing stored status only.")
+        complete = False
+
+    # Incidents (clustered near-duplicate SOS reports) with report counts (fanned out to the shards)
+    try:
+        incidents = all_active_incidents()
+    except Exception as inc_e:
+        logger.warning(f"Error fetching incidents: {inc_e}. Using empty list.")
+        incidents = []
+        complete = False
+    logger.info(f"✅ Admin dashboard data ready: {len(alerts)} alerts, {len(resources)} resources, {len(deliveries)} deliveries")
+    return {'alerts': alerts, 'resources': resources, 'deliveries': deliveries, 'incidents': incidents,
+            'regions': regions, 'complete': complete}
+
+def _assign_sos(sos_id, volunteer_name, actor):
+    """Assign sos_id in one transaction (SQL only: called through run_blocking).
+
+    Returns (version, updated row dict), or (None, None) when there is no such SOS.
+    """
+    conn = connect_sos(sos_id)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE sos_requests SET status = 'assigned', assigned_to = ? WHERE id = ?", 
+                       (volunteer_name, sos_id))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return None, None
+        record_transition(cursor, sos_id, 'assigned', actor)
+        version = bump_sos_version(cursor)
+        conn.commit()
+        
         cursor.execute("""
-            SELECT 
-                sr.id, 
-                u.username, 
-                CAST(sr.latitude AS REAL) as latitude,
-                CAST(sr.longitude AS REAL) as longitude,
-                sr.description, 
-                sr.status, 
-                sr.timestamp, 
-                sr.assigned_to, 
-                sr.risk_level
+            SELECT sr.id, sr.username, sr.latitude, sr.longitude, sr.description, sr.status, sr.assigned_to, sr.risk_level, sr.timestamp
             FROM sos_requests sr
-            JOIN users u ON sr.user_id = u.id
-            ORDER BY sr.timestamp DESC
-        """)
-        alerts_raw = cursor.fetchall()
-        alerts = [dict(row) for row in alerts_raw]
-        
-        logger.info(f"Admin dashboard fetch: {len(alerts_raw)} raw alerts fetched from DB")
-        for alert in alerts[:3]:
-            lat = float(alert.get('latitude', 0)) if alert.get('latitude') else None
-            lng = float(alert.get('longitude', 0)) if alert.get('longitude') else None
-            logger.info(f"Sample alert ID {alert.get('id')}: lat={lat}, lng={lng}, status={alert.get('status')}, desc='{alert.get('description', '')[:50]}...'")
-            if lat is None or lng is None or lat == 0 or lng == 0:
-                logger.warning(f"⚠️ Invalid coords for alert ID {alert.get('id')}: lat={alert.get('latitude')}, lng={alert.get('longitude')} - Marker will be skipped in JS")
-
-        # Fetch all resources
+            WHERE sr.id = ?
+        """, (sos_id,))
+        row = cursor.fetchone()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return version, dict(row) if row else None
+
+def _inventory_rows():
+    """Resources and open deliveries for the dashboard (SQL only: called through run_blocking).
+
+    Returns (resources, deliveries, complete).
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
         cursor.execute("SELECT id, resource_name, quantity, status FROM resources ORDER BY resource_name")
-        resources_raw = cursor.fetchall()
-        resources = [dict(row) for row in resources_raw]
+        resources = [dict(row) for row in cursor.fetchall()]
 
-        # Fetch all pending deliveries
+        # Fetch all open (pending / approved) deliveries
         try:
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT delivery_id as id, volunteer_username, item, quantity, status 
                 FROM resource_deliveries 
-                WHERE status = 'pending'
+                WHERE status IN ({','.join('?' * len(OPEN_DELIVERY_STATUSES))})
                 ORDER BY timestamp DESC
-            """)
-            deliveries_raw = cursor.fetchall()
-            deliveries = [dict(row) for row in deliveries_raw]
+            """, OPEN_DELIVERY_STATUSES)
+            deliveries = [dict(row) for row in cursor.fetchall()]
             logger.info(f"Fetched {len(deliveries)} pending deliveries for admin dashboard")
         except Exception as del_e:
             logger.warning(f"No resource_deliveries table or error fetching deliveries: {del_e}. Using empty list.")
-            deliveries = []
-        
+            return resources, [], False
+    finally:
         conn.close()
-        logger.info(f"✅ Admin dashboard data ready: {len(alerts)} alerts, {len(resources)} resources, {len(deliveries)} deliveries")
-    except Exception as db_e:
-        logger.error(f"Database error fetching dashboard data: {db_e}")
-        flash("Error loading dashboard data. Please try again.", "danger")
-        alerts = []
-        resources = []
-        deliveries = []
-        if 'conn' in locals():
-            conn.rollback()
-    
-    logger.info(f"Admin dashboard loaded for {session.get('username')}: {len(alerts)} alerts, {len(resources)} resources, {len(deliveries)} deliveries")
-    return render_template('admin_dashboard.html', alerts=alerts, resources=resources, deliveries=deliveries, username=session.get('username'), role=session.get('role'))
+    return resources, deliveries, True
+
+def _region_rollup(names=None):
+    """Per-region SOS counts by status, busiest regions first."""
+    names = region_names() if names is None else names
+    rollup = []
+    for region_id, counts in read_model.counts_by_region().items():
+        if region_id is None:
+            continue  # Not resolved to any region
+        active = sum(n for status, n in counts.items() if status != 'resolved')
+        rollup.append({'region_id': region_id, 'name': names.get(region_id, region_id),
+                       'active': active, 'total': sum(counts.values()), 'by_status': counts})
+    rollup.sort(key=lambda r: (-r['active'], -r['total'], r['name']))
+    return rollup
 
 # NEW: API endpoint for live map data (admin sees all SOS locations)
 @admin_bp.route('/api/sos_map_data', methods=['GET'])
@@ -170,26 +240,18 @@ def get_sos_map_data():
     if 'username' not in session or session.get('role') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
+    # Compact/binary columnar format (opt-in via ?format= or Accept header)
+    fmt = requested_format(request)
+    region = request.args.get('region', '').strip() or None
+    return cached_response('admin_sos_map_data', (SOS_TOPIC,), lambda: _sos_map_data(fmt, region),
+                           params=(fmt, region))
+
+def _sos_map_data(fmt, region):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT 
-                sr.id,
-                u.username,
-                CAST(sr.latitude AS REAL) as latitude,
-                CAST(sr.longitude AS REAL) as longitude,
-                sr.description,
-                sr.status,
-                sr.risk_level,
-                sr.assigned_to,
-                sr.timestamp
-            FROM sos_requests sr
-            JOIN users u ON sr.user_id = u.id
-            ORDER BY sr.timestamp DESC
-        """)
-        sos_data_raw = cursor.fetchall()
-        conn.close()
+        if fmt:
+            return compact_response(read_model.compact_rows(region_id=region), fmt)
+
+        sos_data_raw = read_model.alerts_in_region(region) if region else read_model.all_alerts()
         
         # Convert to list of dicts for JSON serialization
         sos_data = [
@@ -202,7 +264,8 @@ def get_sos_map_data():
                 'status': row['status'],
                 'risk_level': row['risk_level'],
                 'assigned_to': row['assigned_to'],
-                'timestamp': row['timestamp']
+                'timestamp': row['timestamp'],
+                'region_id': row['region_id']
             }
             for row in sos_data_raw
         ]
@@ -213,6 +276,183 @@ def get_sos_map_data():
         logger.error(f"Error fetching SOS map data: {e}")
         return jsonify({'error': 'Failed to fetch map data'}), 500
 
+# Popup details for a single SOS marker (loaded lazily by the compact map format)
+@admin_bp.route('/api/sos/<int:sos_id>', methods=['GET'])
+def get_sos_details(sos_id):
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        details = run_blocking(_sos_details, sos_id)
+        if details is None:
+            return jsonify({'error': 'SOS not found'}), 404
+        return jsonify(details)
+    except Exception as e:
+        logger.error(f"Error fetching SOS details for {sos_id}: {e}")
+        return jsonify({'error': 'Failed to fetch SOS details'}), 500
+
+def _sos_details(sos_id):
+    """Popup fields of one SOS, or None (SQL only: called through run_blocking)."""
+    conn = connect_sos(sos_id)
+    try:
+        row = conn.execute("""
+            SELECT sr.id, sr.username, sr.description, sr.assigned_to, sr.timestamp
+            FROM sos_requests sr
+            WHERE sr.id = ?
+        """, (sos_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+# Active incidents (clustered SOS reports) with report counts
+@admin_bp.route('/api/incidents', methods=['GET'])
+def get_incidents():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        return jsonify(all_active_incidents())
+    except Exception as e:
+        logger.error(f"Error fetching incidents: {e}")
+        return jsonify({'error': 'Failed to fetch incidents'}), 500
+
+# Region-wide triage: top-k pending SOS by priority score
+@admin_bp.route('/api/triage', methods=['GET'])
+def get_triage():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), 500)
+        return jsonify(triage_queue.top_k(k))
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    except Exception as e:
+        logger.error(f"Error computing triage list: {e}")
+        return jsonify({'error': 'Failed to compute triage list'}), 500
+
+# Historical SOS lookup (transparently includes archived rows for old ranges)
+@admin_bp.route('/api/sos_history', methods=['GET'])
+def get_sos_history():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    start = request.args.get('start', '').strip() or None
+    end = request.args.get('end', '').strip() or None
+    try:
+        history = fetch_sos_history(start, end)
+        logger.info(f"API: Returned {len(history)} SOS history rows for range {start} - {end}")
+        return jsonify(history)
+    except Exception as e:
+        logger.error(f"Error fetching SOS history: {e}")
+        return jsonify({'error': 'Failed to fetch SOS history'}), 500
+
+# Per-region SOS rollup (regions come from the offline gazetteer, see reverse_geocoder.py)
+@admin_bp.route('/api/regions', methods=['GET'])
+def get_regions():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        return cached_response('admin_regions', (SOS_TOPIC,), lambda: jsonify(_region_rollup()))
+    except Exception as e:
+        logger.error(f"Error computing region rollup: {e}")
+        return jsonify({'error': 'Failed to compute region rollup'}), 500
+
+# Risk-model prediction cache metrics (hit rate, evictions, invalidations)
+@admin_bp.route('/api/prediction_cache', methods=['GET'])
+def get_prediction_cache_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    _, _, version = get_model()
+    return jsonify(dict(prediction_cache.stats(), model_version=version))
+
+# Dashboard / map response cache metrics (hit rate, coalesced computations, evictions)
+@admin_bp.route('/api/response_cache', methods=['GET'])
+def get_response_cache_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(response_cache.stats())
+
+# Database snapshots on disk and the latest backup run (see db_backup.py)
+@admin_bp.route('/api/backups', methods=['GET'])
+def get_backups():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        snapshots = [{'stamp': s['stamp'], 'databases': sorted(s['files']), 'bytes': s['bytes']}
+                     for s in reversed(list_snapshots())]
+        return jsonify({'snapshots': snapshots, 'last_run': dict(last_backup_run) or None})
+    except Exception as e:
+        logger.error(f"Error listing backups: {e}")
+        return jsonify({'error': 'Failed to list backups'}), 500
+
+# Time-to-assign / time-to-resolve percentiles per region and risk level (see sla_metrics.py)
+@admin_bp.route('/api/sla', methods=['GET'])
+def get_sla_metrics():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    by = tuple(c for c in request.args.get('by', ','.join(SLICES)).split(',') if c)
+    if any(c not in SLICES for c in by):
+        return jsonify({'error': f"by must be a comma-separated subset of {', '.join(SLICES)}"}), 400
+    try:
+        quantiles = tuple(float(q) for q in request.args.get('q', '').split(',') if q) or DEFAULT_QUANTILES
+        if not all(0 <= q <= 1 for q in quantiles):
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'q must be comma-separated quantiles between 0 and 1'}), 400
+    try:
+        return jsonify(dict(sla_metrics.summary(by, quantiles), stats=sla_metrics.stats()))
+    except Exception as e:
+        logger.error(f"Error computing SLA metrics: {e}")
+        return jsonify({'error': 'Failed to compute SLA metrics'}), 500
+
+# Database circuit breaker, stale snapshot and SOS spool counters (see degradation.py)
+@admin_bp.route('/api/degradation', methods=['GET'])
+def get_degradation_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        return jsonify(degradation_stats())
+    except Exception as e:
+        logger.error(f"Error reading degradation stats: {e}")
+        return jsonify({'error': 'Failed to read degradation stats'}), 500
+
+# Unattended-SOS escalation timers (see sos_escalation.py)
+@admin_bp.route('/api/escalations', methods=['GET'])
+def get_escalation_stats():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(escalation_scheduler.stats())
+
+# Latest volunteer positions (the admin map then follows 'volunteer_positions' socket deltas)
+@admin_bp.route('/api/volunteer_positions', methods=['GET'])
+def get_volunteer_positions():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({'positions': tracker.positions.snapshot(), 'stats': tracker.stats()})
+
+# Volunteers near a point, nearest first (e.g. who can reach an SOS)
+@admin_bp.route('/api/volunteers/nearby', methods=['GET'])
+def get_nearby_volunteers():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    if lat is None or lng is None:
+        return jsonify({'error': 'lat and lng are required'}), 400
+    radius_km = min(max(request.args.get('radius_km', 10.0, type=float), 0.1), 500.0)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 200)
+    return jsonify(tracker.positions.nearby(lat, lng, radius_km, limit))
+
 # Add a new resource
 @admin_bp.route('/add_resource', methods=['POST'])
 def add_resource():
@@ -223,9 +463,8 @@ def add_resource():
     
     resource_name = request.form.get('resource_name', '').strip()
     quantity_str = request.form.get('quantity', '').strip()
-    status = request.form.get('status', '').strip()
 
-    if not resource_name or not quantity_str or not status:
+    if not resource_name or not quantity_str:
         flash("All resource fields are required!", "danger")
         return redirect(url_for('admin.dashboard'))
     
@@ -234,12 +473,11 @@ def add_resource():
         if quantity < 0:
             raise ValueError("Quantity cannot be negative")
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO resources (resource_name, quantity, status) VALUES (?, ?, ?)",
-                       (resource_name, quantity, status))
-        conn.commit()
-        conn.close()
+        # Status is derived from quantity and the item's consumption rate
+        forecast = stock_forecaster.snapshot()
+        resources, alerts = run_blocking(_add_resource, resource_name, quantity, forecast)
+        emit_inventory_changes(resources=resources, alerts=alerts)
+        status = next((r['status'] for r in resources if r['resource_name'] == resource_name), 'Available')
         flash(f"Resource '{resource_name}' added successfully!", "success")
         logger.info(f"Resource added: {resource_name} (Qty: {quantity}, Status: {status})")
     except ValueError as ve:
@@ -248,12 +486,25 @@ def add_resource():
     except Exception as e:
         flash(f"Error adding resource: {e}", "danger")
         logger.error(f"Error adding resource: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
     
     return redirect(url_for('admin.dashboard'))
 
+def _add_resource(resource_name, quantity, forecast):
+    """Insert a resource and derive its status (SQL only: called through run_blocking)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO resources (resource_name, quantity, status) VALUES (?, ?, 'Available')",
+                       (resource_name, quantity))
+        resources, alerts = refresh_stock(cursor, [resource_name], forecast)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return resources, alerts
+
 # Update an existing resource
 @admin_bp.route('/update_resource', methods=['POST'])
 def update_resource():
@@ -264,9 +515,8 @@ def update_resource():
     
     res_id_str = request.form.get('res_id', '').strip()
     quantity_str = request.form.get('quantity', '').strip()
-    status = request.form.get('status', '').strip()
 
-    if not res_id_str or not quantity_str or not status:
+    if not res_id_str or not quantity_str:
         flash("All update fields are required!", "danger")
         return redirect(url_for('admin.dashboard'))
     
@@ -276,15 +526,13 @@ def update_resource():
         if quantity < 0:
             raise ValueError("Quantity cannot be negative")
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE resources SET quantity = ?, status = ? WHERE id = ?",
-                       (quantity, status, res_id))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+        forecast = stock_forecaster.snapshot()
+        updated = run_blocking(_update_resource, res_id, quantity, forecast)
         
-        if affected_rows > 0:
+        if updated is not None:
+            resources, alerts = updated
+            emit_inventory_changes(resources=resources, alerts=alerts)
+            status = next((r['status'] for r in resources if r['id'] == res_id), None)
             flash(f"Resource ID {res_id} updated successfully!", "success")
             logger.info(f"Resource updated: ID {res_id} (Qty: {quantity}, Status: {status})")
         else:
@@ -296,8 +544,166 @@ def update_resource():
     except Exception as e:
         flash(f"Error updating resource: {e}", "danger")
         logger.error(f"Error updating resource: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
     
     return redirect(url_for('admin.dashboard'))
+
+def _update_resource(res_id, quantity, forecast):
+    """Set a resource's quantity and re-derive its status (SQL only: called through run_blocking).
+
+    Returns (resources, alerts), or None when there is no such resource.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE resources SET quantity = ? WHERE id = ?", (quantity, res_id))
+        if cursor.rowcount == 0:
+            return None
+        cursor.execute("SELECT resource_name FROM resources WHERE id = ?", (res_id,))
+        resources, alerts = refresh_stock(cursor, [cursor.fetchone()['resource_name']], forecast)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return resources, alerts
+
+# Bulk approve / dispatch / cancel deliveries in one transaction
+@admin_bp.route('/api/deliveries/bulk', methods=['POST'])
+def bulk_deliveries():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    payload = request.get_json(silent=True) or {}
+    action = payload.get('action')
+    ids = payload.get('ids')
+    if action not in DELIVERY_ACTIONS:
+        return jsonify({'error': f"action must be one of {sorted(DELIVERY_ACTIONS)}"}), 400
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return jsonify({'error': 'ids must be a non-empty list of delivery ids'}), 400
+    if len(ids) > BULK_MAX_ITEMS:
+        return jsonify({'error': f'At most {BULK_MAX_ITEMS} deliveries per request'}), 413
+    
+    forecast = stock_forecaster.snapshot()
+    try:
+        results, deliveries, resources, alerts, consumption = run_blocking(
+            _bulk_delivery_transaction, action, ids, forecast)
+    except Exception as e:
+        logger.error(f"Error in bulk delivery {action}: {e}")
+        return jsonify({'error': 'Failed to update deliveries'}), 500
+    
+    stock_forecaster.record_all(consumption)  # Only once committed
+    emit_inventory_changes(deliveries, resources, alerts)
+    updated = len(deliveries)
+    logger.info(f"✅ Bulk delivery {action} by {session.get('username')}: {updated}/{len(ids)} updated")
+    return jsonify({'action': action, 'updated': updated, 'failed': len(ids) - updated, 'results': results})
+
+def _bulk_delivery_transaction(action, ids, forecast):
+    """bulk_update_deliveries in one write transaction (SQL only: called through run_blocking)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        outcome = bulk_update_deliveries(cursor, action, ids, forecast)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return outcome
+
+# Bulk stock adjustments ({'id', 'delta' | 'quantity'} items) in one transaction
+@admin_bp.route('/api/resources/bulk', methods=['POST'])
+def bulk_resources():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    payload = request.get_json(silent=True) or {}
+    adjustments = payload.get('adjustments')
+    atomic = bool(payload.get('atomic', False))
+    if not isinstance(adjustments, list) or not adjustments:
+        return jsonify({'error': 'adjustments must be a non-empty list'}), 400
+    if len(adjustments) > BULK_MAX_ITEMS:
+        return jsonify({'error': f'At most {BULK_MAX_ITEMS} adjustments per request'}), 413
+    
+    forecast = stock_forecaster.snapshot()
+    try:
+        results, resources, alerts = run_blocking(_bulk_resource_transaction, adjustments, forecast, atomic)
+    except Exception as e:
+        logger.error(f"Error in bulk resource adjustment: {e}")
+        return jsonify({'error': 'Failed to adjust resources'}), 500
+    
+    emit_inventory_changes(resources=resources, alerts=alerts)
+    failed = sum(1 for result in results if not result['ok'])
+    logger.info(f"✅ Bulk resource adjustment by {session.get('username')}: "
+                f"{len(results) - failed} ok, {failed} failed{' (rolled back)' if atomic and failed else ''}")
+    status_code = 409 if atomic and failed else 200
+    updated = 0 if atomic and failed else len({result['id'] for result in results if result['ok']})
+    return jsonify({'updated': updated, 'failed': failed, 'atomic': atomic, 'results': results}), status_code
+
+def _bulk_resource_transaction(adjustments, forecast, atomic):
+    """bulk_adjust_resources in one write transaction (SQL only: called through run_blocking).
+
+    Returns (results, resources, alerts); with atomic, a partial failure rolls everything back.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        results, resources, alerts, all_ok = bulk_adjust_resources(cursor, adjustments, forecast, atomic=atomic)
+        if atomic and not all_ok:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return results, resources, alerts
+
+# Per-item consumption rate, projected stockout and derived status
+@admin_bp.route('/api/stock_forecast', methods=['GET'])
+def get_stock_forecast():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    snapshot = stock_forecaster.snapshot()
+    try:
+        # Read only: stored statuses are caught up by the transactions that change stock
+        forecast = snapshot.forecast_rows(run_blocking(_resource_rows))
+    except Exception as e:
+        logger.error(f"Error computing stock forecast: {e}")
+        return jsonify({'error': 'Failed to compute stock forecast'}), 500
+    
+    forecast.sort(key=lambda r: (r['hours_to_stockout'] is None, r['hours_to_stockout'] or 0, r['resource_name']))
+    return jsonify(forecast)
+
+def _resource_rows():
+    """Every resource row (SQL only: called through run_blocking)."""
+    conn = get_db_connection()
+    try:
+        return [dict(row) for row in conn.execute("SELECT id, resource_name, quantity, status FROM resources")]
+    finally:
+        conn.close()
+
+# Full-text SOS search: ?q=&order=rank|recent&status=&region=&limit=&cursor=
+@admin_bp.route('/api/search/sos', methods=['GET'])
+def search_sos_requests():
+    if 'username' not in session or session.get('role') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        page = search_all_sos(request.args.get('q', ''),
+                              limit=request.args.get('limit', DEFAULT_LIMIT, type=int),
+                              after=request.args.get('cursor') or None,
+                              order=request.args.get('order', 'rank'),
+                              status=request.args.get('status') or None,
+                              region=request.args.get('region') or None)
+        return jsonify(page)
+    except SearchError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error searching SOS requests: {e}")
+        return jsonify({'error': 'Search failed'}), 500
@@ -1,8 +1,202 @@
-from sklearn.ensemble import RandomForestClassifier
-import pandas as pd
+# ai_predict.py - Serving side of the disaster risk model
+#
+# Models are trained offline by train_model.py and registered as versioned
+# artifacts under models/:
+#   models/disaster_model-<version>.pkl    fitted estimator (joblib)
+#   models/disaster_model-<version>.json   metadata + feature schema
+#   models/registry.json                   {"current": "<version>"} (replaced atomically)
+#
+# This module only ever loads a registered model; it never trains one in the
+# request path. Callers fall back to their own dummy behaviour when get_model()
+# returns no model. Loaded forests are served through tree_inference's flat-array
+# evaluator when it verifies identical to sklearn.
+#
+# predict_risk() is the shared entry point for every caller of the model. It
+# memoises predictions in an LRU + TTL cache keyed on (model version, quantised
+# inputs); a newly loaded model version empties the cache.
+import os
+import json
+import math
+import logging
+import threading
+import time
+from collections import OrderedDict
+import joblib
+import numpy as np
+from tree_inference import CompiledForest, compile_model
+from extensions import run_blocking
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = "models"
+REGISTRY_PATH = os.path.join(MODELS_DIR, "registry.json")
+# Pre-registry locations: the pickle shipped in the repo root, or an older models/ copy
+LEGACY_MODEL_PATHS = (os.path.join(MODELS_DIR, "disaster_model.pkl"), "disaster_model.pkl")
+FEATURES = ['rainfall', 'temperature', 'humidity']
+DEFAULT_LABELS = {0: 'Low', 1: 'Medium', 2: 'High'}
+# Quantisation step per feature: 1 mm rainfall, 0.5 °C, 1 % humidity
+QUANTIZATION_STEPS = (1.0, 0.5, 1.0)
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 4096))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 600))  # Seconds
+
+_lock = threading.Lock()
+_state = {'model': None, 'labels': DEFAULT_LABELS, 'version': None, 'registry_mtime': None, 'loaded': False}
+
+
+class PredictionCache:
+    """Bounded LRU cache of risk labels with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (label, expires_at)
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]  # Expired
+            self.misses += 1
+            return None
+
+    def put(self, key, label):
+        with self._lock:
+            self._entries[key] = (label, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+prediction_cache = PredictionCache()
+
+
+def quantize(features):
+    """Snap [rainfall, temperature, humidity] to the cache grid (ValueError for NaN / infinity)."""
+    values = [float(v) for v in features]
+    if not all(math.isfinite(v) for v in values):
+        raise ValueError(f"Non-finite model input: {features}")
+    return tuple(round(round(v / step) * step, 3) for v, step in zip(values, QUANTIZATION_STEPS))
+
+
+def artifact_paths(version):
+    base = os.path.join(MODELS_DIR, f"disaster_model-{version}")
+    return base + ".pkl", base + ".json"
+
+
+def _registry_mtime():
+    try:
+        return os.stat(REGISTRY_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load_registered():
+    with open(REGISTRY_PATH, encoding='utf-8') as fh:
+        version = json.load(fh)['current']
+    model_path, meta_path = artifact_paths(version)
+    with open(meta_path, encoding='utf-8') as fh:
+        metadata = json.load(fh)
+    if metadata.get('features') != FEATURES:
+        raise ValueError(f"Model {version} feature schema {metadata.get('features')} does not match {FEATURES}")
+    labels = {int(k): v for k, v in metadata.get('labels', DEFAULT_LABELS).items()}
+    return joblib.load(model_path), labels, version
+
+
+def _load(mtime):
+    """(model, labels, version) for the registry state seen at `mtime`."""
+    model, labels, version = None, DEFAULT_LABELS, None
+    try:
+        if mtime is not None:
+            model, labels, version = _load_registered()
+            logger.info(f"✅ Disaster prediction model {version} loaded from registry.")
+        elif any(os.path.exists(path) for path in LEGACY_MODEL_PATHS):
+            path = next(path for path in LEGACY_MODEL_PATHS if os.path.exists(path))
+            model, version = joblib.load(path), 'legacy'
+            logger.info(f"✅ Legacy disaster prediction model loaded from {path} (not registered).")
+        else:
+            logger.warning("⚠️ No registered disaster model. Run train_model.py; predictions fall back to dummy mode.")
+    except Exception as e:
+        logger.error(f"⚠️ Error loading disaster model: {e}. Falling back to dummy mode.")
+        model, labels, version = None, DEFAULT_LABELS, None
+    if model is not None:
+        model = compile_model(model)
+    return model, labels, version
+
+
+def _refresh():
+    mtime = _registry_mtime()
+    if _state['loaded'] and mtime == _state['registry_mtime']:
+        return
+    # Unpickling and verifying a forest takes a while: keep it off the event loop
+    model, labels, version = run_blocking(_load, mtime)
+    if version != _state['version']:
+        prediction_cache.clear()  # Entries of the previous model must never be served
+    _state.update(model=model, labels=labels, version=version, registry_mtime=mtime, loaded=True)
+
+
+def get_model():
+    """Return (model, labels, version) for the currently registered artifact.
+
+    Re-reads the registry when it changes, so a newly registered model is picked
+    up without a restart. `model` is None when nothing usable is registered.
+    """
+    with _lock:
+        _refresh()
+        return _state['model'], _state['labels'], _state['version']
+
 
 def predict_risk(features):
-    df = pd.read_csv('disaster_data.csv')
-    model = RandomForestClassifier()
-    model.fit(df[['feature1', 'feature2']], df['risk_level'])
-    return model.predict([features])
+    """Risk label for one [rainfall, temperature, humidity] row, or None without a model.
+
+    The model is evaluated on the quantised inputs, so a cached label is exactly
+    what a fresh prediction for the same grid point would return.
+    """
+    return predict_risk_batch([features])[0]
+
+
+def predict_risk_batch(rows):
+    """Risk labels for many rows: cache hits are served, all misses share one model call."""
+    model, labels, version = get_model()
+    if model is None:
+        return [None] * len(rows)
+    points = [quantize(row) for row in rows]
+    results = [prediction_cache.get((version, point)) for point in points]
+    missing = sorted({point for point, label in zip(points, results) if label is None})
+    if missing:
+        X = np.asarray(missing, dtype=np.float64)
+        if isinstance(model, CompiledForest):
+            encoded = model.predict(X)  # Microseconds per row: cheaper than a thread-pool hop
+        else:
+            encoded = run_blocking(model.predict, X)
+        fresh = {point: labels.get(int(code), 'Unknown') for point, code in zip(missing, encoded)}
+        for point, label in fresh.items():
+            prediction_cache.put((version, point), label)
+        results = [fresh[point] if label is None else label for point, label in zip(points, results)]
+    return results
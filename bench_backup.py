@@ -0,0 +1,115 @@
+# bench_backup.py - SOS insert latency while an online backup runs
+# Run: python bench_backup.py [--rows 300000] [--seconds 5] [--rate 50]
+#
+# A writer thread inserts SOS rows one transaction each (as the SOS form does)
+# at --rate per second, with the app's default 5 s busy timeout. Phases: no
+# backup, back-to-back incremental backups (db_backup defaults), and
+# back-to-back single-step backups (the whole copy under one read lock), then
+# single-step backups of the same file switched to WAL journaling (readers no
+# longer block writers there).
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+from db_backup import copy_database, BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE
+
+SCHEMA = """
+    CREATE TABLE sos_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, username TEXT NOT NULL,
+        latitude REAL NOT NULL, longitude REAL NOT NULL, description TEXT NOT NULL,
+        status TEXT DEFAULT 'pending', risk_level TEXT DEFAULT 'N/A',
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+INSERT = ("INSERT INTO sos_requests (user_id, username, latitude, longitude, description) "
+          "VALUES (1, 'user', ?, ?, ?)")
+
+
+def _description(rng):
+    return ' '.join(rng.choices("water flood roof trapped family children elderly insulin boat rescue".split(), k=12))
+
+
+def build(path, rows, seed=1):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.executemany(INSERT, ((13 + rng.random(), 80 + rng.random(), _description(rng)) for _ in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def _writer(path, rate, stop, latencies):
+    rng = random.Random(2)
+    conn = sqlite3.connect(path, timeout=5.0)
+    interval = 1.0 / rate
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        conn.execute(INSERT, (13 + rng.random(), 80 + rng.random(), _description(rng)))
+        conn.commit()
+        latencies.append(time.perf_counter() - t0)
+        next_at += interval
+        time.sleep(max(0.0, next_at - time.perf_counter()))
+    conn.close()
+
+
+def phase(path, seconds, rate, backup_pages=None):
+    """Insert latencies over `seconds`, with back-to-back backups of `backup_pages` per step (None = no backup)."""
+    stop, latencies, backups = threading.Event(), [], []
+    writer = threading.Thread(target=_writer, args=(path, rate, stop, latencies))
+    writer.start()
+    deadline = time.perf_counter() + seconds
+    dest = path + '.copy'
+    while time.perf_counter() < deadline:
+        if backup_pages is None:
+            time.sleep(0.05)
+            continue
+        t0 = time.perf_counter()
+        stats = copy_database(path, dest, pages=backup_pages)
+        backups.append((time.perf_counter() - t0, stats['restarts']))
+        os.remove(dest)
+    stop.set()
+    writer.join()
+    return sorted(latencies), backups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SOS insert latency during online backups")
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--seconds', type=float, default=5.0, help="duration of each phase")
+    parser.add_argument('--rate', type=float, default=50.0, help="SOS inserts per second")
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'bench_backup.db'))
+    args = parser.parse_args(argv)
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    build(args.db, args.rows)
+    print(f"SQLite {sqlite3.sqlite_version}, db {os.path.getsize(args.db) / 2 ** 20:.0f} MB, "
+          f"{args.rate:.0f} inserts/s for {args.seconds:.0f}s per phase")
+    cases = [("no backup", None),
+             (f"incremental ({BACKUP_PAGES_PER_STEP} pages, {1e3 * BACKUP_STEP_PAUSE:.0f} ms pause)",
+              BACKUP_PAGES_PER_STEP),
+             ("single step", -1),
+             ("single step, WAL journal", -1)]
+    for name, pages in cases:
+        if 'WAL' in name:
+            conn = sqlite3.connect(args.db)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.close()
+        latencies, backups = phase(args.db, args.seconds, args.rate, pages)
+        n = len(latencies)
+        line = (f"  {name:<38} | p50 {1e3 * latencies[n // 2]:7.2f} ms | p99 {1e3 * latencies[int(n * 0.99)]:7.2f} ms"
+                f" | max {1e3 * latencies[-1]:7.2f} ms")
+        if backups:
+            line += (f" | {len(backups)} backups, avg {sum(b[0] for b in backups) / len(backups):.2f}s, "
+                     f"{sum(b[1] for b in backups)} restarts")
+        print(line)
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench_escalation.py - Cost of escalation timers at scale
+# Run: python bench_escalation.py [--timers 100000] [--idle 5]
+#
+# Arms --timers deadlines spread over the next hour on a scheduler of its own,
+# cancels half of them (as assignments would), then lets the scheduler thread
+# run for --idle seconds and reports the process CPU time it used. Finally
+# times popping a burst of 10k simultaneously due timers (the DB work per fired
+# escalation is one indexed read and one UPDATE, not measured here).
+import os
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Escalation timer cost")
+    parser.add_argument('--timers', type=int, default=100000)
+    parser.add_argument('--idle', type=float, default=5.0, help="seconds to watch the idle scheduler")
+    args = parser.parse_args(argv)
+
+    os.chdir(tempfile.mkdtemp(prefix='bench_escalation_'))  # db_config creates drms.db here on import
+    from sos_escalation import EscalationScheduler
+    scheduler = EscalationScheduler()
+    rng = random.Random(1)
+    now = time.time()
+    deadlines = [now + 60 + rng.random() * 3600 for _ in range(args.timers)]
+
+    t0 = time.perf_counter()
+    for sos_id, deadline in enumerate(deadlines):
+        scheduler.schedule(sos_id, deadline)
+    arm = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for sos_id in range(0, args.timers, 2):
+        scheduler.cancel(sos_id)
+    cancel = time.perf_counter() - t0
+    print(f"{args.timers} timers")
+    print(f"  arm            {1e6 * arm / args.timers:8.2f} us/timer")
+    print(f"  cancel         {1e6 * cancel / (args.timers // 2):8.2f} us/timer  (heap {len(scheduler._heap)} entries, "
+          f"{len(scheduler)} armed)")
+
+    threading.Thread(target=scheduler._loop, daemon=True).start()
+    time.sleep(0.5)
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    time.sleep(args.idle)
+    cpu = time.process_time() - cpu0
+    print(f"  idle           {1e3 * cpu:8.2f} ms CPU over {time.perf_counter() - wall0:.1f}s "
+          f"({100 * cpu / args.idle:.3f}% of a core)")
+
+    burst = EscalationScheduler()
+    for sos_id in range(10000):
+        burst.schedule(sos_id, now - rng.random())
+    t0 = time.perf_counter()
+    due, _ = burst._pop_due(time.time())
+    print(f"  due burst      {1e3 * (time.perf_counter() - t0):8.2f} ms to pop {len(due)} expired timers")
+
+
+if __name__ == "__main__":
+    main()
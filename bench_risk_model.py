@@ -0,0 +1,47 @@
+# bench_risk_model.py - Per-prediction latency: sklearn vs compiled flat-array forest
+# Run: python bench_risk_model.py [model.pkl]
+import sys
+import time
+import warnings
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from tree_inference import CompiledForest
+
+
+def _synthetic_model(n_estimators=100, n_rows=5000, seed=42):
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.uniform(0, 300, n_rows), rng.uniform(10, 45, n_rows), rng.uniform(20, 100, n_rows)])
+    y = np.digitize(X[:, 0] / 3 + X[:, 2] / 2 + rng.normal(0, 10, n_rows), [60, 100])
+    return RandomForestClassifier(n_estimators=n_estimators, random_state=seed).fit(X, y)
+
+
+def _time_per_call(fn, X, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - t0) / repeat
+
+
+def bench(name, model, seed=7):
+    compiled = CompiledForest(model)
+    verified = compiled.verify()
+    rng = np.random.default_rng(seed)
+    print(f"{name}: {compiled.n_trees} trees, {compiled.node_count} nodes, verified identical: {verified}")
+    if not verified:
+        print("  (ai_predict would keep serving the sklearn estimator for this model)")
+    for batch in (1, 16, 200, 1000):
+        X = np.column_stack([rng.uniform(0, 300, batch), rng.uniform(10, 45, batch), rng.uniform(20, 100, batch)])
+        repeat = 200 if batch < 1000 else 20
+        sk = _time_per_call(model.predict, X, repeat)
+        fast = _time_per_call(compiled.predict, X, repeat)
+        same = np.array_equal(model.predict(X), compiled.predict(X))
+        print(f"  batch {batch:>5} | sklearn {1e6 * sk / batch:9.1f} us/row | compiled {1e6 * fast / batch:8.1f} us/row "
+              f"| {sk / fast:6.1f}x | identical: {same}")
+
+
+if __name__ == "__main__":
+    warnings.simplefilter('ignore')  # Pickle version / feature-name warnings
+    if len(sys.argv) > 1:
+        bench(sys.argv[1], joblib.load(sys.argv[1]))
+    bench("synthetic 100-tree forest", _synthetic_model())
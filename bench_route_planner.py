@@ -0,0 +1,27 @@
+# bench_route_planner.py - Timing and quality of volunteer route planning
+# Run: python bench_route_planner.py
+import time
+import random
+from route_planner import haversine_matrix, nearest_neighbor, two_opt, path_length
+
+
+def bench(n_stops, seed=42):
+    rng = random.Random(seed)
+    coords = [(13.0827, 80.2707)] + [(rng.uniform(12.8, 13.3), rng.uniform(80.0, 80.4)) for _ in range(n_stops)]
+    t0 = time.perf_counter()
+    dist = haversine_matrix(coords)
+    t1 = time.perf_counter()
+    nn_path = nearest_neighbor(dist)
+    t2 = time.perf_counter()
+    opt_path = two_opt(dist, nn_path)
+    t3 = time.perf_counter()
+    nn_km = path_length(dist, nn_path)
+    opt_km = path_length(dist, opt_path)
+    print(f"{n_stops:>4} stops | matrix {1000 * (t1 - t0):7.1f} ms | NN {1000 * (t2 - t1):7.1f} ms | "
+          f"2-opt {1000 * (t3 - t2):8.1f} ms | NN {nn_km:8.1f} km -> 2-opt {opt_km:8.1f} km "
+          f"({100 * (nn_km - opt_km) / nn_km:4.1f}% shorter)")
+
+
+if __name__ == "__main__":
+    for n in (10, 25, 50, 100, 200, 500):
+        bench(n)
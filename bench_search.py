@@ -0,0 +1,133 @@
+# bench_search.py - FTS5 search latency at scale and the cost of the sync triggers on SOS inserts
+# Run: python bench_search.py [--rows 1000000] [--db /tmp/bench_search.db]
+# (importing db_config initialises drms.db in the working directory, as the app does)
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import db_config
+from search_index import search_sos
+
+WORDS = ("water flood rising roof trapped family children elderly injured bleeding insulin medicine food "
+         "shelter boat rescue collapsed building road blocked power outage fever pregnant wheelchair dog "
+         "cattle fire smoke landslide mud stranded bridge river school hospital oxygen dialysis baby").split()
+RARE = ["snakebite", "ventilator", "epipen", "chemotherapy", "pacemaker"]
+
+SCHEMA = """
+    CREATE TABLE sos_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, username TEXT NOT NULL,
+        latitude REAL NOT NULL, longitude REAL NOT NULL, description TEXT NOT NULL,
+        status TEXT DEFAULT 'pending', assigned_to TEXT, risk_level TEXT DEFAULT 'N/A',
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, region_id TEXT
+    )
+"""
+
+
+def _description(rng):
+    words = rng.choices(WORDS, k=rng.randint(6, 20))
+    if rng.random() < 0.001:
+        words.insert(rng.randrange(len(words)), rng.choice(RARE))
+    return ' '.join(words)
+
+
+def _rows(rng, n):
+    for _ in range(n):
+        yield (1, 'user', 13 + rng.random(), 80 + rng.random(), _description(rng),
+               rng.choice(('pending', 'pending', 'assigned', 'resolved')))
+
+
+def _open(path, with_index):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(SCHEMA)
+    conn.execute("CREATE TABLE resources (id INTEGER PRIMARY KEY, resource_name TEXT, quantity INTEGER, status TEXT)")
+    if with_index:
+        db_config.ensure_search_indexes(conn.cursor())
+    conn.commit()
+    return conn
+
+
+def bench_inserts(path, n=2000, seed=1):
+    """Single-row insert + commit, as the SOS form does, with and without the FTS triggers."""
+    for with_index in (False, True):
+        conn = _open(path, with_index)
+        rng = random.Random(seed)
+        conn.executemany("INSERT INTO sos_requests (user_id, username, latitude, longitude, description, status) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", _rows(rng, 50000))  # Non-empty table / index
+        conn.commit()
+        timings = []
+        for row in _rows(rng, n):
+            t0 = time.perf_counter()
+            conn.execute("INSERT INTO sos_requests (user_id, username, latitude, longitude, description, status) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", row)
+            conn.commit()
+            timings.append(time.perf_counter() - t0)
+        conn.close()
+        timings.sort()
+        print(f"  insert+commit {'with FTS triggers' if with_index else 'no FTS index    '} | "
+              f"p50 {1e3 * timings[n // 2]:6.3f} ms | p99 {1e3 * timings[int(n * 0.99)]:6.3f} ms")
+
+
+def bench_queries(path, rows, seed=2):
+    conn = _open(path, with_index=True)
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    for start in range(0, rows, 100000):
+        conn.executemany("INSERT INTO sos_requests (user_id, username, latitude, longitude, description, status) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", _rows(rng, min(100000, rows - start)))
+        conn.commit()
+    conn.execute("INSERT INTO sos_fts (sos_fts) VALUES ('optimize')")
+    conn.commit()
+    print(f"  loaded {rows:,} SOS rows (indexed by trigger) in {time.perf_counter() - t0:.1f}s, "
+          f"db {os.path.getsize(path) / 2 ** 20:.0f} MB")
+
+    cursor = conn.cursor()
+    cases = [
+        ("rare term", dict(query="snakebite")),
+        ("rare prefix", dict(query="ventil")),
+        ("two terms", dict(query="insulin dialysis")),
+        ("phrase", dict(query='"trapped roof" children')),
+        ("filtered", dict(query="pacemaker", status="pending")),
+        ("common, recent", dict(query="water", order="recent")),
+        ("common, ranked", dict(query="water flood rescue boat oxygen")),
+    ]
+    for name, kwargs in cases:
+        timings, page = [], None
+        for _ in range(20):
+            t0 = time.perf_counter()
+            page = search_sos(cursor, limit=20, **kwargs)
+            timings.append(time.perf_counter() - t0)
+        next_ms = None
+        if page['next_cursor']:
+            t0 = time.perf_counter()
+            search_sos(cursor, limit=20, after=page['next_cursor'], **kwargs)
+            next_ms = 1e3 * (time.perf_counter() - t0)
+        timings.sort()
+        print(f"  {name:<15} {kwargs['query']!r:<35} | p50 {1e3 * timings[10]:8.2f} ms | "
+              f"p95 {1e3 * timings[18]:8.2f} ms | next page "
+              f"{'-' if next_ms is None else f'{next_ms:.2f} ms'} | {len(page['results'])} hits")
+    conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FTS5 search and insert benchmark")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'bench_search.db'))
+    args = parser.parse_args(argv)
+    print(f"SQLite {sqlite3.sqlite_version}")
+    print("SOS insert latency:")
+    bench_inserts(args.db)
+    print("Search latency:")
+    bench_queries(args.db, args.rows)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# bench_shards.py - SOS write throughput versus number of regional shards
+#
+# For each shard count, a fresh database set is created in a temp directory and
+# W writer processes insert SOS requests as the SOS form does (one transaction
+# per report: id allocation, insert, incident clustering, version bump, commit),
+# spread round-robin over R regions that are placed evenly on the shards.
+# Processes, not threads, so every writer contends only for SQLite's file lock.
+#
+# Run: python bench_shards.py [--shards 1 2 4] [--writers 8] [--inserts 500] [--regions 16]
+#                             [--hold-ms 5] [--journal delete|wal] [--synchronous FULL|NORMAL|OFF]
+#
+# Sharding relieves the per-file write lock, so it only shows where that lock is
+# the bottleneck: while a transaction holds it, other writers of the same file
+# wait. On a fast SSD with few CPUs the lock is held for well under a millisecond
+# and the writers are CPU bound instead, so every shard count measures the same.
+# --hold-ms keeps the lock for that long per transaction (default 5 ms, a slow
+# SD card / network disk fsync; 0 = SQLite's own work only). The header line
+# reports the conditions measured: CPUs, journal and sync mode, and this disk's
+# own commit latency. Measured on one CPU, SSD-backed /tmp (0.5 ms commits),
+# 8 writers x 150 inserts, inserts/s for 1 / 2 / 4 shards:
+#   --hold-ms 0                          313 / 311 / 348  (CPU bound: x1.11)
+#   --hold-ms 5                          110 / 168 / 254  (x2.31, then CPU bound)
+#   --hold-ms 5 --journal wal --synchronous NORMAL   125 / 193 / 275  (x2.20)
+# More CPUs (or a slower disk) let the 4-shard run get closer to x4.
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+WORDS = "water flood rising roof trapped family children elderly injured insulin boat rescue".split()
+
+
+def _setup(workdir, shards):
+    """Point db_config at workdir (it initialises the files on import)."""
+    os.chdir(workdir)
+    os.environ['DB_SHARDS'] = ','.join(f"shard{k}.db" for k in range(1, shards))
+
+
+def _init(workdir, shards, regions, journal):
+    _setup(workdir, shards)
+    from db_config import get_db_connection
+    conn = get_db_connection()
+    conn.executemany("INSERT OR REPLACE INTO region_shards (region_id, shard) VALUES (?, ?)",
+                     [(f"R{r}", r % shards) for r in range(regions)])
+    conn.commit()
+    conn.close()
+    for shard in range(shards):  # journal_mode is stored in the file (WAL) or per connection (others)
+        conn = get_db_connection(shard)
+        conn.execute(f"PRAGMA journal_mode={journal}")
+        conn.close()
+
+
+def commit_latency(directory, journal, synchronous, commits=50):
+    """Mean ms per one-row commit by a single writer on this disk."""
+    import sqlite3
+    path = os.path.join(directory, 'latency.db')
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode={journal}")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute("CREATE TABLE t (v INTEGER)")
+    conn.commit()
+    t0 = time.perf_counter()
+    for i in range(commits):
+        conn.execute("INSERT INTO t (v) VALUES (?)", (i,))
+        conn.commit()
+    elapsed = time.perf_counter() - t0
+    conn.close()
+    return 1000 * elapsed / commits
+
+
+def _writer(workdir, shards, worker, inserts, regions, hold, journal, synchronous, import_lock, ready, go, results):
+    _setup(workdir, shards)
+    import random
+    with import_lock:  # Importing db_config migrates the schema: one process at a time
+        from shard_router import connect_region, allocate_sos_ids
+        from sos_read_model import bump_sos_version
+        from sos_clustering import assign_incident
+    rng = random.Random(worker)
+    ready.put(worker)
+    go.wait()
+    t0, busy = time.perf_counter(), 0
+    for i in range(inserts):
+        region_id = f"R{(worker + i) % regions}"
+        lat, lng = 10 + rng.random() * 10, 75 + rng.random() * 10
+        description = ' '.join(rng.choices(WORDS, k=8))
+        while True:
+            conn = connect_region(region_id)
+            conn.execute(f"PRAGMA journal_mode={journal}")
+            conn.execute(f"PRAGMA synchronous={synchronous}")
+            cursor = conn.cursor()
+            try:
+                sos_id = allocate_sos_ids(cursor)
+                cursor.execute("""
+                    INSERT INTO sos_requests (id, user_id, username, latitude, longitude, description, status,
+                                              risk_level, timestamp, region_id)
+                    VALUES (?, 1, 'bench', ?, ?, ?, 'pending', 'Low', datetime('now'), ?)
+                """, (sos_id, lat, lng, description, region_id))
+                assign_incident(cursor, sos_id, lat, lng, description, 'Low')
+                bump_sos_version(cursor)
+                if hold:
+                    time.sleep(hold)  # Still holding this shard's write lock
+                conn.commit()
+                break
+            except Exception as e:
+                if 'locked' not in str(e):
+                    raise
+                conn.rollback()
+                busy += 1  # Waited past the busy timeout; retry
+            finally:
+                conn.close()
+    results.put((t0, time.perf_counter(), inserts, busy))
+
+
+def bench(shards, writers, inserts, regions, hold=0.0, journal='delete', synchronous='FULL'):
+    ctx = multiprocessing.get_context('spawn')  # Fresh interpreter: db_config reads DB_SHARDS on import
+    workdir = tempfile.mkdtemp(prefix='bench_shards_')
+    try:
+        init = ctx.Process(target=_init, args=(workdir, shards, regions, journal))
+        init.start()
+        init.join()
+        ready, results, go, import_lock = ctx.Queue(), ctx.Queue(), ctx.Event(), ctx.Lock()
+        procs = [ctx.Process(target=_writer,
+                             args=(workdir, shards, w, inserts, regions, hold, journal, synchronous,
+                                   import_lock, ready, go, results))
+                 for w in range(writers)]
+        for p in procs:
+            p.start()
+        for _ in procs:
+            ready.get(timeout=120)
+        go.set()
+        runs = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    elapsed = max(end for _, end, _, _ in runs) - min(start for start, _, _, _ in runs)
+    total = sum(count for _, _, count, _ in runs)
+    return total / elapsed, sum(busy for _, _, _, busy in runs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SOS write throughput by shard count")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--inserts', type=int, default=500, help="SOS inserts per writer")
+    parser.add_argument('--regions', type=int, default=16)
+    parser.add_argument('--hold-ms', type=float, default=5.0,
+                        help="extra ms each transaction holds its shard's write lock (slow-disk fsync); 0 = none")
+    parser.add_argument('--journal', default='delete', choices=['delete', 'wal'],
+                        help="SQLite journal mode (the app runs with the default, delete)")
+    parser.add_argument('--synchronous', default='FULL', choices=['FULL', 'NORMAL', 'OFF'],
+                        help="SQLite sync mode (the app runs with the default, FULL)")
+    args = parser.parse_args(argv)
+    latency_dir = tempfile.mkdtemp(prefix='bench_shards_')
+    try:
+        latency = commit_latency(latency_dir, args.journal, args.synchronous)
+    finally:
+        shutil.rmtree(latency_dir, ignore_errors=True)
+    cpus = os.cpu_count() or 1
+    print(f"{args.writers} writer processes x {args.inserts} SOS inserts over {args.regions} regions")
+    print(f"conditions: {cpus} CPU{'s' if cpus > 1 else ''}, journal={args.journal}, "
+          f"synchronous={args.synchronous}, measured commit {latency:.2f} ms on {tempfile.gettempdir()}, "
+          f"lock held +{args.hold_ms:g} ms per transaction")
+    if args.hold_ms == 0 and latency < 1 and args.writers > cpus:
+        print("  ⚠️ Fast commits and more writers than CPUs: CPU bound, expect the same rate at every shard count")
+    baseline = None
+    for shards in args.shards:
+        rate, busy = bench(shards, args.writers, args.inserts, args.regions,
+                           args.hold_ms / 1000.0, args.journal, args.synchronous)
+        baseline = baseline or rate
+        print(f"  {shards} shard{'s' if shards > 1 else ' '} | {rate:8.0f} inserts/s | "
+              f"x{rate / baseline:4.2f} | busy retries {busy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# bench_socketio.py - Socket.IO concurrency benchmark for one server worker
+#
+# Starts a local server on the shared extensions.socketio instance in the chosen
+# async mode, opens N simulated websocket clients that join 'volunteer-room'
+# (as the dashboards do) and reports:
+#   - connection capacity (clients connected / attempted, connect time)
+#   - broadcast latency percentiles (server emit -> client receive)
+#   - resident memory per connection on the server
+# Optionally keeps the server busy with blocking sqlite calls routed through
+# run_blocking() to show that broadcasts are not stalled by them.
+#
+# Run:
+#   python bench_socketio.py --clients 2000 --mode eventlet
+#   python bench_socketio.py --clients 500 --mode threading --blocking-calls 20
+#
+# Client side needs `pip install "python-socketio[asyncio_client]"` (aiohttp).
+# All clients run on one asyncio loop in one process; past a few thousand
+# clients that process, not the server, dominates the latency figures.
+import os
+import sys
+import time
+import json
+import argparse
+import resource
+import subprocess
+
+
+# ---- server ----------------------------------------------------------------------
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def serve(port, mode, max_connections):
+    os.environ['SOCKETIO_ASYNC_MODE'] = mode
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    import sqlite3
+    from flask import Flask, request, jsonify
+    from flask_socketio import join_room
+    from extensions import socketio, run_blocking
+
+    app = Flask(__name__)
+    socketio.init_app(app)
+    connected = {'count': 0}
+
+    @socketio.on('connect')
+    def on_connect():
+        connected['count'] += 1
+        join_room('volunteer-room')
+
+    @socketio.on('disconnect')
+    def on_disconnect(*args):
+        connected['count'] -= 1
+
+    @app.route('/bench/stats')
+    def stats():
+        return jsonify({'rss': _rss_bytes(), 'clients': connected['count'], 'async_mode': socketio.async_mode})
+
+    @app.route('/bench/broadcast', methods=['POST'])
+    def broadcast():
+        socketio.emit('bench_ping', {'seq': int(request.args['seq']), 'sent': time.time()}, room='volunteer-room')
+        return jsonify({'ok': True})
+
+    def _slow_query(rows):
+        conn = sqlite3.connect(':memory:')
+        try:
+            return conn.execute("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT ?) "
+                                "SELECT count(*) FROM c", (rows,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    @app.route('/bench/blocking', methods=['POST'])
+    def blocking():
+        return jsonify({'rows': run_blocking(_slow_query, int(request.args.get('rows', 2000000)))})
+
+    print(json.dumps({'ready': port}), flush=True)
+    options = {'max_size': max_connections} if mode == 'eventlet' else {}
+    socketio.run(app, host='127.0.0.1', port=port, log_output=False, allow_unsafe_werkzeug=True, **options)
+
+
+# ---- clients ---------------------------------------------------------------------
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+async def run_clients(args, base_url):
+    import asyncio
+    import aiohttp
+    import socketio
+
+    latencies = []
+    received = {}
+    clients = []
+    sem = asyncio.Semaphore(args.connect_concurrency)
+
+    async with aiohttp.ClientSession() as http:
+        async def get_stats():
+            async with http.get(f"{base_url}/bench/stats") as resp:
+                return await resp.json()
+
+        base = await get_stats()
+
+        async def connect_one():
+            client = socketio.AsyncClient(reconnection=False)
+
+            @client.on('bench_ping')
+            async def on_ping(data):
+                latencies.append(time.time() - data['sent'])
+                received[data['seq']] = received.get(data['seq'], 0) + 1
+
+            async with sem:
+                try:
+                    await asyncio.wait_for(client.connect(base_url, transports=['websocket'], wait_timeout=args.timeout),
+                                           args.timeout)
+                    clients.append(client)
+                except Exception:
+                    pass
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(connect_one() for _ in range(args.clients)))
+        connect_secs = time.perf_counter() - t0
+        await asyncio.sleep(1.0)
+        loaded = await get_stats()
+
+        async def blocking_load():
+            async with http.post(f"{base_url}/bench/blocking?rows={args.blocking_rows}") as resp:
+                await resp.read()
+
+        background = [asyncio.ensure_future(blocking_load()) for _ in range(args.blocking_calls)]
+        fanout = []
+        for seq in range(args.broadcasts):
+            started = time.perf_counter()
+            async with http.post(f"{base_url}/bench/broadcast?seq={seq}") as resp:
+                await resp.read()
+            deadline = started + args.timeout
+            while received.get(seq, 0) < len(clients) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.001)
+            fanout.append(time.perf_counter() - started)
+            await asyncio.sleep(args.interval)
+        await asyncio.gather(*background, return_exceptions=True)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(c.disconnect() for c in clients), return_exceptions=True),
+                                   args.timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    lat_ms = sorted(1000 * v for v in latencies)
+    expected = len(clients) * args.broadcasts
+    n = max(1, loaded['clients'])
+    return {
+        'async_mode': loaded['async_mode'],
+        'clients_attempted': args.clients,
+        'clients_connected': len(clients),
+        'connect_seconds': round(connect_secs, 2),
+        'deliveries': f"{len(latencies)}/{expected}",
+        'latency_ms': {p: round(_percentile(lat_ms, p), 2) for p in (50, 95, 99, 100)},
+        'fanout_ms_p50': round(1000 * sorted(fanout)[len(fanout) // 2], 2) if fanout else None,
+        'server_rss_mb': round(loaded['rss'] / 2 ** 20, 1),
+        'kb_per_connection': round((loaded['rss'] - base['rss']) / 1024 / n, 1),
+        'blocking_calls': args.blocking_calls,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Socket.IO concurrency benchmark")
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--mode', default='eventlet', choices=['eventlet', 'gevent', 'threading'])
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--broadcasts', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.1, help="seconds between broadcasts")
+    parser.add_argument('--connect-concurrency', type=int, default=200)
+    parser.add_argument('--blocking-calls', type=int, default=0, help="concurrent blocking sqlite calls during broadcasts")
+    parser.add_argument('--blocking-rows', type=int, default=2000000)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--max-connections', type=int, default=10000, help="eventlet server greenthread pool size")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        return serve(args.port, args.mode, args.max_connections)
+
+    import asyncio
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))  # Server inherits it too
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve',
+                               '--port', str(args.port), '--mode', args.mode,
+                               '--max-connections', str(args.max_connections)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        server.stdout.readline()  # {"ready": port}
+        time.sleep(0.5)
+        result = asyncio.run(run_clients(args, f"http://127.0.0.1:{args.port}"))
+        print(json.dumps(result, indent=2))
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench_tracking.py - Volunteer location ping throughput in one worker
+# Run: python bench_tracking.py [--volunteers 20000] [--pings 400000] [--batch 1] [--threads 1]
+#
+# Simulated volunteers walk / drive around a region and every ping goes through
+# VolunteerTracker.ingest (validation, position store + geocell index, trail
+# downsampling), as the HTTP endpoint and socket event call it, minus the
+# request handling. Also reports the cost of one admin delta drain, a nearby()
+# query, and the trail flush of the kept points into a scratch SQLite file.
+import os
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+
+def _walkers(count, rng):
+    return [[18 + rng.random() * 4, 72 + rng.random() * 6, rng.choice((0.00001, 0.0001, 0.0003))]
+            for _ in range(count)]
+
+
+def _pings(walkers, total, batch, start, rng):
+    """[(username, [ping, ...])], every volunteer advancing one step per round."""
+    work, t = [], start
+    while len(work) * batch < total:
+        t += 1.0
+        for v, walker in enumerate(walkers):
+            pings = []
+            for k in range(batch):
+                walker[0] += (rng.random() - 0.5) * walker[2]
+                walker[1] += (rng.random() - 0.5) * walker[2]
+                pings.append({'latitude': walker[0], 'longitude': walker[1], 'timestamp': t + k * 0.01})
+            work.append((f"volunteer{v}", pings))
+            if len(work) * batch >= total:
+                break
+    return work
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Volunteer location ping throughput")
+    parser.add_argument('--volunteers', type=int, default=20000)
+    parser.add_argument('--pings', type=int, default=400000)
+    parser.add_argument('--batch', type=int, default=1, help="pings per request (offline buffer uploads)")
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='bench_tracking_')
+    os.chdir(workdir)  # db_config creates drms.db here on import
+    from volunteer_tracking import VolunteerTracker
+    tracker = VolunteerTracker()
+    tracker._started = True  # No background pushes: drain / flush are timed below
+
+    rng = random.Random(1)
+    now = time.time()
+    start = now - args.pings // (args.volunteers * args.batch) - 2  # Last round lands just before `now`
+    work = _pings(_walkers(args.volunteers, rng), args.pings, args.batch, start, rng)
+    chunks = [work[i::args.threads] for i in range(args.threads)]
+
+    def run(chunk):
+        for username, pings in chunk:
+            tracker.ingest(username, pings, now=now)
+
+    threads = [threading.Thread(target=run, args=(chunk,)) for chunk in chunks]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stats = tracker.stats()
+    print(f"{args.volunteers} volunteers, {stats['pings']} pings in batches of {args.batch}, {args.threads} thread(s)")
+    print(f"  ingest        {stats['pings'] / elapsed:10.0f} pings/s  ({1e6 * elapsed / stats['pings']:.2f} us/ping)")
+    print(f"  trail kept    {stats['trail_kept']:10d} ({100.0 * stats['trail_kept'] / stats['pings']:.1f}% of pings)")
+
+    t0 = time.perf_counter()
+    rows, offline = tracker.positions.drain(now=now)
+    print(f"  delta drain   {1e3 * (time.perf_counter() - t0):10.2f} ms  ({len(rows)} moved, {len(offline)} offline)")
+    t0 = time.perf_counter()
+    for _ in range(100):
+        found = tracker.positions.nearby(20, 75, radius_km=5, now=now)
+    print(f"  nearby(5 km)  {1e3 * (time.perf_counter() - t0) / 100:10.3f} ms  ({len(found)} found)")
+    t0 = time.perf_counter()
+    written = tracker.trails.flush()
+    print(f"  trail flush   {1e3 * (time.perf_counter() - t0):10.1f} ms  ({written} rows, one transaction)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, flash, session, redirect, url_for
 from db_config import get_db_connection
+from rate_limit import rate_limited
 from flask_socketio import emit  # For real-time emit (optional)
 import logging
 from datetime import datetime
@@ -25,6 +26,7 @@ def generate_ai_response(message):
         return "I'm sorry, I don't have specific advice for that. For emergencies, submit an SOS or contact local authorities. What else can I help with?"
 
 @chatbot_bp.route('/', methods=['GET', 'POST'])
+@rate_limited('chatbot')
 def chatbot():
     if 'username' not in session:
         flash("Please login first to use the chatbot.", "danger")
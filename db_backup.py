@@ -0,0 +1,281 @@
+# db_backup.py - Online backups of the SQLite databases without pausing SOS intake
+#
+# Every database file (drms.db, each regional shard, SOS_ARCHIVE_DB if set) is
+# copied with SQLite's online backup API, BACKUP_PAGES_PER_STEP pages per step.
+# Each step holds a read lock for well under a millisecond, and the copier
+# sleeps BACKUP_STEP_PAUSE between steps so queued writers get the file. The
+# copy is checked (PRAGMA quick_check) and gzipped into BACKUP_DIR as
+# <name>-<UTC stamp>.db.gz; all files of one run share the stamp and form one
+# snapshot. Only the newest BACKUP_KEEP snapshots are kept.
+#
+# A commit from another connection between steps makes SQLite restart the
+# copy. Each restart doubles the step size (fewer pauses for a write to land
+# in); after BACKUP_MAX_RESTARTS the file is copied in a single step, holding
+# the read lock for the whole copy while writers wait on their busy timeout.
+# bench_backup.py measures the effect on concurrent SOS inserts. A database in
+# WAL mode is always copied in one step: its readers don't block writers.
+#
+# Files are copied one after another, so a snapshot is consistent per file,
+# not across shards.
+#
+# Usage:
+#   start_backups()                         # background thread (call once at app startup)
+#   python db_backup.py --once              # take a snapshot now
+#   python db_backup.py --list
+#   python db_backup.py --restore [TIME]    # latest snapshot, or the newest at/before TIME (app stopped)
+import os
+import re
+import gzip
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from db_config import SHARD_FILES
+from sos_archive import ARCHIVE_DB
+from extensions import run_blocking
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 24))  # Snapshots retained
+BACKUP_INTERVAL_SECONDS = float(os.environ.get('BACKUP_INTERVAL_SECONDS', 3600))
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', 0.005))  # Seconds between steps
+BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 5))
+COMPRESS_LEVEL = 6
+STAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+_SNAPSHOT_RE = re.compile(r'^(?P<name>.+)-(?P<stamp>\d{8}T\d{6}Z)\.db\.gz$')
+
+_backup_thread = None
+_run_lock = threading.Lock()  # One snapshot at a time
+last_run = {}                 # Summary of the latest snapshot attempt (admin status endpoint)
+
+
+class BackupError(RuntimeError):
+    """A copy failed its integrity check or no snapshot matches."""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def database_files():
+    """{snapshot name: live path} for every database that is backed up."""
+    paths = list(SHARD_FILES) + ([ARCHIVE_DB] if ARCHIVE_DB else [])
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in paths}
+
+
+def copy_database(source_path, dest_path, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE,
+                  max_restarts=BACKUP_MAX_RESTARTS):
+    """Online copy of one SQLite file into dest_path. Returns page / step / restart counts."""
+    stats = {'pages': 0, 'steps': 0, 'restarts': 0, 'pages_per_step': pages, 'single_step': False}
+    remaining_before = [None]
+
+    def progress(status, remaining, total):
+        stats['steps'] += 1
+        stats['pages'] = total
+        if remaining_before[0] is not None and remaining > remaining_before[0]:
+            raise _Restarted()  # Source changed under us: SQLite started over
+        remaining_before[0] = remaining
+        if remaining:
+            time.sleep(pause)  # Let writers in between steps
+
+    source = sqlite3.connect(source_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        if source.execute("PRAGMA journal_mode").fetchone()[0].lower() == 'wal':
+            pages = -1
+        while pages > 0:
+            remaining_before[0] = None
+            try:
+                source.backup(dest, pages=pages, progress=progress, sleep=pause)  # sleep: retry delay when busy
+                break
+            except _Restarted:
+                stats['restarts'] += 1
+                if stats['restarts'] > max_restarts:
+                    logger.warning(f"⚠️ Backup of {source_path} restarted {max_restarts} times; copying in one step")
+                    pages = -1
+                else:
+                    pages = stats['pages_per_step'] = pages * 2
+        if pages <= 0:
+            stats['single_step'] = True
+            source.backup(dest, pages=-1, sleep=pause)
+        result = dest.execute("PRAGMA quick_check").fetchone()[0]
+        if result != 'ok':
+            raise BackupError(f"Backup of {source_path} failed quick_check: {result}")
+    finally:
+        source.close()
+        dest.close()
+    return stats
+
+
+def _compress(path, dest, level=COMPRESS_LEVEL):
+    """gzip path into dest atomically."""
+    tmp = dest + '.tmp'
+    try:
+        with open(path, 'rb') as src, gzip.open(tmp, 'wb', compresslevel=level) as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _remove(path):
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    """[{'stamp', 'files': {name: path}, 'bytes'}], oldest first."""
+    snapshots = {}
+    if os.path.isdir(backup_dir):
+        for filename in os.listdir(backup_dir):
+            m = _SNAPSHOT_RE.match(filename)
+            if m:
+                snapshots.setdefault(m.group('stamp'), {})[m.group('name')] = os.path.join(backup_dir, filename)
+    return [{'stamp': stamp, 'files': files, 'bytes': sum(os.path.getsize(p) for p in files.values())}
+            for stamp, files in sorted(snapshots.items())]
+
+
+def prune_snapshots(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Delete all but the newest `keep` snapshots. Returns how many were deleted."""
+    old = list_snapshots(backup_dir)[:-keep] if keep > 0 else []
+    for snapshot in old:
+        for path in snapshot['files'].values():
+            os.remove(path)
+    return len(old)
+
+
+def take_snapshot(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Back up every database under one UTC stamp, then apply retention. Returns a summary."""
+    with _run_lock:
+        os.makedirs(backup_dir, exist_ok=True)
+        started = time.time()
+        stamp = datetime.utcnow().strftime(STAMP_FORMAT)
+        summary = {'stamp': stamp, 'files': {}, 'error': None}
+        try:
+            for name, path in database_files().items():
+                if not os.path.exists(path):
+                    continue
+                copy = os.path.join(backup_dir, f".tmp-{name}-{stamp}.db")
+                try:
+                    t0 = time.perf_counter()
+                    stats = copy_database(path, copy)
+                    stats['copy_seconds'] = round(time.perf_counter() - t0, 3)
+                    _compress(copy, os.path.join(backup_dir, f"{name}-{stamp}.db.gz"))
+                    stats['compressed_bytes'] = os.path.getsize(os.path.join(backup_dir, f"{name}-{stamp}.db.gz"))
+                finally:
+                    _remove(copy)
+                summary['files'][name] = stats
+            summary['pruned'] = prune_snapshots(backup_dir, keep)
+        except Exception as e:
+            summary['error'] = str(e)
+            raise
+        finally:
+            summary['seconds'] = round(time.time() - started, 3)
+            last_run.clear()
+            last_run.update(summary)
+    logger.info(f"✅ Snapshot {stamp}: {len(summary['files'])} databases in {summary['seconds']}s")
+    return summary
+
+
+def _parse_time(value):
+    """Snapshot stamp or ISO date/time (UTC) -> stamp string for comparison."""
+    try:
+        return datetime.strptime(value, STAMP_FORMAT).strftime(STAMP_FORMAT)
+    except ValueError:
+        return datetime.fromisoformat(value).strftime(STAMP_FORMAT)
+
+
+def find_snapshot(at=None, backup_dir=BACKUP_DIR):
+    """Latest snapshot, or the newest one taken at or before `at`."""
+    snapshots = list_snapshots(backup_dir)
+    if at is not None:
+        limit = _parse_time(at)
+        snapshots = [s for s in snapshots if s['stamp'] <= limit]
+    if not snapshots:
+        raise BackupError(f"No snapshot in {backup_dir}" + (f" at or before {at}" if at else ""))
+    return snapshots[-1]
+
+
+def restore_snapshot(at=None, backup_dir=BACKUP_DIR):
+    """Write a snapshot back over the live databases. Stop the app first. Returns the stamp restored.
+
+    Each file is decompressed and checked, then copied in with the backup
+    API, which takes the target's write lock (no torn files, no stale -wal).
+    """
+    snapshot = find_snapshot(at, backup_dir)
+    targets = database_files()
+    for name in set(targets) - set(snapshot['files']):
+        logger.warning(f"⚠️ Snapshot {snapshot['stamp']} has no copy of {targets[name]}; left as is")
+    for name, path in snapshot['files'].items():
+        target = targets.get(name)
+        if target is None:
+            logger.warning(f"⚠️ {path} matches no configured database; skipped")
+            continue
+        staged = os.path.join(backup_dir, f".restore-{name}.db")
+        try:
+            with gzip.open(path, 'rb') as src, open(staged, 'wb') as out:
+                shutil.copyfileobj(src, out, 1 << 20)
+            source = sqlite3.connect(staged)
+            dest = sqlite3.connect(target)
+            try:
+                result = source.execute("PRAGMA quick_check").fetchone()[0]
+                if result != 'ok':
+                    raise BackupError(f"{path} failed quick_check: {result}")
+                source.backup(dest)
+            finally:
+                source.close()
+                dest.close()
+        finally:
+            _remove(staged)
+        logger.info(f"✅ Restored {target} from {path}")
+    return snapshot['stamp']
+
+
+def start_backups(interval=BACKUP_INTERVAL_SECONDS):
+    """Start the background snapshot thread (idempotent)."""
+    global _backup_thread
+    if _backup_thread and _backup_thread.is_alive():
+        return _backup_thread
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            try:
+                run_blocking(take_snapshot)  # Native thread under eventlet/gevent
+            except Exception as e:
+                logger.error(f"Database snapshot failed: {e}")
+
+    _backup_thread = threading.Thread(target=_loop, name='db-backup', daemon=True)
+    _backup_thread.start()
+    logger.info(f"Database backups started (every {interval}s into {BACKUP_DIR}, keeping {BACKUP_KEEP})")
+    return _backup_thread
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Online SQLite backups and restore")
+    parser.add_argument('--once', action='store_true', help="take one snapshot and exit")
+    parser.add_argument('--list', action='store_true', help="list snapshots")
+    parser.add_argument('--restore', nargs='?', const='', metavar='TIME',
+                        help="restore the latest snapshot, or the newest at/before TIME (stop the app first)")
+    parser.add_argument('--dir', default=BACKUP_DIR)
+    args = parser.parse_args()
+    if args.once:
+        summary = take_snapshot(args.dir)
+        print(f"✅ Snapshot {summary['stamp']} written to {args.dir}")
+    if args.list:
+        for snapshot in list_snapshots(args.dir):
+            print(f"{snapshot['stamp']}  {snapshot['bytes'] / 2 ** 20:8.1f} MB  {', '.join(sorted(snapshot['files']))}")
+    if args.restore is not None:
+        print(f"✅ Restored snapshot {restore_snapshot(args.restore or None, args.dir)}")
+    if not (args.once or args.list or args.restore is not None):
+        start_backups()
+        while True:
+            time.sleep(BACKUP_INTERVAL_SECONDS)
@@ -8,9 +8,21 @@ logger = logging.getLogger(__name__)
 # Database file path
 DATABASE = 'drms.db'
 
-def get_db_connection():
-    """Get a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE)
+# Regional shards (see shard_router.py): extra SQLite files, each holding the SOS
+# data (sos_requests, incidents, notifications) of the regions mapped to it, with
+# its own writer lock. drms.db is always shard 0 and keeps everything else
+# (users, resources, deliveries, regions, the shard map). Unset = one file.
+DB_SHARDS = [path.strip() for path in os.environ.get('DB_SHARDS', '').split(',') if path.strip()]
+SHARD_FILES = [DATABASE] + DB_SHARDS
+SHARD_ID_SPAN = 1 << 26  # SOS / incident ids of shard k start above k * SHARD_ID_SPAN (ids stay < 2**32)
+
+def get_db_connection(shard=0):
+    """Get a connection to the SQLite database (shard > 0: one regional shard file).
+    
+    Shard files only hold SOS tables. They are deliberately not ATTACHed to
+    drms.db: a write transaction would then lock the home file as well.
+    """
+    conn = sqlite3.connect(SHARD_FILES[shard])
     conn.row_factory = sqlite3.Row  # Allows dictionary-like access to rows
     return conn
 
@@ -30,7 +42,32 @@ def init_db():
         )
     ''')
     
-    # Create SOS requests table
+    create_sos_tables(cursor)
+    
+    # FIXED: Updated resources table schema for inventory management
+    # Drop existing table if it has the old schema to apply new one
+    cursor.execute("DROP TABLE IF EXISTS resources")
+    cursor.execute('''
+        CREATE TABLE resources (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            resource_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('Available', 'Low', 'Out of Stock')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    create_sos_version_table(cursor)
+    ensure_sos_columns(cursor)
+    ensure_home_tables(cursor)
+    ensure_search_indexes(cursor)
+    
+    conn.commit()
+    conn.close()
+    logger.info("✅ Database initialized successfully.")
+
+def create_sos_tables(cursor):
+    """SOS requests and notifications: the per-region tables (present in every shard)."""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS sos_requests (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -60,23 +97,190 @@ def init_db():
             FOREIGN KEY (sos_id) REFERENCES sos_requests (id)
         )
     ''')
+
+def create_sos_version_table(cursor):
+    """Single-row change counter for sos_requests (bumped on every SOS write).
     
-    # FIXED: Updated resources table schema for inventory management
-    # Drop existing table if it has the old schema to apply new one
-    cursor.execute("DROP TABLE IF EXISTS resources")
+    Process-local caches compare it against their own copy to detect writes made
+    by other workers (see sos_read_model.py).
+    """
     cursor.execute('''
-        CREATE TABLE resources (
+        CREATE TABLE IF NOT EXISTS sos_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO sos_version (id, version) VALUES (1, 0)")
+
+def ensure_sos_columns(cursor):
+    """Add columns introduced after the original sos_requests schema (dev migration)."""
+    cursor.execute("PRAGMA table_info(sos_requests)")
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'resolved_at' not in columns:
+        cursor.execute("ALTER TABLE sos_requests ADD COLUMN resolved_at TIMESTAMP DEFAULT NULL")
+        logger.info("✅ Added 'resolved_at' column to sos_requests.")
+    # Environmental inputs used for the risk prediction (training data for train_model.py)
+    for feature in ('rainfall', 'temperature', 'humidity'):
+        if feature not in columns:
+            cursor.execute(f"ALTER TABLE sos_requests ADD COLUMN {feature} REAL DEFAULT NULL")
+            logger.info(f"✅ Added '{feature}' column to sos_requests.")
+    if 'incident_id' not in columns:
+        cursor.execute("ALTER TABLE sos_requests ADD COLUMN incident_id INTEGER DEFAULT NULL")
+        logger.info("✅ Added 'incident_id' column to sos_requests.")
+    # Client-generated idempotency key for store-and-forward batch uploads (/sos/batch)
+    if 'client_key' not in columns:
+        cursor.execute("ALTER TABLE sos_requests ADD COLUMN client_key TEXT DEFAULT NULL")
+        logger.info("✅ Added 'client_key' column to sos_requests.")
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_sos_requests_client_key
+        ON sos_requests (user_id, client_key) WHERE client_key IS NOT NULL
+    ''')
+    
+    # Incidents group near-duplicate SOS reports (see sos_clustering.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS incidents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            resource_name TEXT NOT NULL,
-            quantity INTEGER NOT NULL,
-            status TEXT NOT NULL CHECK (status IN ('Available', 'Low', 'Out of Stock')),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            cell_row INTEGER NOT NULL,
+            cell_col INTEGER NOT NULL,
+            risk_level TEXT DEFAULT 'N/A',
+            report_count INTEGER NOT NULL DEFAULT 1,
+            signature TEXT,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sos_requests_incident ON sos_requests (incident_id)")
     
+    # Region stamped at ingest by the offline reverse geocoder (reverse_geocoder.py)
+    if 'region_id' not in columns:
+        cursor.execute("ALTER TABLE sos_requests ADD COLUMN region_id TEXT DEFAULT NULL")
+        logger.info("✅ Added 'region_id' column to sos_requests.")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sos_requests_region ON sos_requests (region_id, status)")
+    
+    # Unattended-SOS escalations (sos_escalation.py)
+    if 'escalation_level' not in columns:
+        cursor.execute("ALTER TABLE sos_requests ADD COLUMN escalation_level INTEGER DEFAULT 0")
+        cursor.execute("ALTER TABLE sos_requests ADD COLUMN escalated_at TIMESTAMP DEFAULT NULL")
+        logger.info("✅ Added 'escalation_level' and 'escalated_at' columns to sos_requests.")
+    
+    # SOS status transition log for SLA metrics (sla_metrics.py); times in epoch seconds
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sos_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sos_id INTEGER NOT NULL,
+            from_status TEXT,
+            to_status TEXT NOT NULL,
+            actor TEXT,
+            region_id TEXT,
+            risk_level TEXT,
+            elapsed_seconds REAL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sos_events_sos ON sos_events (sos_id, id)")
+
+def ensure_home_tables(cursor):
+    """Tables that only exist in the home database (drms.db)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS regions (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            district TEXT,
+            level TEXT,
+            latitude REAL,
+            longitude REAL
+        )
+    ''')
+    # Shard map (shard_router.py): owning shard per region, and SOS rows reshard.py
+    # moved away from the shard their id was allocated in
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS region_shards (
+            region_id TEXT PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sos_locations (
+            sos_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+    ''')
+    # Downsampled volunteer GPS trails (volunteer_tracking.py), recorded_at in epoch seconds
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS volunteer_trails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            recorded_at REAL NOT NULL,
+            accuracy REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_volunteer_trails_user_time ON volunteer_trails (username, recorded_at)")
+
+def init_shard(shard):
+    """Create the SOS tables in a regional shard file and start its id ranges at shard * SHARD_ID_SPAN."""
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    create_sos_tables(cursor)
+    create_sos_version_table(cursor)
+    ensure_sos_columns(cursor)  # Also creates incidents
+    ensure_search_indexes(cursor, ('sos_fts',))
+    for table in ('sos_requests', 'incidents'):
+        cursor.execute("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)", (table, shard * SHARD_ID_SPAN))
+        elif row[0] < shard * SHARD_ID_SPAN:
+            cursor.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?", (shard * SHARD_ID_SPAN, table))
     conn.commit()
     conn.close()
-    logger.info("✅ Database initialized successfully.")
+
+# Full-text indexes (external-content FTS5 tables kept in sync by triggers, see search_index.py)
+SEARCH_INDEXES = {
+    'sos_fts': ('sos_requests', 'description'),
+    'resources_fts': ('resources', 'resource_name'),
+}
+
+def ensure_search_indexes(cursor, names=None):
+    """Create the FTS5 indexes and their sync triggers; rebuild an index whose triggers were missing."""
+    for fts, (table, column) in SEARCH_INDEXES.items():
+        if names is not None and fts not in names:
+            continue
+        try:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"{fts}_ai",))
+            in_sync = cursor.fetchone() is not None
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                    {column}, content='{table}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts} (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                    INSERT INTO {fts} (rowid, {column}) VALUES (new.id, new.{column});
+                END
+            ''')
+            if not in_sync:
+                # New index, or the content table was recreated (its triggers went with it)
+                cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+                logger.info(f"✅ Full-text index '{fts}' built over {table}.{column}.")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"⚠️ Full-text index '{fts}' unavailable (SQLite built without FTS5?): {e}")
+            return
 
 def ensure_users_schema():
     """Check and fix users table schema if needed (dev migration)."""
@@ -156,7 +360,16 @@ else:
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    create_sos_version_table(cursor)
+    ensure_sos_columns(cursor)
+    ensure_home_tables(cursor)
+    ensure_search_indexes(cursor)
     conn.commit()
     conn.close()
     logger.info("✅ Existing database 'resources' table schema updated.")
     create_default_users() # Ensure default users are still there
+
+for _shard in range(1, len(SHARD_FILES)):
+    init_shard(_shard)
+if DB_SHARDS:
+    logger.info(f"✅ {len(SHARD_FILES)} database shards ready: {', '.join(SHARD_FILES)}")
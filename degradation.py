@@ -0,0 +1,402 @@
+# degradation.py - Keep dashboards and SOS intake working while SQLite is locked or slow
+#
+# A circuit breaker watches the database calls routed through it. Calls that
+# fail with sqlite3.OperationalError (typically "database is locked" after the
+# busy timeout) or take longer than DB_SLOW_MS count against it; other errors
+# (a constraint violation, a bad record) say nothing about the database's
+# health and go to the caller as usual; BREAKER_FAILURES in
+# a row open it. While open, callers fail fast with DatabaseUnavailable instead
+# of queueing on the lock. After BREAKER_OPEN_SECONDS one probe call is let
+# through (half-open); success closes the breaker, failure re-opens it.
+#
+#   serve(key, compute)    dashboard / map data: compute() through the breaker,
+#                          remembering the last good result per key; on failure
+#                          or while open, that snapshot is returned with the
+#                          time it was taken so the page can mark it stale
+#   sos_spool.add(...)     SOS reports that cannot be stored now go to a local
+#                          spool file (its own SQLite database, so it is not
+#                          behind the same lock); a drainer thread replays them
+#                          through the batch ingest once the breaker lets calls
+#                          through. Each spooled report carries a client_key, so
+#                          a replay interrupted halfway is deduplicated. A report
+#                          that keeps failing for another reason is moved to the
+#                          sos_spool_dead table after SPOOL_MAX_ATTEMPTS replays,
+#                          so it cannot hold back everyone else's.
+#
+# Breaker state and snapshots are per worker process; the spool file is shared.
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DB_SLOW_MS = float(os.environ.get('DB_SLOW_MS', 1000))           # A call slower than this counts as a failure
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 3))     # Consecutive failures that open the breaker
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 10))
+SNAPSHOT_MAX_ENTRIES = int(os.environ.get('SNAPSHOT_MAX_ENTRIES', 2048))
+SOS_SPOOL_DB = os.environ.get('SOS_SPOOL_DB', 'sos_spool.db')
+SPOOL_DRAIN_INTERVAL = 2.0  # Seconds between drain attempts while reports are spooled
+SPOOL_DRAIN_BATCH = 200     # Reports replayed per user per attempt
+SPOOL_MAX_ATTEMPTS = int(os.environ.get('SPOOL_MAX_ATTEMPTS', 5))  # Failed replays before a report is dead-lettered
+EWMA_ALPHA = 0.2
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class DatabaseUnavailable(RuntimeError):
+    """The circuit breaker is open: the database is not being called."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker over database calls, with latency tracking."""
+
+    def __init__(self, failures=BREAKER_FAILURES, open_seconds=BREAKER_OPEN_SECONDS, slow_ms=DB_SLOW_MS):
+        self.failure_threshold = failures
+        self.open_seconds = open_seconds
+        self.slow_seconds = slow_ms / 1000.0
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.latency_ewma_ms = None
+        self.calls = self.failed = self.rejected = self.trips = 0
+        self.last_error = None
+
+    def allow(self):
+        """True if a call may go to the database now (claims the probe when half-open)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def _record(self, seconds, error=None):
+        with self._lock:
+            self.calls += 1
+            ms = seconds * 1000.0
+            self.latency_ewma_ms = ms if self.latency_ewma_ms is None else \
+                (1 - EWMA_ALPHA) * self.latency_ewma_ms + EWMA_ALPHA * ms
+            if error is None and seconds <= self.slow_seconds:
+                if self.state != CLOSED:
+                    logger.info(f"✅ Database responsive again ({ms:.0f} ms): circuit closed")
+                self.state = CLOSED
+                self._failures = 0
+                self._probing = False
+                return
+            self.failed += 1
+            self._failures += 1
+            self.last_error = str(error) if error is not None else f"slow call ({ms:.0f} ms)"
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    self.trips += 1
+                    logger.warning(f"⚠️ Database degraded ({self.last_error}): circuit open, serving snapshots")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def _release(self):
+        """A call ended with a non-database error: tells nothing about the DB, free the probe."""
+        with self._lock:
+            self._probing = False
+
+    def call(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) if the breaker allows it; OperationalErrors and slow calls are counted."""
+        if not self.allow():
+            raise DatabaseUnavailable(f"Database circuit open ({self.last_error})")
+        t0 = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            self._record(time.perf_counter() - t0, e)
+            raise
+        except BaseException:
+            self._release()
+            raise
+        self._record(time.perf_counter() - t0)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'latency_ewma_ms': None if self.latency_ewma_ms is None
+                    else round(self.latency_ewma_ms, 1), 'consecutive_failures': self._failures,
+                    'calls': self.calls, 'failed': self.failed, 'rejected': self.rejected, 'trips': self.trips,
+                    'last_error': self.last_error}
+
+
+class SnapshotStore:
+    """Last good value per key (LRU-bounded), with the time it was computed."""
+
+    def __init__(self, max_entries=SNAPSHOT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, saved_at epoch)
+        self.served_stale = 0
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.served_stale += 1
+            return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+
+breaker = CircuitBreaker()
+snapshots = SnapshotStore()
+
+
+def serve(key, compute, good=lambda value: True):
+    """(value, stale_since): compute() through the breaker, or the last good snapshot of key.
+
+    stale_since is None for fresh data, else the epoch time the snapshot was
+    taken. A value failing good() (e.g. an error response) is not stored and
+    is replaced by the snapshot when there is one. With no snapshot, the
+    error (or bad value) goes to the caller as before.
+    """
+    try:
+        value = breaker.call(compute)
+    except (DatabaseUnavailable, sqlite3.OperationalError) as e:
+        entry = snapshots.get(key)
+        if entry is None:
+            raise
+        logger.warning(f"⚠️ Serving stale {key[0] if isinstance(key, tuple) else key} "
+                       f"({time.time() - entry[1]:.0f}s old): {e}")
+        return entry
+    if good(value):
+        snapshots.put(key, value)
+        return value, None
+    return snapshots.get(key) or (value, None)
+
+
+def stale_notice(stale_since):
+    """Flash text for pages rendered from a snapshot."""
+    taken = time.strftime('%H:%M:%S', time.localtime(stale_since))
+    return (f"⚠️ The database is busy: showing data as of {taken}. New SOS reports are still accepted "
+            f"and will appear once it recovers.")
+
+
+class SosSpool:
+    """Local store-and-forward queue for SOS reports the database could not take."""
+
+    def __init__(self, path=SOS_SPOOL_DB):
+        self.path = path
+        self._ingest = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.spooled = self.drained = self.drain_failures = self.dead_lettered = 0
+        self._init()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")  # Spooling must not wait on a drain in another worker
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sos_spool (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    username TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    spooled_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )
+            """)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(sos_spool)")}
+            if 'attempts' not in columns:  # Spool files from before dead-lettering
+                conn.execute("ALTER TABLE sos_spool ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE sos_spool ADD COLUMN last_error TEXT")
+            # Reports that failed SPOOL_MAX_ATTEMPTS replays: kept for an operator, never replayed
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sos_spool_dead (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    username TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    spooled_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    failed_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def set_ingest(self, ingest):
+        """ingest(user_id, username, records): store them all (through the breaker) or raise."""
+        self._ingest = ingest
+
+    def add(self, user_id, username, record):
+        """Spool one report ({latitude, longitude, description, timestamp}). Returns its client_key."""
+        record = dict(record)
+        record.setdefault('client_key', f"spool-{uuid.uuid4().hex}")
+        conn = self._connect()
+        try:
+            conn.execute("INSERT INTO sos_spool (user_id, username, record, spooled_at) VALUES (?, ?, ?, ?)",
+                         (user_id, username, json.dumps(record), time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+        self.spooled += 1
+        logger.warning(f"⚠️ SOS from {username} spooled ({record['client_key']}): database unavailable")
+        self.start()
+        return record['client_key']
+
+    def pending(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM sos_spool").fetchone()[0]
+        finally:
+            conn.close()
+
+    def dead(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM sos_spool_dead").fetchone()[0]
+        finally:
+            conn.close()
+
+    def drain_once(self):
+        """Replay spooled reports (oldest users first) while the breaker allows. Returns reports stored."""
+        if self._ingest is None:
+            return 0
+        conn = self._connect()
+        try:
+            users = conn.execute("SELECT user_id, username FROM sos_spool GROUP BY user_id, username "
+                                 "ORDER BY MIN(id)").fetchall()
+        finally:
+            conn.close()
+        stored = 0
+        for user_id, username in users:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT id, record, attempts FROM sos_spool WHERE user_id = ? AND username = ? "
+                                    "ORDER BY id LIMIT ?", (user_id, username, SPOOL_DRAIN_BATCH)).fetchall()
+                if not rows:
+                    continue
+                done, failed, paused = self._replay(user_id, username, rows)
+                self._settle(conn, done, failed)
+                stored += len(done)
+            finally:
+                conn.close()
+            if paused is not None:
+                # Shards that did commit are deduplicated by client_key on the next attempt
+                self.drain_failures += 1
+                logger.info(f"SOS spool drain paused ({len(rows) - len(done)} reports from {username} kept): "
+                            f"{paused}")
+                break
+        if stored:
+            self.drained += stored
+            logger.info(f"✅ SOS spool: {stored} reports delivered to the database")
+        return stored
+
+    def _replay(self, user_id, username, rows):
+        """Ingest one user's spooled rows: (done rows, [(row, error)], error that paused the drain or None).
+
+        If the batch fails for a reason other than the database being unavailable,
+        the rows are replayed one by one so only the bad report is held back.
+        """
+        try:
+            self._ingest(user_id, username, [json.loads(row['record']) for row in rows])
+            return rows, [], None
+        except (DatabaseUnavailable, sqlite3.OperationalError) as e:
+            return [], [], e
+        except Exception as e:
+            if len(rows) == 1:
+                return [], [(rows[0], e)], None
+        done, failed = [], []
+        for row in rows:
+            try:
+                self._ingest(user_id, username, [json.loads(row['record'])])
+            except (DatabaseUnavailable, sqlite3.OperationalError) as e:
+                return done, failed, e
+            except Exception as e:
+                failed.append((row, e))
+            else:
+                done.append(row)
+        return done, failed, None
+
+    def _settle(self, conn, done, failed):
+        """Delete delivered rows; count a failed attempt on the others, dead-lettering exhausted ones."""
+        conn.executemany("DELETE FROM sos_spool WHERE id = ?", [(row['id'],) for row in done])
+        now = time.time()
+        for row, error in failed:
+            attempts = row['attempts'] + 1
+            if attempts < SPOOL_MAX_ATTEMPTS:
+                conn.execute("UPDATE sos_spool SET attempts = ?, last_error = ? WHERE id = ?",
+                             (attempts, str(error), row['id']))
+                logger.warning(f"⚠️ Spooled SOS {row['id']} failed replay {attempts}/{SPOOL_MAX_ATTEMPTS}: {error}")
+                continue
+            conn.execute("""
+                INSERT OR REPLACE INTO sos_spool_dead (id, user_id, username, record, spooled_at, attempts,
+                                                       last_error, failed_at)
+                SELECT id, user_id, username, record, spooled_at, ?, ?, ? FROM sos_spool WHERE id = ?
+            """, (attempts, str(error), now, row['id']))
+            conn.execute("DELETE FROM sos_spool WHERE id = ?", (row['id'],))
+            self.dead_lettered += 1
+            logger.error(f"❌ Spooled SOS {row['id']} moved to sos_spool_dead after {attempts} failed replays: "
+                         f"{error}")
+        conn.commit()
+
+    def _loop(self):
+        while True:
+            time.sleep(SPOOL_DRAIN_INTERVAL)
+            try:
+                if self.pending():
+                    self.drain_once()
+            except Exception as e:
+                logger.error(f"⚠️ SOS spool drain failed: {e}")
+
+    def start(self):
+        """Start the drainer thread (idempotent; also started by the first add())."""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return self._thread
+            self._thread = threading.Thread(target=self._loop, name='sos-spool', daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def stats(self):
+        return {'pending': self.pending(), 'spooled': self.spooled, 'drained': self.drained,
+                'drain_failures': self.drain_failures, 'dead_letters': self.dead(),
+                'dead_lettered': self.dead_lettered}
+
+
+sos_spool = SosSpool()
+
+
+def start_spool_drainer():
+    """Replay reports left in the spool by a previous run (call once at app startup)."""
+    return sos_spool.start()
+
+
+def stats():
+    return {'breaker': breaker.stats(), 'snapshots': len(snapshots), 'served_stale': snapshots.served_stale,
+            'spool': sos_spool.stats()}
@@ -1,5 +1,49 @@
 
 # extensions.py - NEW: Shared SocketIO instance to fix circular import
+#
+# SOCKETIO_ASYNC_MODE selects the server model:
+#   unset / 'threading'  one OS thread per connection (dev server, default)
+#   'eventlet'           green threads; thousands of websocket clients per worker
+#   'gevent'             same, on gevent
+# Green-thread modes must be monkey patched before anything else is imported:
+# start the server with serve.py. Blocking sqlite / sklearn work then goes
+# through run_blocking() so it runs on a real OS thread and never stalls the hub.
+import os
 from flask_socketio import SocketIO
 
-socketio = SocketIO(cors_allowed_origins="*")  # Init with basic config; customize as needed
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None  # e.g. redis:// for multi-worker emits
+
+socketio = SocketIO(cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE,
+                    message_queue=SOCKETIO_MESSAGE_QUEUE)  # Init with basic config; customize as needed
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Call fn on a native thread pool when serving on green threads, else inline.
+
+    fn must not touch Socket.IO or green-thread locks: it runs outside the hub.
+    """
+    if SOCKETIO_ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if SOCKETIO_ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+
+def native_lock():
+    """A real OS lock, also under eventlet/gevent monkey patching.
+
+    For state shared between the hub and run_blocking() callers: green locks
+    cannot be waited on from a native thread. Hold it only around short
+    in-memory sections (no I/O), since waiting for it blocks the hub.
+    """
+    if SOCKETIO_ASYNC_MODE == 'eventlet':
+        from eventlet import patcher
+        return patcher.original('_thread').allocate_lock()
+    if SOCKETIO_ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        return monkey.get_original('_thread', 'allocate_lock')()
+    import threading
+    return threading.Lock()
@@ -0,0 +1,26 @@
+# geo_utils.py - Small shared geo helpers (geocells, distances)
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+GEOCELL_DEG = 0.1  # ~11 km cells; coarse enough for dashboard/map bucketing
+
+
+def geocell(latitude, longitude, cell_deg=GEOCELL_DEG):
+    """Return the (row, col) grid cell containing a point."""
+    return (int(math.floor(float(latitude) / cell_deg)), int(math.floor(float(longitude) / cell_deg)))
+
+
+def neighbor_cells(cell):
+    """The cell itself plus its 8 neighbours."""
+    row, col = cell
+    return [(row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
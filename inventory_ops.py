@@ -0,0 +1,208 @@
+# inventory_ops.py - Batched delivery and inventory operations for the admin dashboard
+#
+# The dashboard used to approve deliveries / edit stock one form POST at a time
+# (connection, one UPDATE, redirect, full re-render). These helpers apply many
+# operations in one transaction and report a result per item; the routes in
+# admin_routes.py then push small change events over Socket.IO so open
+# dashboards patch rows in place.
+#
+# Delivery lifecycle (stock is reserved when the volunteer makes the request):
+#   pending -> approved -> dispatched -> delivered
+#   pending / approved -> cancelled   (reserved stock goes back to inventory)
+# Resource status is never set by hand: stock_forecast derives it from the
+# quantity and the projected time to stockout after every change. The helpers
+# take a stock_forecaster.snapshot() taken before the transaction and return the
+# consumption events to record() once it has committed.
+import logging
+from response_cache import response_cache, INVENTORY_TOPIC
+
+logger = logging.getLogger(__name__)
+
+BULK_MAX_ITEMS = 500  # Per bulk request
+
+# action -> (statuses it may be applied to, resulting status)
+DELIVERY_ACTIONS = {
+    'approve': ({'pending'}, 'approved'),
+    'dispatch': ({'pending', 'approved'}, 'dispatched'),
+    'cancel': ({'pending', 'approved'}, 'cancelled'),
+}
+OPEN_DELIVERY_STATUSES = ('pending', 'approved')  # Shown on the admin dashboard
+# Volunteer updates: status -> statuses it may be set from
+VOLUNTEER_DELIVERY_TRANSITIONS = {
+    'delivered': ('dispatched',),
+    'cancelled': tuple(sorted(DELIVERY_ACTIONS['cancel'][0])),
+}
+VOLUNTEER_DELIVERY_STATUSES = OPEN_DELIVERY_STATUSES + ('dispatched',)  # Still on the volunteer's list
+
+
+def _fetch_by_ids(cursor, sql, ids, chunk=500):
+    rows = {}
+    for start in range(0, len(ids), chunk):
+        part = ids[start:start + chunk]
+        cursor.execute(sql.format(marks=','.join('?' * len(part))), part)
+        for row in cursor.fetchall():
+            rows[row[0]] = dict(row)
+    return rows
+
+
+def _fetch_resources_by_name(cursor, names):
+    rows = {}
+    names = list(names)
+    for start in range(0, len(names), 500):
+        part = names[start:start + 500]
+        cursor.execute(f"SELECT id, resource_name, quantity, status FROM resources "
+                       f"WHERE resource_name IN ({','.join('?' * len(part))})", part)
+        for row in cursor.fetchall():
+            rows[row['resource_name']] = dict(row)
+    return rows
+
+
+def refresh_stock(cursor, names, forecast, pending=()):
+    """Re-derive stock status in the caller's write transaction; returns (rows, stock alerts).
+
+    Every item is re-derived, not only the named ones: statuses also move as old
+    consumption ages out of the forecast window, and stock writes are where that
+    is caught up (the stock forecast API only reads). rows are the named
+    resources plus any other resource whose status changed.
+    forecast is a stock_forecaster.snapshot(); pending the uncommitted consumption events.
+    """
+    changed, alerts = forecast.refresh(cursor, None, pending)
+    rows = _fetch_resources_by_name(cursor, names)
+    for row in changed:
+        rows.setdefault(row['resource_name'], row)
+    return list(rows.values()), alerts
+
+
+def bulk_update_deliveries(cursor, action, delivery_ids, forecast):
+    """Apply one action to many deliveries inside the caller's transaction.
+
+    Returns (results, changed_deliveries, changed_resources, stock_alerts,
+    consumption); results has one {'id', 'ok', 'status' | 'error'} entry per
+    requested id, in request order. Record consumption on stock_forecaster
+    after the commit.
+    """
+    allowed_from, new_status = DELIVERY_ACTIONS[action]
+    current = _fetch_by_ids(cursor, """
+        SELECT delivery_id, volunteer_username, item, quantity, status, timestamp
+        FROM resource_deliveries WHERE delivery_id IN ({marks})
+    """, list(set(delivery_ids)))
+
+    results, updates, returned_stock, seen = [], [], {}, set()
+    for delivery_id in delivery_ids:
+        row = current.get(delivery_id)
+        if row is None:
+            results.append({'id': delivery_id, 'ok': False, 'error': 'Delivery not found'})
+        elif delivery_id in seen:
+            results.append({'id': delivery_id, 'ok': False, 'error': 'Duplicate id in request'})
+        elif row['status'] not in allowed_from:
+            results.append({'id': delivery_id, 'ok': False, 'status': row['status'],
+                            'error': f"Cannot {action} a delivery that is '{row['status']}'"})
+        else:
+            seen.add(delivery_id)
+            row['status'] = new_status
+            updates.append(row)
+            if action == 'cancel':
+                returned_stock[row['item']] = returned_stock.get(row['item'], 0) + row['quantity']
+            results.append({'id': delivery_id, 'ok': True, 'status': new_status})
+
+    if updates:
+        cursor.executemany("UPDATE resource_deliveries SET status = ? WHERE delivery_id = ?",
+                           [(new_status, row['delivery_id']) for row in updates])
+    changed_resources, alerts, consumption = [], [], []
+    if returned_stock:
+        cursor.executemany("UPDATE resources SET quantity = quantity + ? WHERE resource_name = ?",
+                           [(qty, item) for item, qty in returned_stock.items()])
+        consumption = [(row['item'], -row['quantity'], row['timestamp']) for row in updates]
+        changed_resources, alerts = refresh_stock(cursor, returned_stock, forecast, consumption)
+        logger.info(f"🔄 Returned cancelled stock to inventory: {returned_stock}")
+
+    changed = [{'id': row['delivery_id'], 'volunteer_username': row['volunteer_username'], 'item': row['item'],
+                'quantity': row['quantity'], 'status': row['status']} for row in updates]
+    return results, changed, changed_resources, alerts, consumption
+
+
+def _validate_adjustment(raw):
+    """Normalise one {'id', 'delta' | 'quantity'} item; raises ValueError."""
+    if not isinstance(raw, dict):
+        raise ValueError("Adjustment must be an object")
+    try:
+        res_id = int(raw['id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Missing or invalid resource id")
+    if ('delta' in raw) == ('quantity' in raw):
+        raise ValueError("Give exactly one of 'delta' or 'quantity'")
+    key = 'delta' if 'delta' in raw else 'quantity'
+    value = raw[key]
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"'{key}' must be an integer")
+    return {'id': res_id, key: value}
+
+
+def bulk_adjust_resources(cursor, adjustments, forecast, atomic=False):
+    """Apply many stock adjustments inside the caller's transaction.
+
+    Each item sets an absolute 'quantity' or adds a signed 'delta'; quantities
+    never go below zero. Several items for one resource apply in order. With
+    atomic=True any failed item rolls back the whole request (the caller sees
+    ok=False results and must not commit). Statuses are re-derived afterwards.
+
+    Returns (results, changed_resources, stock_alerts, all_ok); changed_resources
+    may include other resources whose status refresh_stock caught up.
+    """
+    parsed = []
+    for raw in adjustments:
+        try:
+            parsed.append(_validate_adjustment(raw))
+        except ValueError as e:
+            parsed.append(e)
+    ids = list({item['id'] for item in parsed if isinstance(item, dict)})
+    current = _fetch_by_ids(cursor, "SELECT id, resource_name, quantity, status FROM resources WHERE id IN ({marks})",
+                            ids)
+
+    results, touched = [], {}
+    for raw, item in zip(adjustments, parsed):
+        if isinstance(item, ValueError):
+            results.append({'id': raw.get('id') if isinstance(raw, dict) else None, 'ok': False, 'error': str(item)})
+            continue
+        row = touched.get(item['id']) or current.get(item['id'])
+        if row is None:
+            results.append({'id': item['id'], 'ok': False, 'error': 'Resource not found'})
+            continue
+        quantity = item['quantity'] if 'quantity' in item else row['quantity'] + item['delta']
+        if quantity < 0:
+            results.append({'id': item['id'], 'ok': False, 'quantity': row['quantity'],
+                            'error': f"Quantity would go negative ({quantity})"})
+            continue
+        row = dict(row, quantity=quantity)
+        touched[item['id']] = row
+        results.append({'id': item['id'], 'ok': True, 'quantity': quantity})
+
+    all_ok = all(result['ok'] for result in results)
+    if atomic and not all_ok:
+        return results, [], [], False
+    if not touched:
+        return results, [], [], all_ok
+    cursor.executemany("UPDATE resources SET quantity = ? WHERE id = ?",
+                       [(row['quantity'], row['id']) for row in touched.values()])
+    resources, alerts = refresh_stock(cursor, {row['resource_name'] for row in touched.values()}, forecast)
+    status_by_id = {r['id']: r['status'] for r in resources}
+    for result in results:
+        if result['ok']:
+            result['status'] = status_by_id.get(result['id'])
+    return results, resources, alerts, all_ok
+
+
+def emit_inventory_changes(deliveries=(), resources=(), alerts=()):
+    """Drop cached dashboard data and push small change events so open dashboards patch rows in place."""
+    response_cache.invalidate(INVENTORY_TOPIC)
+    try:
+        from extensions import socketio
+        for room in ('admin-room', 'volunteer-room'):
+            if deliveries:
+                socketio.emit('deliveries_updated', {'deliveries': list(deliveries)}, room=room)
+            if resources:
+                socketio.emit('resources_updated', {'resources': list(resources)}, room=room)
+        if alerts:
+            socketio.emit('stock_alert', {'alerts': list(alerts)}, room='admin-room')
+    except Exception as e:
+        logger.warning(f"⚠️ Inventory change broadcast failed: {e}")
@@ -1,6 +1,12 @@
 # routes/map_routes.py
-from flask import Blueprint, jsonify, render_template
-from db_config import get_db_connection
+import hashlib
+from flask import Blueprint, jsonify, render_template, request, make_response, abort
+from shard_router import connect_sos
+from sos_wire import requested_format, compact_response
+from sos_read_model import read_model
+from response_cache import cached_response, SOS_TOPIC
+from tile_cache import get_tile_proxy, valid_tile, TileUnavailable, TILE_MAX_AGE
+from extensions import run_blocking
 
 map_bp = Blueprint('map', __name__)
 
@@ -12,12 +18,15 @@ def map_home():
 @map_bp.route('/sos_locations')
 def sos_locations():
     """Return all SOS requests with coordinates for map plotting."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, latitude, longitude, description, status, risk_level FROM sos_requests")
-    
-    sos_data_raw = cursor.fetchall() # FIX: Fetch raw rows
-    # FIX: Convert sqlite3.Row objects to dictionaries for JSON serialization
+    # Compact/binary columnar format (opt-in via ?format= or Accept header)
+    fmt = requested_format(request)
+    return cached_response('sos_locations', (SOS_TOPIC,), lambda: _sos_locations(fmt), params=(fmt,))
+
+def _sos_locations(fmt):
+    if fmt:
+        return compact_response(read_model.compact_rows(), fmt)
+
+    sos_data_raw = read_model.all_alerts() # Served from the in-memory read model
     sos_data = [
         {
             "id": row['id'], # Access by column name
@@ -31,5 +40,41 @@ def sos_locations():
         for row in sos_data_raw # Iterate over raw rows
     ]
     
-    conn.close()
     return jsonify(sos_data)
+
+@map_bp.route('/sos_locations/<int:sos_id>')
+def sos_location_details(sos_id):
+    """Return popup details for one SOS (lazy companion to the compact format)."""
+    details = run_blocking(_sos_popup, sos_id)
+    if details is None:
+        return jsonify({'error': 'SOS not found'}), 404
+    return jsonify(details)
+
+def _sos_popup(sos_id):
+    """Popup fields of one SOS, or None (SQL only: called through run_blocking)."""
+    conn = connect_sos(sos_id)
+    try:
+        row = conn.execute("SELECT id, username, description, assigned_to, timestamp FROM sos_requests WHERE id = ?",
+                           (sos_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+@map_bp.route('/tiles/<int:z>/<int:x>/<int:y>.png')
+def map_tile(z, x, y):
+    """Serve a map tile from the local pack / MBTiles cache, fetching upstream once on a miss."""
+    if not valid_tile(z, x, y):
+        abort(404)
+    try:
+        data = get_tile_proxy().get_tile(z, x, y)
+    except TileUnavailable:
+        # Short negative cache so an offline tile is retried after reconnecting
+        response = make_response('Tile unavailable', 404)
+        response.headers['Cache-Control'] = 'public, max-age=60'
+        return response
+
+    response = make_response(data)
+    response.mimetype = 'image/jpeg' if data[:3] == b'\xff\xd8\xff' else 'image/png'
+    response.headers['Cache-Control'] = f'public, max-age={TILE_MAX_AGE}, immutable'
+    response.set_etag(hashlib.md5(data).hexdigest())
+    return response.make_conditional(request)
@@ -0,0 +1,209 @@
+# rate_limit.py - Token-bucket admission control for the write-heavy endpoints
+#
+# Every limited request spends one token from a per-user bucket and from a
+# per-IP bucket of its endpoint's policy (O(1): two dict/row lookups). An empty
+# bucket answers immediately with 429 and a Retry-After telling the client when
+# the next token arrives.
+#
+# Overload backpressure: requests in flight on limited endpoints are counted per
+# worker. Lower-priority endpoints are shed with 503 + Retry-After at a fraction
+# of MAX_IN_FLIGHT, so SOS keeps capacity when the chatbot or predictor is busy.
+#
+# Bucket state is in-process by default. With RATE_LIMIT_BACKEND=sqlite it lives
+# in a small SQLite file (RATE_LIMIT_DB) shared by every worker on the host.
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict, namedtuple
+from flask import request, session, jsonify, make_response
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'memory' | 'sqlite'
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', 'rate_limit.db')
+MAX_IN_FLIGHT = int(os.environ.get('RATE_LIMIT_MAX_IN_FLIGHT', 64))
+MAX_MEMORY_BUCKETS = 100000  # LRU bound on in-process bucket state
+OVERLOAD_RETRY_AFTER = 1     # Seconds suggested to clients shed under overload
+
+# capacity = burst size, rate = tokens per second, shed_at = share of MAX_IN_FLIGHT
+Policy = namedtuple('Policy', 'user_capacity user_rate ip_capacity ip_rate shed_at')
+
+POLICIES = {
+    # SOS: highest priority. Double submits are throttled, but it is shed last
+    'sos': Policy(user_capacity=6, user_rate=1 / 10, ip_capacity=60, ip_rate=2.0, shed_at=1.0),
+    'predict': Policy(user_capacity=20, user_rate=1.0, ip_capacity=60, ip_rate=3.0, shed_at=0.75),
+    'chatbot': Policy(user_capacity=10, user_rate=0.5, ip_capacity=30, ip_rate=1.0, shed_at=0.5),
+    # Volunteer GPS pings: one every few seconds per volunteer, many volunteers per NAT; shed first
+    'location': Policy(user_capacity=10, user_rate=1.0, ip_capacity=600, ip_rate=200.0, shed_at=0.5),
+}
+
+
+# ---- bucket stores --------------------------------------------------------------
+class MemoryBucketStore:
+    """Per-process buckets: key -> (tokens, last_refill)."""
+
+    def __init__(self, max_buckets=MAX_MEMORY_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.max_buckets = max_buckets
+
+    def take(self, requests_, now=None):
+        """Spend one token from every (key, capacity, rate) bucket, or none of them.
+
+        Returns 0 when admitted, else seconds until the emptiest bucket refills.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            levels = []
+            for key, capacity, rate in requests_:
+                tokens, last = self._buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - last) * rate))
+            wait = _wait_seconds(levels, requests_)
+            if wait:
+                return wait
+            for (key, capacity, rate), tokens in zip(requests_, levels):
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)  # Idle long enough to have refilled
+            return 0
+
+
+class SQLiteBucketStore:
+    """Buckets in a shared SQLite file so every worker process sees the same state."""
+
+    PRUNE_EVERY = 1000      # Requests between sweeps of idle buckets
+    IDLE_SECONDS = 3600
+
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.path = path
+        self._local = threading.local()
+        self._count = 0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, requests_, now=None):
+        now = time.time() if now is None else now  # Wall clock: shared across processes
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, capacity, rate in requests_:
+                row = conn.execute("SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, last = row if row else (capacity, now)
+                levels.append(min(capacity, tokens + max(0.0, now - last) * rate))
+            wait = _wait_seconds(levels, requests_)
+            if not wait:
+                conn.executemany("INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                                 [(key, tokens - 1, now) for (key, _, _), tokens in zip(requests_, levels)])
+            self._count += 1
+            if self._count % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limit_buckets WHERE updated < ?", (now - self.IDLE_SECONDS,))
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _wait_seconds(levels, requests_):
+    waits = [(1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, requests_) if tokens < 1]
+    return max(waits) if waits else 0
+
+
+def _make_store():
+    if RATE_LIMIT_BACKEND == 'sqlite':
+        try:
+            store = SQLiteBucketStore(RATE_LIMIT_DB)
+            logger.info(f"✅ Rate limiter sharing bucket state via {RATE_LIMIT_DB}")
+            return store
+        except Exception as e:
+            logger.error(f"⚠️ Rate limiter SQLite store unavailable ({e}); using in-process buckets.")
+    return MemoryBucketStore()
+
+
+bucket_store = _make_store()
+
+
+# ---- overload tracking ----------------------------------------------------------
+class InFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def enter(self, limit):
+        with self._lock:
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.count -= 1
+
+
+in_flight = InFlight()
+
+
+def _reject(status, retry_after, message):
+    retry_after = max(1, int(math.ceil(retry_after)))
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = make_response(jsonify({'error': message, 'retry_after': retry_after}), status)
+    else:
+        response = make_response(message, status)
+        response.mimetype = 'text/plain'
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limited(policy_name, methods=('POST',)):
+    """Admit requests to a view through the named policy's token buckets."""
+    policy = POLICIES[policy_name]
+    shed_limit = max(1, int(MAX_IN_FLIGHT * policy.shed_at))
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in methods:
+                return view(*args, **kwargs)
+            if not in_flight.enter(shed_limit):
+                logger.warning(f"⚠️ Overloaded: shedding {policy_name} request ({in_flight.count} in flight)")
+                return _reject(503, OVERLOAD_RETRY_AFTER, "Server is busy. Please retry shortly.")
+            try:
+                buckets = [(f"{policy_name}:ip:{request.remote_addr}", policy.ip_capacity, policy.ip_rate)]
+                user = session.get('username')
+                if user:
+                    buckets.append((f"{policy_name}:user:{user}", policy.user_capacity, policy.user_rate))
+                try:
+                    wait = bucket_store.take(buckets)
+                except Exception as e:
+                    logger.error(f"⚠️ Rate limiter store error ({e}); admitting request.")
+                    wait = 0
+                if wait:
+                    logger.info(f"Rate limited {policy_name} for {user or request.remote_addr}: retry in {wait:.1f}s")
+                    return _reject(429, wait, "Too many requests. Please wait before trying again.")
+                return view(*args, **kwargs)
+            finally:
+                in_flight.leave()
+        return wrapper
+    return decorator
@@ -0,0 +1,287 @@
+# replay_traffic.py - Replay a traffic capture against a running instance and diff it against a baseline
+# Run: python replay_traffic.py traffic_capture.jsonl --base-url http://127.0.0.1:5000 \
+#          --login user=user:user --login volunteer=vol1:vol1 --login admin=admin:admin \
+#          [--speedup 10] [--concurrency 16] [--save-baseline base.json | --baseline base.json]
+#
+# Replays the lines written by traffic_capture.py in arrival order, compressed in
+# time by --speedup (0 = as fast as possible). Each captured actor gets its own
+# cookie jar, logged in with an account of the actor's role (--login
+# role=username:password, several accounts per role are used round-robin), and
+# always runs on the same client thread, so one user's requests are sent in the
+# order they were captured. Everything is derived from the capture file, so two
+# runs of the same capture send the same requests in the same order.
+#
+# Reports per route (method + URL rule): requests, errors (5xx / connection
+# failures), throttled (429 / 503 from rate_limit.py), and latency p50 / p90 /
+# p99 / max. Send lag (how late requests left compared with the schedule) is
+# shown too: if it grows, the client, not the server, is the bottleneck.
+#
+# --save-baseline writes the report as JSON; --baseline compares the run with a
+# saved one and exits with status 1 if a route's p90 or p99 grew by more than
+# --max-regression (and at least --min-delta-ms) or its error rate rose by more
+# than --max-error-increase (routes with fewer than --min-requests requests are
+# listed but not judged). For comparable numbers, replay both releases
+# against the same database copy (db_backup.py restore).
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+
+def load_capture(path, limit=None):
+    """Capture lines sorted by arrival time (unreadable lines are skipped)."""
+    entries, bad = [], 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                entry['ts'] = float(entry['ts'])
+                if not (entry.get('method') and entry.get('path')):
+                    raise ValueError("method / path missing")
+            except (ValueError, KeyError, TypeError):
+                bad += 1
+                continue
+            if 'body_skipped' not in entry:
+                entries.append(entry)
+    entries.sort(key=lambda e: e['ts'])
+    if bad:
+        print(f"  skipped {bad} malformed capture lines", file=sys.stderr)
+    return entries[:limit] if limit else entries
+
+
+def route_key(entry):
+    return f"{entry['method']} {entry.get('route') or entry['path']}"
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects (post/redirect/get, login bounces) as responses instead of following them."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    """One captured actor: a cookie jar logged in as an account of its role."""
+
+    def __init__(self, base_url, timeout, account=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+        self.account = account
+        self.logged_in = account is None
+
+    def send(self, method, path, query=None, form=None, body_json=None):
+        """(status, seconds); status None for connection failures."""
+        url = self.base_url + path
+        if query:
+            url += '?' + urllib.parse.urlencode(query, doseq=True)
+        data, headers = None, {}
+        if body_json is not None:
+            data, headers = json.dumps(body_json).encode(), {'Content-Type': 'application/json'}
+        elif form is not None:
+            data = urllib.parse.urlencode(form, doseq=True).encode()
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        t0 = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:  # 3xx (not followed), 4xx, 5xx
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = None
+        return status, time.perf_counter() - t0
+
+    def login(self):
+        if not self.logged_in:
+            username, password = self.account
+            self.send('POST', '/auth/login', form={'username': username, 'password': password})
+            self.logged_in = True
+
+
+def replay(entries, base_url, logins, speedup=1.0, concurrency=8, timeout=30.0):
+    """Send the captured requests; returns [(route, status, seconds, lag seconds)]."""
+    accounts = defaultdict(list)
+    for role, account in logins:
+        accounts[role].append(account)
+    clients, used = {}, defaultdict(int)
+
+    def client_for(entry):
+        actor = entry.get('actor') or 'anonymous'
+        client = clients.get(actor)
+        if client is None:
+            pool = accounts.get(entry.get('role')) if entry.get('actor') else None
+            account = pool[used[entry.get('role')] % len(pool)] if pool else None
+            used[entry.get('role')] += 1
+            client = clients[actor] = Client(base_url, timeout, account)
+        return client
+
+    # Same actor -> same thread, assigned in order of first appearance (deterministic)
+    lanes, lane_of = [queue.Queue() for _ in range(concurrency)], {}
+    for entry in entries:
+        actor = entry.get('actor') or 'anonymous'
+        lane = lane_of.setdefault(actor, len(lane_of) % concurrency)
+        lanes[lane].put((entry, client_for(entry)))
+    results, results_lock = [], threading.Lock()
+    ts0 = entries[0]['ts'] if entries else 0.0
+    start = time.perf_counter() + 0.5
+
+    def run(lane):
+        while True:
+            try:
+                entry, client = lane.get_nowait()
+            except queue.Empty:
+                return
+            client.login()
+            due = start + ((entry['ts'] - ts0) / speedup if speedup > 0 else 0.0)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            lag = max(0.0, time.perf_counter() - due)
+            status, seconds = client.send(entry['method'], entry['path'], entry.get('query'),
+                                          entry.get('form'), entry.get('json'))
+            with results_lock:
+                results.append((route_key(entry), status, seconds, lag))
+
+    threads = [threading.Thread(target=run, args=(lane,), daemon=True) for lane in lanes]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def summarize(results):
+    """{'routes': {route: stats}, 'total': stats} with latencies in ms."""
+    by_route = defaultdict(list)
+    for route, status, seconds, lag in results:
+        by_route[route].append((status, seconds, lag))
+        by_route['*'].append((status, seconds, lag))
+    report = {}
+    for route, rows in by_route.items():
+        ms = sorted(1000 * seconds for _, seconds, _ in rows)
+        errors = sum(1 for status, _, _ in rows if status is None or (status >= 500 and status != 503))
+        throttled = sum(1 for status, _, _ in rows if status in (429, 503))
+        lag_ms = sorted(1000 * lag for _, _, lag in rows)
+        report[route] = {
+            'requests': len(rows), 'errors': errors, 'throttled': throttled,
+            'error_rate': round(errors / len(rows), 4),
+            'p50_ms': round(_percentile(ms, 50), 2), 'p90_ms': round(_percentile(ms, 90), 2),
+            'p99_ms': round(_percentile(ms, 99), 2), 'max_ms': round(ms[-1], 2),
+            'lag_p99_ms': round(_percentile(lag_ms, 99), 2),
+        }
+    total = report.pop('*', None)
+    return {'routes': dict(sorted(report.items())), 'total': total}
+
+
+def compare(report, baseline, max_regression=0.25, min_delta_ms=5.0, max_error_increase=0.01, min_requests=20):
+    """Regressions of report against baseline: [(route, what, baseline value, new value)].
+
+    Routes with fewer than min_requests requests in either run are too noisy to judge and are skipped.
+    """
+    regressions = []
+    for route, new in report['routes'].items():
+        old = baseline['routes'].get(route)
+        if old is None or min(old['requests'], new['requests']) < min_requests:
+            continue
+        for field in ('p90_ms', 'p99_ms'):
+            if new[field] > old[field] * (1 + max_regression) and new[field] - old[field] >= min_delta_ms:
+                regressions.append((route, field, old[field], new[field]))
+        if new['error_rate'] - old['error_rate'] > max_error_increase:
+            regressions.append((route, 'error_rate', old['error_rate'], new['error_rate']))
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"{'route':<52} {'reqs':>6} {'err%':>6} {'429/503':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+          + ("   p90 vs base" if baseline else ""))
+    rows = list(report['routes'].items()) + ([('TOTAL', report['total'])] if report['total'] else [])
+    for route, s in rows:
+        line = (f"{route[:52]:<52} {s['requests']:>6} {100 * s['error_rate']:>5.1f}% {s['throttled']:>7} "
+                f"{s['p50_ms']:>8.1f} {s['p90_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['max_ms']:>8.1f}")
+        old = baseline and (baseline['total'] if route == 'TOTAL' else baseline['routes'].get(route))
+        if old:
+            line += f"   {100 * (s['p90_ms'] / old['p90_ms'] - 1) if old['p90_ms'] else 0.0:+6.1f}%"
+        elif baseline:
+            line += "   (new)"
+        print(line)
+    if report['total']:
+        print(f"send lag p99 {report['total']['lag_p99_ms']:.1f} ms")
+
+
+def _login(value):
+    role, _, credentials = value.partition('=')
+    username, _, password = credentials.partition(':')
+    if not (role and username):
+        raise argparse.ArgumentTypeError("expected role=username:password")
+    return role, (username, password)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured traffic and report per-route latency")
+    parser.add_argument('capture', help="JSONL file written by traffic_capture.py")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--login', type=_login, action='append', default=[], metavar='ROLE=USER:PASSWORD')
+    parser.add_argument('--speedup', type=float, default=1.0, help="time compression (0 = no pacing)")
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads")
+    parser.add_argument('--limit', type=int, default=None, help="replay only the first N requests")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--baseline', metavar='PATH', help="compare with a saved report, exit 1 on regressions")
+    parser.add_argument('--max-regression', type=float, default=0.25, help="allowed relative p90/p99 growth")
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help="ignore latency changes smaller than this")
+    parser.add_argument('--max-error-increase', type=float, default=0.01)
+    parser.add_argument('--min-requests', type=int, default=20, help="routes with fewer requests are not judged")
+    args = parser.parse_args(argv)
+
+    entries = load_capture(args.capture, args.limit)
+    if not entries:
+        print("Nothing to replay")
+        return 0
+    span = entries[-1]['ts'] - entries[0]['ts']
+    print(f"Replaying {len(entries)} requests ({span:.0f}s captured) against {args.base_url} "
+          f"at {'full speed' if args.speedup <= 0 else f'{args.speedup:g}x'}")
+    t0 = time.perf_counter()
+    report = summarize(replay(entries, args.base_url, args.login, args.speedup, args.concurrency, args.timeout))
+    report['meta'] = {'capture': args.capture, 'requests': len(entries), 'speedup': args.speedup,
+                      'concurrency': args.concurrency, 'elapsed_s': round(time.perf_counter() - t0, 2)}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if baseline is not None:
+        regressions = compare(report, baseline, args.max_regression, args.min_delta_ms, args.max_error_increase,
+                              args.min_requests)
+        for route, field, old, new in regressions:
+            print(f"REGRESSION {route}: {field} {old} -> {new}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# reshard.py - Inspect and change the region -> shard map (run with the app stopped)
+#
+#   python reshard.py --plan                   # SOS rows per shard and region
+#   python reshard.py --move REGION SHARD      # move one region's SOS data to SHARD
+#   python reshard.py --rebalance [--dry-run]  # even out rows across shards
+#
+# A move copies the region's sos_requests rows from every other shard (rows
+# stamped by a later region backfill included) together with their incidents
+# and their sos_events status log, updates the shard map and deletes the originals, all in one transaction over
+# the destination with the other shard files ATTACHed. SOS rows keep their ids
+# (users and volunteers refer to them) and are recorded in sos_locations;
+# incidents and events are renumbered into the destination's id range (events
+# keep their order, so the next transition still sees the right from_status).
+#
+# Workers cache the shard map, so restart the app afterwards. To shard an
+# existing single-file deployment: set DB_SHARDS, then run --rebalance.
+import logging
+import argparse
+from db_config import get_db_connection, SHARD_FILES, SHARD_ID_SPAN
+from shard_router import SHARD_COUNT, HOME_SHARD, default_shard, id_range_shard
+from sos_read_model import bump_sos_version
+
+logger = logging.getLogger(__name__)
+
+
+def region_counts():
+    """[{region_id: SOS rows}] per shard (None = rows without a region)."""
+    counts = []
+    for shard in range(SHARD_COUNT):
+        conn = get_db_connection(shard)
+        try:
+            rows = conn.execute("SELECT region_id, COUNT(*) FROM sos_requests GROUP BY region_id").fetchall()
+        finally:
+            conn.close()
+        counts.append({row[0]: row[1] for row in rows})
+    return counts
+
+
+def region_owners():
+    conn = get_db_connection()
+    try:
+        return {row[0]: row[1] for row in conn.execute("SELECT region_id, shard FROM region_shards")}
+    finally:
+        conn.close()
+
+
+def _sequence(cursor, table):
+    cursor.execute("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,))
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def move_region(region_id, dest):
+    """Move every SOS row of region_id (with its incidents and events) onto shard dest. Returns rows moved."""
+    if not 0 <= dest < SHARD_COUNT:
+        raise ValueError(f"shard must be between 0 and {SHARD_COUNT - 1}")
+    conn = get_db_connection(dest)
+    conn.isolation_level = None  # Explicit transaction below
+    cursor = conn.cursor()
+    sources = [shard for shard in range(SHARD_COUNT) if shard != dest]
+    for shard in sources:
+        cursor.execute(f"ATTACH DATABASE ? AS shard{shard}", (SHARD_FILES[shard],))
+    home = 'main' if dest == HOME_SHARD else f'shard{HOME_SHARD}'
+    columns = ', '.join(row[1] for row in cursor.execute("PRAGMA main.table_info(sos_requests)").fetchall())
+    incident_columns = ', '.join(row[1] for row in cursor.execute("PRAGMA main.table_info(incidents)").fetchall()
+                                 if row[1] != 'id')
+    event_columns = ', '.join(row[1] for row in cursor.execute("PRAGMA main.table_info(sos_events)").fetchall()
+                              if row[1] != 'id')
+    cursor.execute("CREATE TEMP TABLE moving (id INTEGER PRIMARY KEY)")
+    moved_ids = []
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        sequence = _sequence(cursor, 'sos_requests')
+        for shard in sources:
+            src = f"shard{shard}"
+            cursor.execute("DELETE FROM temp.moving")
+            cursor.execute(f"INSERT INTO temp.moving SELECT id FROM {src}.sos_requests WHERE region_id = ?",
+                           (region_id,))
+            if cursor.rowcount == 0:
+                continue
+            cursor.execute(f"INSERT INTO main.sos_requests ({columns}) SELECT {columns} FROM {src}.sos_requests "
+                           f"WHERE id IN (SELECT id FROM temp.moving)")
+
+            cursor.execute(f"SELECT DISTINCT incident_id FROM {src}.sos_requests "
+                           f"WHERE id IN (SELECT id FROM temp.moving) AND incident_id IS NOT NULL")
+            incident_ids = [row[0] for row in cursor.fetchall()]
+            for incident_id in incident_ids:
+                cursor.execute(f"INSERT INTO main.incidents ({incident_columns}) "
+                               f"SELECT {incident_columns} FROM {src}.incidents WHERE id = ?", (incident_id,))
+                new_id = cursor.lastrowid if cursor.rowcount else None
+                cursor.execute("UPDATE main.sos_requests SET incident_id = ? "
+                               "WHERE incident_id = ? AND id IN (SELECT id FROM temp.moving)", (new_id, incident_id))
+
+            # Status log, in its original order (the SLA aggregator replays it on restart)
+            cursor.execute(f"INSERT INTO main.sos_events ({event_columns}) SELECT {event_columns} "
+                           f"FROM {src}.sos_events WHERE sos_id IN (SELECT id FROM temp.moving) ORDER BY id")
+            cursor.execute(f"DELETE FROM {src}.sos_events WHERE sos_id IN (SELECT id FROM temp.moving)")
+
+            cursor.execute(f"DELETE FROM {src}.sos_requests WHERE id IN (SELECT id FROM temp.moving)")
+            # Incidents shared with rows of other regions stay behind for those rows
+            cursor.executemany(f"DELETE FROM {src}.incidents WHERE id = ? AND NOT EXISTS "
+                               f"(SELECT 1 FROM {src}.sos_requests WHERE incident_id = ?)",
+                               [(incident_id, incident_id) for incident_id in incident_ids])
+            cursor.execute(f"UPDATE {src}.sos_version SET version = version + 1 WHERE id = 1")
+            moved_ids.extend(row[0] for row in cursor.execute("SELECT id FROM temp.moving").fetchall())
+
+        if moved_ids:
+            # Explicit ids from other shards' ranges must not advance this shard's id counter
+            if sequence is None:
+                cursor.execute("SELECT COALESCE(MAX(id), ?) FROM main.sos_requests WHERE id >= ? AND id < ?",
+                               (dest * SHARD_ID_SPAN, dest * SHARD_ID_SPAN, (dest + 1) * SHARD_ID_SPAN))
+                sequence = cursor.fetchone()[0]
+            cursor.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = 'sos_requests'", (sequence,))
+            bump_sos_version(cursor)
+        cursor.executemany(f"DELETE FROM {home}.sos_locations WHERE sos_id = ?",
+                           [(sos_id,) for sos_id in moved_ids if id_range_shard(sos_id) == dest])
+        cursor.executemany(f"INSERT OR REPLACE INTO {home}.sos_locations (sos_id, shard) VALUES (?, ?)",
+                           [(sos_id, dest) for sos_id in moved_ids if id_range_shard(sos_id) != dest])
+        cursor.execute(f"INSERT OR REPLACE INTO {home}.region_shards (region_id, shard) VALUES (?, ?)",
+                       (region_id, dest))
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    logger.info(f"✅ Region {region_id}: {len(moved_ids)} SOS rows moved to shard {dest}")
+    return len(moved_ids)
+
+
+def plan_rebalance(counts, owners):
+    """Greedy region moves [(region_id, from_shard, to_shard)] that even out SOS rows per shard.
+
+    A region counts fully on its owning shard (where a move would put all of
+    it); rows without a region stay where they are.
+    """
+    load = [counts[shard].get(None, 0) for shard in range(SHARD_COUNT)]
+    totals = {}
+    for shard, regions in enumerate(counts):
+        for region_id, rows in regions.items():
+            if region_id is not None:
+                totals[region_id] = totals.get(region_id, 0) + rows
+    placement = {}
+    for region_id, rows in totals.items():
+        owner = owners.get(region_id)
+        if owner is None or owner >= SHARD_COUNT:
+            owner = max(range(SHARD_COUNT), key=lambda shard: counts[shard].get(region_id, 0))
+        placement[region_id] = owner
+        load[owner] += rows
+
+    moves = []
+    while True:
+        fullest = max(range(SHARD_COUNT), key=lambda shard: load[shard])
+        emptiest = min(range(SHARD_COUNT), key=lambda shard: load[shard])
+        gap = load[fullest] - load[emptiest]
+        # Largest region whose move narrows the gap
+        candidates = [(rows, region_id) for region_id, rows in totals.items()
+                      if placement[region_id] == fullest and 0 < rows < gap]
+        if not candidates:
+            return moves
+        rows, region_id = max(candidates)
+        placement[region_id] = emptiest
+        load[fullest] -= rows
+        load[emptiest] += rows
+        moves.append((region_id, fullest, emptiest))
+
+
+def print_plan(counts, owners):
+    for shard, regions in enumerate(counts):
+        print(f"shard {shard} ({SHARD_FILES[shard]}): {sum(regions.values())} SOS rows")
+        for region_id, rows in sorted(regions.items(), key=lambda kv: -kv[1]):
+            owner = owners.get(region_id, default_shard(region_id) if region_id is not None else HOME_SHARD)
+            note = '' if owner == shard else f"  (owned by shard {owner}, --move to gather)"
+            print(f"    {region_id or '-':<24} {rows:>9}{note}")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Inspect and change the region -> shard map (app stopped)")
+    parser.add_argument('--plan', action='store_true', help="show SOS rows per shard and region")
+    parser.add_argument('--move', nargs=2, metavar=('REGION', 'SHARD'), help="move one region to a shard")
+    parser.add_argument('--rebalance', action='store_true', help="move regions until shards are even")
+    parser.add_argument('--dry-run', action='store_true', help="with --rebalance: only print the moves")
+    args = parser.parse_args(argv)
+
+    if SHARD_COUNT < 2:
+        parser.error("DB_SHARDS is not set: there is only one shard")
+    if args.move:
+        region_id, shard = args.move
+        print(f"✅ Moved {move_region(region_id, int(shard))} SOS rows of {region_id} to shard {shard}")
+    if args.rebalance:
+        moves = plan_rebalance(region_counts(), region_owners())
+        for region_id, from_shard, to_shard in moves:
+            print(f"{region_id}: shard {from_shard} -> {to_shard}")
+            if not args.dry_run:
+                move_region(region_id, to_shard)
+        print(f"✅ {len(moves)} region moves {'planned' if args.dry_run else 'done'}")
+    if args.plan or not (args.move or args.rebalance):
+        print_plan(region_counts(), region_owners())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
-from flask import Blueprint, render_template, session, redirect, url_for, flash
+from flask import Blueprint, render_template, session, redirect, url_for, flash, request, jsonify
 from db_config import get_db_connection
+import search_index
 import logging
 
 resource_bp = Blueprint('resources', __name__, url_prefix='/resources')
@@ -35,8 +36,27 @@ def inventory():
     
     return render_template('resources.html', username=username, resources=resources, role=role)
 
-# Optional: Add more routes if needed (e.g., search resources)
+# Full-text search over the resources catalog: ?q=&order=rank|recent&limit=&cursor=
 @resource_bp.route('/search', methods=['GET', 'POST'])
 def search_resources():
-    # Similar to above - implement if needed
-    return redirect(url_for('resources.inventory'))
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    query = request.values.get('q', '').strip()
+    if not query:
+        return redirect(url_for('resources.inventory'))
+    
+    conn = get_db_connection()
+    try:
+        page = search_index.search_resources(conn.cursor(), query,
+                                             limit=request.values.get('limit', search_index.DEFAULT_LIMIT, type=int),
+                                             after=request.values.get('cursor') or None,
+                                             order=request.values.get('order', 'rank'))
+        return jsonify(page)
+    except search_index.SearchError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error searching resources: {e}")
+        return jsonify({'error': 'Search failed'}), 500
+    finally:
+        conn.close()
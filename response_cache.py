@@ -0,0 +1,247 @@
+# response_cache.py - Event-invalidated cache for dashboard data and read-only API responses
+#
+# Every admin loading the dashboard, and every volunteer polling the same pending
+# set, used to recompute identical results. Entries here are keyed by
+# (name, role, user or None when shared, params) and tagged with the domain
+# topics they were built from:
+#
+#   'sos'        SOS created / status changed / archived / re-geocoded
+#                (the read model's change feed; foreign writes show up through
+#                its sos_version check, run before every 'sos' lookup)
+#   'inventory'  stock or delivery changes (inventory_ops.emit_inventory_changes)
+#
+# invalidate(topic) bumps that topic's generation; an entry is only served while
+# the generations it was built under are current, so invalidation is exact and
+# O(1). A computation that overlaps an invalidation is returned but not stored.
+# RESPONSE_CACHE_TTL is only a backstop for inventory writes made by other
+# worker processes (which send this process no event) and for stock forecasts
+# that drift as consumption ages out.
+#
+# Stampede protection: one caller computes a missing key, concurrent callers for
+# that key wait for it and then read the stored entry. Memory is bounded by
+# RESPONSE_CACHE_MAX_BYTES (approximate serialized size) with LRU eviction.
+#
+# cached_serve() puts the database circuit breaker (degradation.serve) behind
+# the cache: a hit never counts as a database call, only a miss's compute()
+# goes through the breaker, and a stale snapshot served instead is never cached.
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import Response, request, session
+from sos_read_model import read_model
+from degradation import serve
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 2 ** 20))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 4096))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 300))  # Seconds
+COMPUTE_WAIT_TIMEOUT = 10.0  # Seconds a caller waits on another's computation before computing itself
+
+SOS_TOPIC = 'sos'
+INVENTORY_TOPIC = 'inventory'
+
+
+def approx_size(value):
+    """Rough in-memory cost of a cached value: its serialized length."""
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class ResponseCache:
+    """Bounded LRU of computed values, invalidated per topic, one computation per key."""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl=RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, {topic: generation}, expires_at)
+        self._generations = {}         # topic -> generation
+        self._in_flight = {}           # key -> Event set when its computation finishes
+        self._freshness_checks = {}    # topic -> callable run before lookups of that topic
+        self._bytes = 0
+        self.hits = self.misses = self.coalesced = self.stale = 0
+        self.evictions = self.invalidations = self.discarded = 0
+        self._by_name = {}             # key[0] -> [hits, misses]
+
+    # ---- invalidation ----------------------------------------------------------------
+    def invalidate(self, *topics):
+        with self._lock:
+            for topic in topics:
+                self._generations[topic] = self._generations.get(topic, 0) + 1
+            self.invalidations += 1
+
+    def watch(self, topic, check):
+        """Run check() before lookups tagged `topic` (it may call invalidate)."""
+        self._freshness_checks[topic] = check
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    # ---- lookup ----------------------------------------------------------------------
+    def _current(self, key, now):
+        """Live entry for key or None; drops it if invalidated or expired. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, generations, expires_at = entry
+        if expires_at > now and all(self._generations.get(t, 0) == g for t, g in generations.items()):
+            self._entries.move_to_end(key)
+            return entry
+        del self._entries[key]
+        self._bytes -= size
+        self.stale += 1
+        return None
+
+    def _count(self, key, hit):
+        counts = self._by_name.setdefault(key[0] if isinstance(key, tuple) else key, [0, 0])
+        counts[0 if hit else 1] += 1
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get_or_compute(self, key, topics, compute, size_of=approx_size):
+        """Cached value for key, else compute() once (concurrent callers share the result).
+
+        Exceptions from compute() propagate and are never cached; neither are
+        values for which size_of() returns None.
+        """
+        for topic in topics:
+            check = self._freshness_checks.get(topic)
+            if check is not None:
+                try:
+                    check()
+                except Exception as e:
+                    logger.warning(f"⚠️ Response cache freshness check for '{topic}' failed: {e}")
+
+        waited = False
+        while True:
+            with self._lock:
+                entry = self._current(key, time.monotonic())
+                if entry is not None:
+                    self._count(key, True)
+                    if waited:
+                        self.coalesced += 1
+                    return entry[0]
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    generations = {t: self._generations.get(t, 0) for t in topics}
+                    self._count(key, False)
+                    break
+            # Another caller is computing this key: wait, then re-read
+            if waited or not event.wait(COMPUTE_WAIT_TIMEOUT):
+                with self._lock:
+                    self._count(key, False)
+                return compute()  # Its computation failed or is stuck; don't pile up behind it
+            waited = True
+
+        try:
+            value = compute()
+            size = size_of(value)
+            with self._lock:
+                if any(self._generations.get(t, 0) != g for t, g in generations.items()):
+                    self.discarded += 1  # Invalidated while computing: may already be stale
+                elif size is not None and size <= self.max_bytes:
+                    old = self._entries.pop(key, None)
+                    if old is not None:
+                        self._bytes -= old[1]
+                    self._entries[key] = (value, size, generations, time.monotonic() + self.ttl)
+                    self._bytes += size
+                    while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                        _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+                        self._bytes -= evicted_size
+                        self.evictions += 1
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'coalesced': self.coalesced,
+                'stale': self.stale,
+                'discarded': self.discarded,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'in_flight': len(self._in_flight),
+                'generations': dict(self._generations),
+                'by_name': {name: {'hits': h, 'misses': m, 'hit_rate': round(h / (h + m), 4)}
+                            for name, (h, m) in sorted(self._by_name.items(), key=lambda kv: str(kv[0]))},
+            }
+
+
+response_cache = ResponseCache()
+
+# Domain events -> invalidation. Writers in this process go through the read
+# model's change feed; refresh() makes it notice other workers' SOS writes.
+read_model.subscribe(lambda event, payload: response_cache.invalidate(SOS_TOPIC))
+response_cache.watch(SOS_TOPIC, read_model.refresh)
+
+
+def cache_key(name, per_user=False, params=()):
+    """(name, role, user, params) for the current session; user is None for role-wide entries."""
+    return (name, session.get('role'), session.get('username') if per_user else None, tuple(params))
+
+
+def cached_serve(key, topics, compute, good=lambda value: True, size_of=approx_size):
+    """(value, stale_since) like degradation.serve(), with cache hits answered before the breaker."""
+    return response_cache.get_or_compute(
+        key, topics, lambda: serve(key, compute, good),
+        size_of=lambda result: None if result[1] is not None else size_of(result[0]))
+
+
+def cached_response(name, topics, build, per_user=False, params=()):
+    """Serve a read-only endpoint from the cache; build() returns the Flask response.
+
+    Only 200 responses are stored (body + headers). Clients get an ETag, so
+    unchanged polls are answered with 304.
+    """
+    def compute():
+        response = build()
+        if isinstance(response, tuple) or response.status_code != 200:
+            return ('uncached', response)
+        body = response.get_data()
+        headers = [(k, v) for k, v in response.headers if k.lower() not in ('content-length', 'set-cookie')]
+        return ('response', (body, headers, hashlib.md5(body).hexdigest()))
+
+    key = cache_key(name, per_user, params)
+    # Database locked / slow: the last good response, marked stale (see degradation.py)
+    (kind, payload), stale_since = cached_serve(
+        key, topics, compute, good=lambda value: value[0] == 'response',
+        size_of=lambda value: len(value[1][0]) + 256 if value[0] == 'response' else None)
+    if kind == 'uncached':
+        return payload
+    body, headers, etag = payload
+    response = Response(body, headers=headers)
+    if stale_since:
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['X-Data-Stale-Seconds'] = str(int(time.time() - stale_since))
+    response.headers['Cache-Control'] = 'private, no-cache'  # Revalidate every poll, cheap 304s
+    response.set_etag(etag)
+    return response.make_conditional(request)
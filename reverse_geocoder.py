@@ -0,0 +1,327 @@
+# reverse_geocoder.py - Offline reverse geocoding of SOS coordinates to regions
+#
+# GAZETTEER_FILE points at a local gazetteer. Two formats are understood:
+#   *.csv      places: region_id,name,latitude,longitude[,district][,level]
+#              -> KD-tree over unit-sphere vectors; a point resolves to the
+#                 nearest place within MAX_MATCH_KM
+#   *.geojson  admin boundaries: Polygon / MultiPolygon features whose
+#              properties carry region_id (or id) and name
+#              -> bounding boxes bucketed by geocell, then point-in-polygon
+#
+# SOS rows are stamped with region_id at ingest (sos_routes). Rows written
+# before that, or before a gazetteer change, are filled in by
+#   python reverse_geocoder.py --backfill
+# which resolves whole batches with one vectorised lookup_many() call.
+import os
+import csv
+import json
+import math
+import logging
+import argparse
+import threading
+import numpy as np
+from geo_utils import EARTH_RADIUS_KM, geocell
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_FILE = os.environ.get('GAZETTEER_FILE', 'gazetteer.csv')
+MAX_MATCH_KM = float(os.environ.get('GAZETTEER_MAX_MATCH_KM', 25))  # Farther than this: no region
+BACKFILL_BATCH_SIZE = 5000
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def _unit_vectors(lats, lngs):
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lng = np.radians(np.asarray(lngs, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)])
+
+
+class PointGazetteer:
+    """Nearest named place, via a KD-tree on 3-D unit vectors (chord ~ great circle)."""
+
+    def __init__(self, regions):
+        from scipy.spatial import cKDTree
+        self.regions = {r['id']: r for r in regions}
+        self._ids = [r['id'] for r in regions]
+        self._tree = cKDTree(_unit_vectors([r['latitude'] for r in regions], [r['longitude'] for r in regions]))
+        # Chord length on the unit sphere equivalent to MAX_MATCH_KM along the surface
+        self._max_chord = 2 * math.sin(min(MAX_MATCH_KM / EARTH_RADIUS_KM, math.pi) / 2)
+
+    @classmethod
+    def load(cls, path):
+        regions = []
+        with open(path, newline='', encoding='utf-8') as fh:
+            for row in csv.DictReader(fh):
+                regions.append({
+                    'id': str(row['region_id']),
+                    'name': row.get('name') or str(row['region_id']),
+                    'district': row.get('district') or None,
+                    'level': row.get('level') or 'place',
+                    'latitude': float(row['latitude']),
+                    'longitude': float(row['longitude'])
+                })
+        if not regions:
+            raise ValueError(f"Gazetteer {path} has no places")
+        return cls(regions)
+
+    def lookup(self, latitude, longitude):
+        dist, idx = self._tree.query(_unit_vectors([latitude], [longitude])[0],
+                                     distance_upper_bound=self._max_chord)
+        return self._ids[idx] if np.isfinite(dist) else None
+
+    def lookup_many(self, lats, lngs):
+        if len(lats) == 0:
+            return []
+        dist, idx = self._tree.query(_unit_vectors(lats, lngs), distance_upper_bound=self._max_chord)
+        return [self._ids[i] if np.isfinite(d) else None for d, i in zip(dist.tolist(), idx.tolist())]
+
+
+class PolygonGazetteer:
+    """Admin boundary polygons with a geocell -> candidate polygon index."""
+
+    def __init__(self, regions, polygons):
+        # polygons: list of (region_id, [ring arrays (n, 2) lng/lat; first = outer, rest = holes])
+        self.regions = {r['id']: r for r in regions}
+        self._polygons = polygons
+        self._bboxes = np.array([[ring[:, 0].min(), ring[:, 1].min(), ring[:, 0].max(), ring[:, 1].max()]
+                                 for _, rings in polygons for ring in rings[:1]])
+        self._cells = {}
+        for i, (min_lng, min_lat, max_lng, max_lat) in enumerate(self._bboxes):
+            r0, c0 = geocell(min_lat, min_lng)
+            r1, c1 = geocell(max_lat, max_lng)
+            for row in range(r0, r1 + 1):
+                for col in range(c0, c1 + 1):
+                    self._cells.setdefault((row, col), []).append(i)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as fh:
+            features = json.load(fh).get('features', [])
+        regions, polygons = [], []
+        for feature in features:
+            props = feature.get('properties') or {}
+            geometry = feature.get('geometry') or {}
+            region_id = str(props.get('region_id') or props.get('id') or props.get('name'))
+            if geometry.get('type') == 'Polygon':
+                parts = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                parts = geometry['coordinates']
+            else:
+                continue
+            for part in parts:
+                polygons.append((region_id, [np.asarray(ring, dtype=np.float64)[:, :2] for ring in part]))
+            outer = np.asarray(parts[0][0], dtype=np.float64)
+            regions.append({
+                'id': region_id,
+                'name': props.get('name') or region_id,
+                'district': props.get('district'),
+                'level': props.get('level') or 'boundary',
+                'latitude': float(outer[:, 1].mean()),
+                'longitude': float(outer[:, 0].mean())
+            })
+        if not polygons:
+            raise ValueError(f"Gazetteer {path} has no polygons")
+        return cls(regions, polygons)
+
+    @staticmethod
+    def _inside(ring, lngs, lats):
+        """Even-odd ray casting of many points against one ring (vectorised over points)."""
+        x0, y0 = ring[:, 0], ring[:, 1]
+        x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+        lngs = lngs[:, None]
+        lats = lats[:, None]
+        crosses = (y0 > lats) != (y1 > lats)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_at = x0 + (lats - y0) * (x1 - x0) / (y1 - y0)
+        return np.count_nonzero(crosses & (lngs < x_at), axis=1) % 2 == 1
+
+    def _contains(self, i, lngs, lats):
+        rings = self._polygons[i][1]
+        inside = self._inside(rings[0], lngs, lats)
+        for hole in rings[1:]:
+            inside &= ~self._inside(hole, lngs, lats)
+        return inside
+
+    def lookup(self, latitude, longitude):
+        lng, lat = np.array([longitude], dtype=np.float64), np.array([latitude], dtype=np.float64)
+        for i in self._cells.get(geocell(latitude, longitude), ()):
+            min_lng, min_lat, max_lng, max_lat = self._bboxes[i]
+            if min_lng <= longitude <= max_lng and min_lat <= latitude <= max_lat and self._contains(i, lng, lat)[0]:
+                return self._polygons[i][0]
+        return None
+
+    def lookup_many(self, lats, lngs):
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        result = [None] * len(lats)
+        unresolved = np.ones(len(lats), dtype=bool)
+        for i, (min_lng, min_lat, max_lng, max_lat) in enumerate(self._bboxes):
+            candidates = np.flatnonzero(unresolved & (lngs >= min_lng) & (lngs <= max_lng)
+                                        & (lats >= min_lat) & (lats <= max_lat))
+            if not len(candidates):
+                continue
+            hits = candidates[self._contains(i, lngs[candidates], lats[candidates])]
+            region_id = self._polygons[i][0]
+            for k in hits.tolist():
+                result[k] = region_id
+            unresolved[hits] = False
+        return result
+
+
+def load_gazetteer(path=GAZETTEER_FILE):
+    if path.lower().endswith(('.geojson', '.json')):
+        return PolygonGazetteer.load(path)
+    return PointGazetteer.load(path)
+
+
+def get_geocoder():
+    """Process-wide gazetteer, loaded on first use; None when no gazetteer is available."""
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            if not os.path.exists(GAZETTEER_FILE):
+                logger.warning(f"⚠️ Gazetteer {GAZETTEER_FILE} not found; SOS alerts are not stamped with regions.")
+                _geocoder = False
+            else:
+                try:
+                    _geocoder = load_gazetteer(GAZETTEER_FILE)
+                    logger.info(f"✅ Gazetteer loaded from {GAZETTEER_FILE}: {len(_geocoder.regions)} regions")
+                    _sync_regions(_geocoder)
+                except Exception as e:
+                    logger.error(f"⚠️ Failed to load gazetteer {GAZETTEER_FILE}: {e}")
+                    _geocoder = False
+    return _geocoder or None
+
+
+def region_for(latitude, longitude):
+    """Region id for a point, or None (no gazetteer / nothing close enough)."""
+    geocoder = get_geocoder()
+    if geocoder is None:
+        return None
+    try:
+        return geocoder.lookup(float(latitude), float(longitude))
+    except Exception as e:
+        logger.warning(f"Reverse geocoding failed for ({latitude}, {longitude}): {e}")
+        return None
+
+
+def regions_for(lats, lngs):
+    """Region ids for many points in one vectorised lookup."""
+    geocoder = get_geocoder()
+    if geocoder is None or not len(lats):
+        return [None] * len(lats)
+    try:
+        return geocoder.lookup_many(np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64))
+    except Exception as e:
+        logger.warning(f"Batch reverse geocoding failed: {e}")
+        return [None] * len(lats)
+
+
+def region_names():
+    geocoder = get_geocoder()
+    return {rid: r['name'] for rid, r in geocoder.regions.items()} if geocoder else {}
+
+
+def _sync_regions(geocoder):
+    """Mirror gazetteer metadata into the regions table so SQL rollups can join names."""
+    from db_config import get_db_connection
+    conn = get_db_connection()
+    try:
+        conn.executemany("""
+            INSERT OR REPLACE INTO regions (id, name, district, level, latitude, longitude)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(r['id'], r['name'], r['district'], r['level'], r['latitude'], r['longitude'])
+              for r in geocoder.regions.values()])
+        conn.commit()
+    except Exception as e:
+        logger.warning(f"⚠️ Could not sync regions table: {e}")
+    finally:
+        conn.close()
+
+
+def backfill_regions(batch_size=BACKFILL_BATCH_SIZE, restamp=False):
+    """Stamp region_id on existing SOS rows, one vectorised lookup per batch. Returns rows updated.
+
+    Rows stay on the shard they were written to; reshard.py --move gathers a
+    region's stamped rows onto its shard.
+    """
+    from db_config import get_db_connection
+    from shard_router import SHARD_COUNT
+    geocoder = get_geocoder()
+    if geocoder is None:
+        return 0
+    updated = 0
+    for shard in range(SHARD_COUNT):
+        conn = get_db_connection(shard)
+        try:
+            updated += _backfill_shard(conn, geocoder, batch_size, restamp)
+        finally:
+            conn.close()
+    logger.info(f"✅ Region backfill stamped {updated} SOS rows")
+    return updated
+
+
+def _backfill_shard(conn, geocoder, batch_size, restamp):
+    from sos_read_model import bump_sos_version
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    where = "" if restamp else "AND region_id IS NULL"
+    last_id, updated = 0, 0
+    while True:
+        cursor.execute(f"""
+            SELECT id, latitude, longitude FROM sos_requests
+            WHERE id > ? {where}
+            ORDER BY id LIMIT ?
+        """, (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        ids, lats, lngs = zip(*rows)
+        regions = geocoder.lookup_many(np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64))
+        changes = [(region, sos_id) for sos_id, region in zip(ids, regions) if region is not None or restamp]
+        cursor.executemany("UPDATE sos_requests SET region_id = ? WHERE id = ?", changes)
+        if changes:
+            bump_sos_version(cursor)  # Read models pick up the new region ids
+        conn.commit()
+        updated += len(changes)
+        last_id = ids[-1]
+    return updated
+
+
+def main(argv=None):
+    import time
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Offline reverse geocoding for SOS alerts")
+    parser.add_argument('--backfill', action='store_true', help="stamp region_id on SOS rows missing it")
+    parser.add_argument('--restamp', action='store_true', help="with --backfill: recompute every row")
+    parser.add_argument('--lookup', nargs=2, type=float, metavar=('LAT', 'LNG'))
+    parser.add_argument('--bench', type=int, metavar='N', help="time N single and N batched lookups")
+    args = parser.parse_args(argv)
+
+    if get_geocoder() is None:
+        parser.error(f"no usable gazetteer at {GAZETTEER_FILE} (set GAZETTEER_FILE)")
+    if args.lookup:
+        region_id = region_for(*args.lookup)
+        print(region_id, get_geocoder().regions.get(region_id))
+    if args.bench:
+        geocoder = get_geocoder()
+        rng = np.random.default_rng(0)
+        coords = np.array([(r['latitude'], r['longitude']) for r in geocoder.regions.values()])
+        lats = rng.uniform(coords[:, 0].min(), coords[:, 0].max(), args.bench)
+        lngs = rng.uniform(coords[:, 1].min(), coords[:, 1].max(), args.bench)
+        t0 = time.perf_counter()
+        for lat, lng in zip(lats.tolist(), lngs.tolist()):
+            geocoder.lookup(lat, lng)
+        t1 = time.perf_counter()
+        geocoder.lookup_many(lats, lngs)
+        t2 = time.perf_counter()
+        print(f"{args.bench} points: single {1e6 * (t1 - t0) / args.bench:.1f} us/lookup, "
+              f"batched {1e6 * (t2 - t1) / args.bench:.2f} us/lookup")
+    if args.backfill:
+        print(f"✅ Stamped {backfill_regions(restamp=args.restamp)} SOS rows with regions")
+
+
+if __name__ == "__main__":
+    main()
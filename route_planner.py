@@ -0,0 +1,231 @@
+# route_planner.py - Multi-stop route planning for volunteers
+#
+# Orders a volunteer's assigned SOS sites (plus the supply depot when they have
+# pending delivery pickups) into a near-optimal visiting sequence:
+#   1. nearest-neighbour construction from the volunteer's position
+#   2. 2-opt improvement, vectorised over NumPy rows of the distance matrix
+#
+# Distances are haversine by default. If ROAD_GRAPH_FILE points at a local JSON
+# road graph ({"nodes": {id: [lat, lng]}, "edges": [[a, b, km], ...]}) stops are
+# snapped to the nearest node and shortest road distances are used instead.
+#
+# Results are cached per volunteer until the set of stops changes.
+import os
+import json
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from geo_utils import EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+ROAD_GRAPH_FILE = os.environ.get('ROAD_GRAPH_FILE')
+DEPOT_LATITUDE = float(os.environ.get('DEPOT_LATITUDE', 13.0827))    # Supply depot (default Chennai)
+DEPOT_LONGITUDE = float(os.environ.get('DEPOT_LONGITUDE', 80.2707))
+MAX_TWO_OPT_PASSES = 50
+ROUTE_CACHE_SIZE = 256
+START_ROUND_DIGITS = 3  # ~100 m: small GPS jitter reuses the cached route
+
+_road_graph = None
+_road_graph_lock = threading.Lock()
+_route_cache = OrderedDict()
+_route_cache_lock = threading.Lock()
+
+
+# ---- distance matrices ---------------------------------------------------------
+def haversine_matrix(coords):
+    """Pairwise great-circle distances (km) for an (n, 2) array of lat/lng."""
+    rad = np.radians(np.asarray(coords, dtype=np.float64))
+    lat = rad[:, 0][:, None]
+    lng = rad[:, 1][:, None]
+    dlat = lat - lat.T
+    dlng = lng - lng.T
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RoadGraph:
+    """Small adjacency-list road graph loaded from a local JSON file."""
+
+    def __init__(self, nodes, edges):
+        self.node_ids = list(nodes)
+        self.coords = np.array([nodes[n] for n in self.node_ids], dtype=np.float64)
+        index = {n: i for i, n in enumerate(self.node_ids)}
+        self.adj = [[] for _ in self.node_ids]
+        for a, b, km in edges:
+            ia, ib = index[str(a)], index[str(b)]
+            self.adj[ia].append((ib, float(km)))
+            self.adj[ib].append((ia, float(km)))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as fh:
+            data = json.load(fh)
+        nodes = {str(k): v for k, v in data['nodes'].items()}
+        return cls(nodes, data['edges'])
+
+    def snap(self, lat, lng):
+        d = (self.coords[:, 0] - lat) ** 2 + ((self.coords[:, 1] - lng) * np.cos(np.radians(lat))) ** 2
+        return int(np.argmin(d))
+
+    def _dijkstra(self, source, targets):
+        dist = {source: 0.0}
+        remaining = set(targets)
+        heap = [(0.0, source)]
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if d > dist.get(u, float('inf')):
+                continue
+            remaining.discard(u)
+            for v, w in self.adj[u]:
+                nd = d + w
+                if nd < dist.get(v, float('inf')):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def distance_matrix(self, coords):
+        snapped = [self.snap(lat, lng) for lat, lng in coords]
+        matrix = haversine_matrix(coords)  # Fallback for disconnected pairs
+        for i, src in enumerate(snapped):
+            dist = self._dijkstra(src, snapped)
+            for j, dst in enumerate(snapped):
+                if i != j and dst in dist:
+                    matrix[i, j] = dist[dst]
+        return matrix
+
+
+def _get_road_graph():
+    global _road_graph
+    if not ROAD_GRAPH_FILE:
+        return None
+    with _road_graph_lock:
+        if _road_graph is None:
+            try:
+                _road_graph = RoadGraph.load(ROAD_GRAPH_FILE)
+                logger.info(f"✅ Road graph loaded from {ROAD_GRAPH_FILE}: {len(_road_graph.node_ids)} nodes")
+            except Exception as e:
+                logger.error(f"⚠️ Failed to load road graph {ROAD_GRAPH_FILE}: {e}. Using haversine distances.")
+                _road_graph = False
+    return _road_graph or None
+
+
+def distance_matrix(coords):
+    graph = _get_road_graph()
+    if graph is not None:
+        return graph.distance_matrix(coords)
+    return haversine_matrix(coords)
+
+
+# ---- TSP heuristics ------------------------------------------------------------
+def nearest_neighbor(dist):
+    """Open path from node 0 always visiting the closest unvisited node next."""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    path = [0]
+    visited[0] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[path[-1]])
+        nxt = int(np.argmin(row))
+        path.append(nxt)
+        visited[nxt] = True
+    return path
+
+
+def two_opt(dist, path, max_passes=MAX_TWO_OPT_PASSES):
+    """Improve an open path (fixed start at path[0]) with 2-opt segment reversals."""
+    n = len(path)
+    if n < 4:
+        return list(path)
+    # Dummy end node at zero distance from everything turns the open path into a
+    # cycle, so one delta formula covers reversals that run to the end.
+    padded = np.zeros((n + 1, n + 1))
+    padded[:n, :n] = dist
+    p = np.array(list(path) + [n])
+    for _ in range(max_passes):
+        improved = False
+        for i in range(0, n - 2):
+            a, b = p[i], p[i + 1]
+            js = np.arange(i + 2, n)
+            c, d = p[js], p[js + 1]
+            delta = padded[a, c] + padded[b, d] - padded[a, b] - padded[c, d]
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = js[best]
+                p[i + 1:j + 1] = p[i + 1:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return [int(x) for x in p[:-1]]
+
+
+def path_length(dist, path):
+    return float(sum(dist[path[k], path[k + 1]] for k in range(len(path) - 1)))
+
+
+def solve(start, stops):
+    """Order `stops` (list of dicts with latitude/longitude) starting from `start` (lat, lng).
+
+    Returns (ordered_stops, total_km).
+    """
+    if not stops:
+        return [], 0.0
+    coords = [start] + [(s['latitude'], s['longitude']) for s in stops]
+    dist = distance_matrix(coords)
+    path = two_opt(dist, nearest_neighbor(dist))
+    ordered = []
+    for order, node in enumerate(path[1:], start=1):
+        stop = dict(stops[node - 1])
+        stop['order'] = order
+        stop['leg_km'] = round(float(dist[path[order - 1], node]), 3)
+        ordered.append(stop)
+    return ordered, path_length(dist, path)
+
+
+# ---- volunteer routes (cached) -------------------------------------------------
+def _cache_key(username, start, stops):
+    stop_key = tuple(sorted((s['type'], s['id'], round(s['latitude'], 5), round(s['longitude'], 5), s.get('label', ''))
+                            for s in stops))
+    start_key = (round(start[0], START_ROUND_DIGITS), round(start[1], START_ROUND_DIGITS))
+    return (username, start_key, stop_key)
+
+
+def plan_volunteer_route(username, stops, start=None):
+    """Cached route for a volunteer's current stops; recomputed only when they change."""
+    if start is None:
+        # No GPS fix: assume the volunteer sets out from the supply depot
+        start = (DEPOT_LATITUDE, DEPOT_LONGITUDE)
+    key = _cache_key(username, start, stops)
+    with _route_cache_lock:
+        cached = _route_cache.get(key)
+        if cached is not None:
+            _route_cache.move_to_end(key)
+            return dict(cached, cached=True)
+    ordered, total_km = solve(start, stops)
+    route = {
+        'start': {'latitude': start[0], 'longitude': start[1]},
+        'stops': ordered,
+        'total_km': round(total_km, 3),
+        'cached': False
+    }
+    with _route_cache_lock:
+        # Drop this volunteer's previous routes: the assignment set has changed
+        for old_key in [k for k in _route_cache if k[0] == username]:
+            del _route_cache[old_key]
+        _route_cache[key] = route
+        while len(_route_cache) > ROUTE_CACHE_SIZE:
+            _route_cache.popitem(last=False)
+    return route
+
+
+def depot_stop(deliveries):
+    """Single pickup stop at the supply depot covering all pending delivery items."""
+    return {
+        'type': 'delivery',
+        'id': 0,
+        'latitude': DEPOT_LATITUDE,
+        'longitude': DEPOT_LONGITUDE,
+        'label': "Depot pickup: " + ", ".join(f"{d['quantity']}x {d['item']}" for d in deliveries)
+    }
@@ -0,0 +1,46 @@
+# serve.py - High-concurrency entry point for the Flask + Socket.IO app
+#
+# Runs the app on green threads so one worker can hold thousands of websocket
+# clients. Blocking sqlite / sklearn work is pushed to a native thread pool via
+# extensions.run_blocking().
+#
+# Usage:
+#   python serve.py                                   # eventlet (default)
+#   SOCKETIO_ASYNC_MODE=gevent python serve.py --port 8000
+#   SOCKETIO_MESSAGE_QUEUE=redis://localhost python serve.py   # several workers
+#
+# Requires `pip install eventlet` (or gevent + gevent-websocket).
+import os
+
+MODE = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'eventlet')
+
+# Monkey patching has to happen before sqlite3, threading, socket etc. are imported
+if MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+import argparse  # noqa: E402
+import logging  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Serve the app with Socket.IO on {MODE}")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--max-connections', type=int, default=10000,
+                        help="concurrent connections per worker (eventlet's default pool is 1024)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from app import app
+    from extensions import socketio
+    logging.getLogger(__name__).info(f"🚀 Serving on http://{args.host}:{args.port} ({socketio.async_mode})")
+    options = {'max_size': args.max_connections} if MODE == 'eventlet' else {}
+    socketio.run(app, host=args.host, port=args.port, **options)
+
+
+if __name__ == "__main__":
+    main()
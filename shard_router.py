@@ -0,0 +1,166 @@
+# shard_router.py - Routes SOS data to regional SQLite shards and fans out cross-region reads
+#
+# With DB_SHARDS set (db_config.py), each region's SOS requests, incidents and
+# notifications live in one shard file, so a surge in one region only contends
+# for that file's writer lock. drms.db is shard 0: it holds every global table,
+# SOS rows without a region, and all data of an unsharded deployment.
+#
+#   region -> shard   region_shards table (home DB); a region seen for the first
+#                     time is placed by a stable hash and the choice persisted
+#   sos id -> shard   ids are allocated per shard in disjoint ranges
+#                     (id // SHARD_ID_SPAN, see allocate_sos_ids); rows moved
+#                     by reshard.py keep their id and are recorded in
+#                     sos_locations. Moved incidents are renumbered instead, so
+#                     an incident id always gives its shard (id_range_shard).
+#
+# Writes: open the owning shard with connect_region() / connect_sos(); the
+# usual single-file transaction then covers the SOS row, its incident and the
+# shard's sos_version counter.
+# Reads across regions: fan_out() runs a function on every shard in parallel
+# (thread pool, one connection each) and returns the per-shard results for the
+# caller to merge (merge_sorted() for ordered lists).
+import heapq
+import zlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from db_config import get_db_connection, SHARD_FILES, SHARD_ID_SPAN
+from extensions import run_blocking
+
+logger = logging.getLogger(__name__)
+
+SHARD_COUNT = len(SHARD_FILES)
+HOME_SHARD = 0
+
+_lock = threading.Lock()
+_region_shards = None  # region_id -> shard, loaded on first use
+_sos_locations = None  # sos_id -> shard for rows moved off their allocating shard
+_executor = None
+
+
+def is_sharded():
+    return SHARD_COUNT > 1
+
+
+def _load_maps():
+    global _region_shards, _sos_locations
+    conn = get_db_connection()
+    try:
+        regions = {row[0]: row[1] for row in conn.execute("SELECT region_id, shard FROM region_shards")}
+        moved = {row[0]: row[1] for row in conn.execute("SELECT sos_id, shard FROM sos_locations")}
+    finally:
+        conn.close()
+    _region_shards, _sos_locations = regions, moved
+
+
+def reload_maps():
+    """Re-read the shard map (after reshard.py changed it)."""
+    with _lock:
+        _load_maps()
+
+
+def default_shard(region_id):
+    """Placement for a region that is not in the map yet."""
+    return zlib.crc32(region_id.encode('utf-8')) % SHARD_COUNT
+
+
+def shard_for_region(region_id):
+    """Owning shard of a region (None = no region -> home shard)."""
+    if region_id is None or not is_sharded():
+        return HOME_SHARD
+    with _lock:
+        if _region_shards is None:
+            _load_maps()
+        shard = _region_shards.get(region_id)
+        if shard is not None:
+            return shard
+        conn = get_db_connection()
+        try:
+            conn.execute("INSERT OR IGNORE INTO region_shards (region_id, shard) VALUES (?, ?)",
+                         (region_id, default_shard(region_id)))
+            conn.commit()
+            shard = conn.execute("SELECT shard FROM region_shards WHERE region_id = ?", (region_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        _region_shards[region_id] = shard
+        logger.info(f"Region {region_id} placed on shard {shard}")
+        return shard
+
+
+def id_range_shard(row_id):
+    """Shard whose id range row_id was allocated in."""
+    return min(int(row_id) // SHARD_ID_SPAN, SHARD_COUNT - 1)
+
+
+def shard_of_id(sos_id):
+    """Shard holding an SOS id."""
+    if not is_sharded():
+        return HOME_SHARD
+    if _sos_locations is None:
+        with _lock:
+            if _sos_locations is None:
+                _load_maps()
+    shard = _sos_locations.get(sos_id)
+    return id_range_shard(sos_id) if shard is None else shard
+
+
+def allocate_sos_ids(cursor, count=1):
+    """Reserve `count` consecutive SOS ids on the cursor's shard; returns the first.
+
+    Ids come from the shard's sqlite_sequence counter: AUTOINCREMENT alone
+    would continue after the largest id present, which is in another shard's
+    range once reshard.py has moved rows in. Call inside the write transaction.
+    """
+    cursor.execute("UPDATE sqlite_sequence SET seq = seq + ? WHERE name = 'sos_requests'", (count,))
+    if cursor.rowcount == 0:  # No SOS inserted here yet
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) "
+                       "SELECT 'sos_requests', COALESCE(MAX(id), 0) + ? FROM sos_requests", (count,))
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sos_requests'")
+    return cursor.fetchone()[0] - count + 1
+
+
+def connect_region(region_id):
+    return get_db_connection(shard_for_region(region_id))
+
+
+def connect_sos(sos_id):
+    return get_db_connection(shard_of_id(sos_id))
+
+
+def group_by_shard(ids):
+    """{shard: [ids]} preserving the input order within each shard."""
+    groups = {}
+    for sos_id in ids:
+        groups.setdefault(shard_of_id(sos_id), []).append(sos_id)
+    return groups
+
+
+def _run_on_shard(fn, shard):
+    conn = get_db_connection(shard)
+    try:
+        return fn(conn, shard)
+    finally:
+        conn.close()
+
+
+def fan_out(fn, shards=None):
+    """[fn(conn, shard) for each shard], run in parallel; each call gets its own connection.
+
+    Results are in shard order. An exception on any shard propagates.
+    """
+    global _executor
+    shards = list(range(SHARD_COUNT)) if shards is None else list(shards)
+    if len(shards) == 1:
+        return [run_blocking(_run_on_shard, fn, shards[0])]
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SHARD_COUNT, thread_name_prefix='shard')
+    futures = [_executor.submit(run_blocking, _run_on_shard, fn, shard) for shard in shards]
+    return [future.result() for future in futures]
+
+
+def merge_sorted(results, key, reverse=False, limit=None):
+    """Merge per-shard lists that are each already sorted by key."""
+    merged = heapq.merge(*results, key=key, reverse=reverse)
+    return list(merged) if limit is None else [row for _, row in zip(range(limit), merged)]
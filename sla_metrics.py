@@ -0,0 +1,192 @@
+# sla_metrics.py - SOS state-transition log and streaming time-to-assign / time-to-resolve percentiles
+#
+# Every SOS status change writes one sos_events row in the same transaction as
+# the UPDATE (record_transition), carrying the seconds elapsed since the SOS was
+# reported plus its region and risk level at that moment. The first move from
+# 'pending' to 'assigned' is a time-to-assign sample, any move into 'resolved'
+# a time-to-resolve sample; reassignments and repeated resolutions are logged
+# but not sampled.
+#
+# SlaMetrics folds samples into LatencySketch objects: log-spaced buckets with
+# SKETCH_RELATIVE_ERROR relative error (the HDR-histogram / DDSketch idea), O(1)
+# per sample and a few KB per sketch however many samples it holds. Each
+# sample updates four slices: (region, risk), (region, all), (all, risk) and
+# (all, all). The aggregator tails sos_events per shard from its last seen id,
+# so every worker sees every worker's transitions; the first request replays
+# the log once, later requests only read new rows.
+import os
+import math
+import logging
+import threading
+from db_config import get_db_connection
+from shard_router import SHARD_COUNT
+
+logger = logging.getLogger(__name__)
+
+SKETCH_RELATIVE_ERROR = float(os.environ.get('SLA_SKETCH_RELATIVE_ERROR', 0.01))
+SKETCH_MIN_SECONDS = 1.0           # Faster samples share the lowest bucket
+SKETCH_MAX_SECONDS = 30 * 86400.0  # Slower samples share the highest bucket
+CATCH_UP_BATCH = 5000              # sos_events rows read per query while tailing
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+ALL = '*'
+METRICS = ('time_to_assign', 'time_to_resolve')
+SLICES = ('region_id', 'risk_level')
+
+
+def record_transition(cursor, sos_id, to_status, actor):
+    """Log a status change of sos_id that was just applied in cursor's transaction.
+
+    The previous status is the last logged one (rows changed before the log
+    existed count as coming from 'pending').
+    """
+    cursor.execute("""
+        INSERT INTO sos_events (sos_id, from_status, to_status, actor, region_id, risk_level,
+                                elapsed_seconds, created_at)
+        SELECT sr.id,
+               COALESCE((SELECT e.to_status FROM sos_events e WHERE e.sos_id = sr.id ORDER BY e.id DESC LIMIT 1),
+                        'pending'),
+               ?, ?, sr.region_id, sr.risk_level,
+               (julianday('now') - julianday(sr.timestamp)) * 86400.0,
+               (julianday('now') - 2440587.5) * 86400.0
+        FROM sos_requests sr WHERE sr.id = ?
+    """, (to_status, actor, sos_id))
+
+
+def sample_metric(from_status, to_status):
+    """Which SLA metric a transition is a sample of, if any."""
+    if to_status == 'assigned' and from_status == 'pending':
+        return 'time_to_assign'
+    if to_status == 'resolved' and from_status != 'resolved':
+        return 'time_to_resolve'
+    return None
+
+
+class LatencySketch:
+    """Streaming histogram of durations in log-spaced buckets (relative error bounded)."""
+
+    __slots__ = ('gamma', 'log_gamma', 'top', 'buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self, relative_error=SKETCH_RELATIVE_ERROR):
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = math.log(self.gamma)
+        self.top = int(math.ceil(math.log(SKETCH_MAX_SECONDS / SKETCH_MIN_SECONDS) / self.log_gamma))
+        self.buckets = {}  # bucket index -> count (sparse: only ranges that occurred)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, seconds):
+        seconds = max(float(seconds), 0.0)
+        if seconds <= SKETCH_MIN_SECONDS:
+            index = 0
+        else:
+            index = min(int(math.ceil(math.log(seconds / SKETCH_MIN_SECONDS) / self.log_gamma)), self.top)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                if index == 0:
+                    value = SKETCH_MIN_SECONDS
+                else:  # Midpoint (in relative terms) of (gamma^(i-1), gamma^i]
+                    value = SKETCH_MIN_SECONDS * 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        result = {'count': self.count}
+        if self.count:
+            result['mean'] = round(self.total / self.count, 1)
+            result['min'] = round(self.min, 1)
+            result['max'] = round(self.max, 1)
+            for q in quantiles:
+                result[f"p{q * 100:g}"] = round(self.quantile(q), 1)
+        return result
+
+
+class SlaMetrics:
+    """Time-to-assign / time-to-resolve sketches per (region, risk level), fed from sos_events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sketches = {metric: {} for metric in METRICS}  # metric -> (region, risk) -> LatencySketch
+        self._high_water = [0] * SHARD_COUNT                 # Last sos_events id folded in, per shard
+        self.events = 0
+
+    def observe(self, metric, seconds, region_id, risk_level):
+        sketches = self._sketches[metric]
+        for key in ((region_id, risk_level), (region_id, ALL), (ALL, risk_level), (ALL, ALL)):
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = LatencySketch()
+            sketch.add(seconds)
+
+    def catch_up(self):
+        """Fold in sos_events rows written since the last call (by any worker). Returns rows read."""
+        with self._lock:
+            read = 0
+            for shard in range(SHARD_COUNT):
+                conn = get_db_connection(shard)
+                try:
+                    while True:
+                        rows = conn.execute("""
+                            SELECT id, from_status, to_status, region_id, risk_level, elapsed_seconds
+                            FROM sos_events WHERE id > ? ORDER BY id LIMIT ?
+                        """, (self._high_water[shard], CATCH_UP_BATCH)).fetchall()
+                        for event_id, from_status, to_status, region_id, risk_level, elapsed in rows:
+                            metric = sample_metric(from_status, to_status)
+                            if metric and elapsed is not None:
+                                self.observe(metric, elapsed, region_id, risk_level)
+                        if rows:
+                            self._high_water[shard] = rows[-1][0]
+                        read += len(rows)
+                        if len(rows) < CATCH_UP_BATCH:
+                            break
+                finally:
+                    conn.close()
+            self.events += read
+            return read
+
+    def summary(self, by=SLICES, quantiles=DEFAULT_QUANTILES):
+        """{metric: [{'region_id', 'risk_level', 'count', 'mean', 'p50', ...}]} sliced by the `by` columns.
+
+        Columns not in `by` are reported as '*' (all).
+        """
+        self.catch_up()
+        result = {}
+        with self._lock:
+            for metric, sketches in self._sketches.items():
+                rows = []
+                for (region_id, risk_level), sketch in sketches.items():
+                    if (region_id == ALL) == ('region_id' in by) or (risk_level == ALL) == ('risk_level' in by):
+                        continue
+                    rows.append(dict(sketch.summary(quantiles), region_id=region_id, risk_level=risk_level))
+                rows.sort(key=lambda row: -row['count'])
+                result[metric] = rows
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'events': self.events, 'sketches': sum(len(s) for s in self._sketches.values()),
+                    'high_water': list(self._high_water)}
+
+
+sla_metrics = SlaMetrics()
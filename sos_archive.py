@@ -0,0 +1,243 @@
+# sos_archive.py - Hot/cold partitioning of resolved SOS requests
+#
+# Resolved SOS rows older than SOS_ARCHIVE_AFTER_DAYS are moved out of the hot
+# `sos_requests` table into `sos_requests_archive` (optionally in a separate
+# database file given by SOS_ARCHIVE_DB), and can also be written out as
+# date-partitioned, gzip-compressed JSONL files.
+#
+# Rows move in small batches, each its own short transaction, so the write lock
+# is never held for long and SOS intake keeps flowing while the archiver runs.
+# With regional shards each shard is archived in turn (into its own
+# sos_requests_archive, or all into the shared SOS_ARCHIVE_DB). Archived rows
+# keep their environmental inputs, incident and region so train_model.py can
+# still learn from them.
+#
+# Usage:
+#   start_archiver()                      # background thread (call once at app startup)
+#   python sos_archive.py --once          # single pass from the command line
+import os
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from db_config import get_db_connection
+from sos_read_model import bump_sos_version
+from shard_router import fan_out, merge_sorted, SHARD_COUNT, HOME_SHARD
+from extensions import run_blocking
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get('SOS_ARCHIVE_AFTER_DAYS', 7))
+ARCHIVE_DB = os.environ.get('SOS_ARCHIVE_DB')  # e.g. 'drms_archive.db'; None = same file
+ARCHIVE_EXPORT_DIR = os.environ.get('SOS_ARCHIVE_EXPORT_DIR')  # e.g. 'archive/sos'
+BATCH_SIZE = 200
+BATCH_PAUSE_SECONDS = 0.05  # Let queued writers in between batches
+RUN_INTERVAL_SECONDS = 3600
+
+ARCHIVE_COLUMNS = ('id', 'user_id', 'username', 'latitude', 'longitude', 'description',
+                   'status', 'risk_level', 'assigned_to', 'timestamp', 'resolved_at',
+                   'rainfall', 'temperature', 'humidity', 'incident_id', 'region_id')
+# Columns added after the first archive schema: name -> type for ALTER TABLE
+_LATER_COLUMNS = {'rainfall': 'REAL', 'temperature': 'REAL', 'humidity': 'REAL',
+                  'incident_id': 'INTEGER', 'region_id': 'TEXT'}
+_COLUMN_LIST = ', '.join(ARCHIVE_COLUMNS)
+
+_archiver_thread = None
+
+
+def _archive_table(conn):
+    """Attach the archive DB if configured, create the table, return its qualified name."""
+    cursor = conn.cursor()
+    table = 'sos_requests_archive'
+    if ARCHIVE_DB:
+        attached = [row[1] for row in cursor.execute("PRAGMA database_list").fetchall()]
+        if 'archive' not in attached:
+            cursor.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB,))
+        table = 'archive.sos_requests_archive'
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            description TEXT NOT NULL,
+            status TEXT NOT NULL,
+            risk_level TEXT,
+            assigned_to TEXT,
+            timestamp TIMESTAMP,
+            resolved_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            rainfall REAL,
+            temperature REAL,
+            humidity REAL,
+            incident_id INTEGER,
+            region_id TEXT
+        )
+    ''')
+    index_prefix = 'archive.' if ARCHIVE_DB else ''
+    cursor.execute(f"PRAGMA {index_prefix}table_info(sos_requests_archive)")
+    columns = [row[1] for row in cursor.fetchall()]
+    for name, kind in _LATER_COLUMNS.items():
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind} DEFAULT NULL")
+            logger.info(f"✅ Added '{name}' column to {table}.")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_prefix}idx_sos_archive_timestamp ON sos_requests_archive (timestamp)")
+    return table
+
+
+def _cutoff(now=None, after_days=None):
+    now = now or datetime.utcnow()
+    days = ARCHIVE_AFTER_DAYS if after_days is None else after_days
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _export_jsonl(rows, export_dir):
+    """Append rows to gzip JSONL files partitioned by SOS date (one gzip member per batch)."""
+    partitions = {}
+    for row in rows:
+        record = dict(zip(ARCHIVE_COLUMNS, row))
+        day = (record.get('timestamp') or 'unknown')[:10]
+        partitions.setdefault(day, []).append(record)
+    for day, records in partitions.items():
+        path = os.path.join(export_dir, f"sos_{day}.jsonl.gz")
+        os.makedirs(export_dir, exist_ok=True)
+        with gzip.open(path, 'at', encoding='utf-8') as fh:
+            for record in records:
+                fh.write(json.dumps(record) + '\n')
+
+
+def archive_batch(conn, cutoff, batch_size=BATCH_SIZE, export_dir=ARCHIVE_EXPORT_DIR):
+    """Move one batch of old resolved SOS rows to the archive. Returns rows moved."""
+    table = _archive_table(conn)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(f"""
+            SELECT {_COLUMN_LIST} FROM sos_requests
+            WHERE status = 'resolved' AND COALESCE(resolved_at, timestamp) < ?
+            ORDER BY id
+            LIMIT ?
+        """, (cutoff, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+        placeholders = ', '.join('?' * len(ARCHIVE_COLUMNS))
+        cursor.executemany(f"INSERT OR REPLACE INTO {table} ({_COLUMN_LIST}) VALUES ({placeholders})", rows)
+        cursor.executemany("DELETE FROM sos_requests WHERE id = ?", [(row[0],) for row in rows])
+        bump_sos_version(cursor)  # Read models reload without the archived rows
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if export_dir:
+        try:
+            _export_jsonl(rows, export_dir)
+        except Exception as e:
+            logger.warning(f"⚠️ JSONL export of archived SOS batch failed (rows are archived in DB): {e}")
+    return len(rows)
+
+
+def run_archive_pass(after_days=None, batch_size=BATCH_SIZE, pause=BATCH_PAUSE_SECONDS):
+    """Archive everything past the cutoff, batch by batch, shard by shard. Returns total rows moved."""
+    cutoff = _cutoff(after_days=after_days)
+    total = 0
+    for shard in range(SHARD_COUNT):
+        conn = get_db_connection(shard)
+        conn.isolation_level = None  # Explicit BEGIN IMMEDIATE per batch
+        try:
+            while True:
+                try:
+                    moved = archive_batch(conn, cutoff, batch_size)
+                except sqlite3.OperationalError as e:
+                    # Busy writer: back off and try again on the next pass
+                    logger.warning(f"⚠️ SOS archive batch skipped on shard {shard} ({e}); will retry later")
+                    break
+                total += moved
+                if moved < batch_size:
+                    break
+                time.sleep(pause)
+        finally:
+            conn.close()
+    if total:
+        logger.info(f"✅ Archived {total} resolved SOS requests older than {cutoff}")
+    return total
+
+
+def start_archiver(interval=RUN_INTERVAL_SECONDS):
+    """Start the background archiver thread (idempotent)."""
+    global _archiver_thread
+    if _archiver_thread and _archiver_thread.is_alive():
+        return _archiver_thread
+
+    def _loop():
+        while True:
+            try:
+                run_blocking(run_archive_pass)  # Native thread under eventlet/gevent
+            except Exception as e:
+                logger.error(f"SOS archiver pass failed: {e}")
+            time.sleep(interval)
+
+    _archiver_thread = threading.Thread(target=_loop, name='sos-archiver', daemon=True)
+    _archiver_thread.start()
+    logger.info(f"SOS archiver started (every {interval}s, archive after {ARCHIVE_AFTER_DAYS} days)")
+    return _archiver_thread
+
+
+def fetch_sos_history(start=None, end=None):
+    """SOS rows in [start, end], newest first.
+
+    Only the hot table is read unless the range reaches back to the newest
+    archived row, in which case archived rows are unioned in (passes run with a
+    shorter --after-days move rows newer than the default cutoff, so the
+    archive itself is the watermark). Shards are read in parallel and merged.
+    """
+    results = fan_out(lambda conn, shard: _shard_history(conn, shard, start, end))
+    return merge_sorted(results, key=lambda row: row['timestamp'] or '', reverse=True)
+
+
+def _shard_history(conn, shard, start, end):
+    params = []
+    where = []
+    if start:
+        where.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        where.append("timestamp <= ?")
+        params.append(end)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    sql = f"SELECT {_COLUMN_LIST} FROM sos_requests {where_sql}"
+    # A shared SOS_ARCHIVE_DB holds every shard's rows: read it once
+    if not ARCHIVE_DB or shard == HOME_SHARD:
+        table = _archive_table(conn)
+        newest = conn.execute(f"SELECT MAX(timestamp) FROM {table}").fetchone()[0]  # Index seek
+        if newest is not None and (start is None or start <= newest):
+            sql += f" UNION ALL SELECT {_COLUMN_LIST} FROM {table} {where_sql}"
+            params = params * 2
+    sql += " ORDER BY timestamp DESC"
+
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Archive resolved SOS requests")
+    parser.add_argument('--once', action='store_true', help="run a single archive pass and exit")
+    parser.add_argument('--after-days', type=float, default=None, help="override SOS_ARCHIVE_AFTER_DAYS")
+    args = parser.parse_args()
+    if args.once:
+        moved = run_archive_pass(after_days=args.after_days)
+        print(f"✅ Archived {moved} SOS requests")
+    else:
+        start_archiver()
+        while True:
+            time.sleep(RUN_INTERVAL_SECONDS)
@@ -0,0 +1,227 @@
+# sos_clustering.py - Near-duplicate SOS detection and incident clustering at ingest
+#
+# During a flood many people report the same incident from the same street. Each
+# new SOS is matched against recent incidents in its clustering cell (and the 8
+# around it) within a sliding time window; candidates are compared with a MinHash
+# signature of the description (LSH banding for the cheap pre-filter) and must be
+# within MAX_INCIDENT_DISTANCE_M of the report, so similar wording from another
+# neighbourhood stays a separate emergency. A match attaches the report to the
+# existing incident instead of creating a new one.
+#
+# Clustering cells are CLUSTER_CELL_DEG wide (about the distance cap), much finer
+# than the ~11 km dashboard geocells, so the neighbourhood scan stays small.
+# Cells narrow east-west away from the equator; a match missed there only means
+# a separate incident, never a wrong merge.
+#
+# Per-insert cost is bounded: at most 9 cells x 2 time buckets x
+# MAX_ENTRIES_PER_BUCKET candidate comparisons of NUM_PERM-length signatures.
+#
+# With regional shards (shard_router.py) incidents live in the shard of their
+# reports; a report only joins incidents of its own shard.
+import os
+import re
+import time
+import zlib
+import logging
+from collections import deque
+from geo_utils import geocell, neighbor_cells, haversine_km
+from shard_router import fan_out, merge_sorted, shard_of_id, id_range_shard
+from extensions import native_lock
+
+logger = logging.getLogger(__name__)
+
+TIME_WINDOW_SECONDS = 30 * 60  # Reports further apart than this are separate incidents
+SIMILARITY_THRESHOLD = 0.3     # Estimated Jaccard similarity of description shingles
+NUM_PERM = 32
+LSH_BANDS = 16  # 2 rows per band: ~95% recall at similarity 0.4
+LSH_ROWS = NUM_PERM // LSH_BANDS
+MAX_ENTRIES_PER_BUCKET = 32
+MAX_INCIDENT_DISTANCE_M = float(os.environ.get('MAX_INCIDENT_DISTANCE_M', 300))  # Report -> incident position
+CLUSTER_CELL_DEG = MAX_INCIDENT_DISTANCE_M / 111320.0  # Cell height = the distance cap (111.32 km per degree)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed (deterministic) permutation parameters so signatures survive restarts
+_PERMUTATIONS = [((i * 0x9E3779B1 + 1) % _MERSENNE_PRIME, (i * 0x85EBCA77 + 7) % _MERSENNE_PRIME)
+                 for i in range(1, NUM_PERM + 1)]
+_RISK_ORDER = {'N/A': 0, 'Unknown': 0, 'Error': 0, 'Low': 1, 'Medium': 2, 'High': 3}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text):
+    """Word bigrams (plus single words, so short descriptions still overlap)."""
+    words = _WORD_RE.findall(text.lower())
+    grams = set(words)
+    grams.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return grams
+
+
+def minhash(text):
+    """NUM_PERM-value MinHash signature of a description."""
+    hashes = [zlib.crc32(g.encode('utf-8')) for g in shingles(text)]
+    if not hashes:
+        return (_MAX_HASH,) * NUM_PERM
+    return tuple(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def band_keys(signature):
+    return {(band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]) for band in range(LSH_BANDS)}
+
+
+def max_risk(a, b):
+    return a if _RISK_ORDER.get(a, 0) >= _RISK_ORDER.get(b, 0) else b
+
+
+def cluster_cell(latitude, longitude):
+    return geocell(latitude, longitude, CLUSTER_CELL_DEG)
+
+
+class IncidentIndex:
+    """Recent incidents bucketed by (geocell, time bucket) for O(1) lookups."""
+
+    def __init__(self, window=TIME_WINDOW_SECONDS):
+        self.window = window
+        self._lock = native_lock()  # assign_incident runs inside run_blocking() transactions
+        self._buckets = {}
+        self._bucket_order = deque()  # (time_bucket, key) in insertion order, for expiry
+        self.warmed = set()  # Shards whose recent incidents have been loaded
+
+    def _time_bucket(self, ts):
+        return int(ts // self.window)
+
+    def _expire(self, now):
+        oldest = self._time_bucket(now) - 1
+        while self._bucket_order and self._bucket_order[0][0] < oldest:
+            _, key = self._bucket_order.popleft()
+            self._buckets.pop(key, None)
+
+    def find(self, latitude, longitude, signature, now=None, shard=None):
+        """Best matching incident id for a new report (of `shard`, if given), or None."""
+        now = now or time.time()
+        cell = cluster_cell(latitude, longitude)
+        max_km = MAX_INCIDENT_DISTANCE_M / 1000.0
+        keys = band_keys(signature)
+        tb = self._time_bucket(now)
+        best_id, best_sim = None, SIMILARITY_THRESHOLD
+        with self._lock:
+            self._expire(now)
+            for c in neighbor_cells(cell):
+                for bucket_time in (tb, tb - 1):
+                    for incident_id, sig, sig_keys, seen, lat, lng in self._buckets.get((c, bucket_time), ()):
+                        if now - seen > self.window or not (keys & sig_keys):
+                            continue
+                        if shard is not None and id_range_shard(incident_id) != shard:
+                            continue
+                        if haversine_km(latitude, longitude, lat, lng) > max_km:
+                            continue
+                        sim = similarity(signature, sig)
+                        if sim >= best_sim:
+                            best_id, best_sim = incident_id, sim
+        return best_id
+
+    def add(self, latitude, longitude, incident_id, signature, now=None):
+        now = now or time.time()
+        key = (cluster_cell(latitude, longitude), self._time_bucket(now))
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = deque(maxlen=MAX_ENTRIES_PER_BUCKET)
+                self._bucket_order.append((key[1], key))
+            bucket.append((incident_id, signature, band_keys(signature), now, latitude, longitude))
+
+
+incident_index = IncidentIndex()
+
+
+def _encode_signature(signature):
+    return ','.join(str(v) for v in signature)
+
+
+def _decode_signature(text):
+    return tuple(int(v) for v in text.split(',')) if text else None
+
+
+def warm_index(cursor, shard=0):
+    """Rebuild the in-memory index from one shard's incidents seen within the window (after restart)."""
+    cursor.execute("""
+        SELECT id, latitude, longitude, signature, CAST(strftime('%s', last_seen) AS INTEGER)
+        FROM incidents
+        WHERE last_seen >= datetime('now', ?)
+    """, (f"-{int(TIME_WINDOW_SECONDS)} seconds",))
+    for incident_id, lat, lng, sig_text, seen in cursor.fetchall():
+        signature = _decode_signature(sig_text)
+        if signature and len(signature) == NUM_PERM:
+            incident_index.add(lat, lng, incident_id, signature, now=float(seen))
+    incident_index.warmed.add(shard)
+
+
+def assign_incident(cursor, sos_id, latitude, longitude, description, risk_level):
+    """Attach a freshly inserted SOS to an incident inside the caller's transaction.
+
+    Returns (incident_id, report_count, is_new_incident).
+    """
+    shard = shard_of_id(sos_id)  # The cursor's shard
+    if shard not in incident_index.warmed:
+        warm_index(cursor, shard)
+    cell = cluster_cell(latitude, longitude)
+    signature = minhash(description)
+    incident_id = incident_index.find(latitude, longitude, signature, shard=shard)
+
+    if incident_id is not None:
+        cursor.execute("SELECT report_count, latitude, longitude, risk_level FROM incidents WHERE id = ?", (incident_id,))
+        row = cursor.fetchone()
+        if row is None:
+            incident_id = None  # Index entry outlived its row (e.g. rolled back)
+        elif haversine_km(latitude, longitude, row[1], row[2]) * 1000.0 > MAX_INCIDENT_DISTANCE_M:
+            incident_id = None  # Near one of its reports, but the incident has drifted away from here
+
+    if incident_id is None:
+        cursor.execute("""
+            INSERT INTO incidents (latitude, longitude, cell_row, cell_col, risk_level, report_count, signature, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, 1, ?, datetime('now'), datetime('now'))
+        """, (latitude, longitude, cell[0], cell[1], risk_level, _encode_signature(signature)))
+        incident_id = cursor.lastrowid
+        report_count, is_new = 1, True
+    else:
+        count, inc_lat, inc_lng, inc_risk = row
+        report_count = count + 1
+        # Running centroid of all reports in the incident
+        new_lat = inc_lat + (latitude - inc_lat) / report_count
+        new_lng = inc_lng + (longitude - inc_lng) / report_count
+        cursor.execute("""
+            UPDATE incidents
+            SET report_count = ?, latitude = ?, longitude = ?, risk_level = ?, last_seen = datetime('now')
+            WHERE id = ?
+        """, (report_count, new_lat, new_lng, max_risk(inc_risk, risk_level), incident_id))
+        is_new = False
+
+    cursor.execute("UPDATE sos_requests SET incident_id = ? WHERE id = ?", (incident_id, sos_id))
+    # Index this report's own signature too, so later reports can match either wording
+    incident_index.add(latitude, longitude, incident_id, signature)
+    return incident_id, report_count, is_new
+
+
+def active_incidents(cursor, limit=100):
+    """Incidents that still have unresolved reports, most recent first."""
+    cursor.execute("""
+        SELECT i.id, i.latitude, i.longitude, i.risk_level, i.report_count,
+               i.first_seen, i.last_seen,
+               SUM(CASE WHEN sr.status != 'resolved' THEN 1 ELSE 0 END) AS open_reports
+        FROM incidents i
+        JOIN sos_requests sr ON sr.incident_id = i.id
+        GROUP BY i.id
+        HAVING open_reports > 0
+        ORDER BY i.last_seen DESC
+        LIMIT ?
+    """, (limit,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def all_active_incidents(limit=100):
+    """active_incidents() across every shard, most recent first."""
+    per_shard = fan_out(lambda conn, shard: active_incidents(conn.cursor(), limit))
+    return merge_sorted(per_shard, key=lambda row: row['last_seen'] or '', reverse=True, limit=limit)
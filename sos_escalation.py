@@ -0,0 +1,272 @@
+# sos_escalation.py - Escalation deadlines for SOS alerts nobody has picked up
+#
+# Every pending SOS gets a deadline ESCALATE_AFTER[risk] seconds after it was
+# reported (or last escalated). If it is still pending then, it is escalated:
+# risk goes up one step (Low -> Medium -> High), escalation_level and
+# escalated_at are stamped on the row, the alert is re-broadcast to volunteers
+# as 'sos_escalated' and admins get the same event on the admin map. The next
+# deadline is armed from the new risk level, up to MAX_ESCALATIONS times.
+#
+# Deadlines live in a binary heap of (deadline, sos_id, seq) with lazy deletion
+# (as in sos_triage.py): arming is O(log n), cancelling drops the dict entry and
+# leaves the heap tuple to be skipped. The scheduler thread sleeps until the
+# earliest deadline, so 100k outstanding timers cost memory (~100 bytes each),
+# not CPU.
+#
+# Timers follow the SOS read model change feed: a pending alert that appears
+# (sos_form, /sos/batch) is armed, an alert that leaves 'pending' (assignment,
+# archive) is cancelled, and a reload (restart, another worker's write)
+# reconciles the heap with the pending set. When a timer fires the row is
+# re-read: if it is no longer pending, or was escalated meanwhile (by another
+# worker), nothing happens or the timer is re-armed at the real deadline. The
+# escalating UPDATE is conditional on the escalation level, so with several
+# workers each escalation happens once.
+#
+# Usage:
+#   start_escalations()      # background thread (call once at app startup)
+import os
+import time
+import heapq
+import calendar
+import logging
+import threading
+from shard_router import connect_sos
+from sos_read_model import read_model, bump_sos_version
+from extensions import socketio, run_blocking
+
+logger = logging.getLogger(__name__)
+
+ESCALATE_AFTER = {  # Seconds an SOS may stay pending at each risk level
+    'High': float(os.environ.get('ESCALATE_AFTER_HIGH', 300)),
+    'Medium': float(os.environ.get('ESCALATE_AFTER_MEDIUM', 900)),
+    'Low': float(os.environ.get('ESCALATE_AFTER_LOW', 1800)),
+}
+DEFAULT_ESCALATE_AFTER = ESCALATE_AFTER['Medium']  # Unknown / N/A risk
+NEXT_RISK = {'Low': 'Medium', 'Medium': 'High', 'High': 'High'}
+MAX_ESCALATIONS = int(os.environ.get('MAX_ESCALATIONS', 3))
+MAX_SLEEP = 30.0  # Upper bound on one wait, so other workers' assignments are picked up
+
+
+def _epoch(timestamp):
+    """SQLite 'YYYY-MM-DD HH:MM:SS' (UTC) -> epoch seconds."""
+    try:
+        return float(calendar.timegm(time.strptime(str(timestamp)[:19], '%Y-%m-%d %H:%M:%S')))
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def deadline_for(risk_level, since):
+    return since + ESCALATE_AFTER.get(risk_level, DEFAULT_ESCALATE_AFTER)
+
+
+class EscalationScheduler:
+    """Heap of escalation deadlines with lazy cancellation, driven by the SOS change feed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._heap = []     # (deadline, sos_id, seq)
+        self._timers = {}   # sos_id -> (seq, deadline)
+        self._seq = 0
+        self._stale = 0
+        self._exhausted = set()  # Pending alerts already escalated MAX_ESCALATIONS times
+        self._thread = None
+        self.fired = self.escalated = self.skipped = 0
+
+    # ---- timers ------------------------------------------------------------------
+    def schedule(self, sos_id, deadline):
+        """Arm (or re-arm) the timer of sos_id."""
+        with self._lock:
+            if sos_id in self._timers:
+                self._stale += 1
+            self._seq += 1
+            self._timers[sos_id] = (self._seq, deadline)
+            earliest = not self._heap or deadline < self._heap[0][0]
+            heapq.heappush(self._heap, (deadline, sos_id, self._seq))
+        if earliest:
+            self._wakeup.set()  # Scheduler may be sleeping past this deadline
+
+    def cancel(self, sos_id):
+        with self._lock:
+            self._exhausted.discard(sos_id)
+            if self._timers.pop(sos_id, None) is not None:
+                self._stale += 1
+                self._compact()
+
+    def _compact(self):
+        """Drop cancelled entries once they outnumber live ones. Caller holds the lock."""
+        if self._stale > len(self._timers) + 1024:
+            self._heap = [(deadline, sos_id, seq) for sos_id, (seq, deadline) in self._timers.items()]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def _pop_due(self, now):
+        """Live timers whose deadline has passed (removed), and seconds until the next one."""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, sos_id, seq = heapq.heappop(self._heap)
+                timer = self._timers.get(sos_id)
+                if timer is not None and timer[0] == seq:
+                    del self._timers[sos_id]
+                    due.append(sos_id)
+                else:
+                    self._stale = max(0, self._stale - 1)
+            wait = self._heap[0][0] - now if self._heap else None
+        return due, wait
+
+    def _arm_alert(self, alert):
+        """Arm a pending alert from the read model (first seen: counted from its report time)."""
+        if alert.get('status') != 'pending':
+            self.cancel(alert['id'])
+        elif alert['id'] not in self._timers and alert['id'] not in self._exhausted:
+            self.schedule(alert['id'], deadline_for(alert.get('risk_level'), _epoch(alert.get('timestamp'))))
+
+    def rebuild(self, alerts):
+        """Reconcile timers with the pending alerts (kept timers keep their deadline)."""
+        pending = {alert['id']: alert for alert in alerts if alert.get('status') == 'pending'}
+        with self._lock:
+            timers = {sos_id: timer for sos_id, timer in self._timers.items() if sos_id in pending}
+            self._exhausted &= set(pending)
+            for sos_id, alert in pending.items():
+                if sos_id not in timers and sos_id not in self._exhausted:
+                    self._seq += 1
+                    timers[sos_id] = (self._seq, deadline_for(alert.get('risk_level'), _epoch(alert.get('timestamp'))))
+            self._timers = timers
+            self._heap = [(deadline, sos_id, seq) for sos_id, (seq, deadline) in timers.items()]
+            heapq.heapify(self._heap)
+            self._stale = 0
+        self._wakeup.set()
+
+    # ---- change feed -------------------------------------------------------------
+    def on_change(self, event, payload):
+        if event == 'reload':
+            self.rebuild(read_model.active_alerts())
+        elif event == 'upsert':
+            self._arm_alert(payload)
+        elif event == 'remove':
+            self.cancel(payload)
+
+    # ---- firing ------------------------------------------------------------------
+    @staticmethod
+    def _escalate(sos_id, now):
+        """Escalate sos_id if still due.
+
+        Returns (alert dict, version) when escalated, (None, deadline) to re-arm,
+        (None, None) when there is nothing left to do and (None, False) once
+        MAX_ESCALATIONS is reached.
+        """
+        conn = connect_sos(sos_id)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT id, username, latitude, longitude, description, status, assigned_to, risk_level, timestamp,
+                       escalation_level, escalated_at
+                FROM sos_requests WHERE id = ?
+            """, (sos_id,))
+            row = cursor.fetchone()
+            if row is None or row['status'] != 'pending':
+                return None, None
+            level = row['escalation_level'] or 0
+            if level >= MAX_ESCALATIONS:
+                return None, False
+            due = deadline_for(row['risk_level'], _epoch(row['escalated_at'] or row['timestamp']))
+            if due > now:
+                return None, due  # Escalated elsewhere, or the risk changed: not due yet
+            risk = NEXT_RISK.get(row['risk_level'], 'Medium')
+            cursor.execute("""
+                UPDATE sos_requests SET risk_level = ?, escalation_level = ?, escalated_at = datetime('now')
+                WHERE id = ? AND status = 'pending' AND COALESCE(escalation_level, 0) = ?
+            """, (risk, level + 1, sos_id, level))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return None, now + 1  # Lost a race with another worker; re-check shortly
+            version = bump_sos_version(cursor)
+            conn.commit()
+            alert = dict(row, risk_level=risk, escalation_level=level + 1, previous_risk_level=row['risk_level'])
+            alert.pop('escalated_at')
+            return alert, version
+        finally:
+            conn.close()
+
+    def fire(self, sos_id, now=None):
+        """Handle one expired timer: escalate, broadcast and re-arm."""
+        now = time.time() if now is None else now
+        self.fired += 1
+        alert, extra = run_blocking(self._escalate, sos_id, now)  # Native thread under eventlet/gevent
+        if alert is None:
+            self.skipped += 1
+            if extra is False:
+                with self._lock:
+                    self._exhausted.add(sos_id)
+            elif extra is not None:
+                self.schedule(sos_id, extra)
+            return None
+        self.escalated += 1
+        if alert['escalation_level'] < MAX_ESCALATIONS:
+            self.schedule(sos_id, deadline_for(alert['risk_level'], now))
+        else:
+            with self._lock:
+                self._exhausted.add(sos_id)
+        read_model.apply_change(sos_id, extra)  # Risk changed: triage rescoring, map caches
+        socketio.emit('sos_escalated', alert, room='volunteer-room')
+        socketio.emit('sos_escalated', alert, room='admin-room')
+        logger.warning(f"⚠️ SOS {sos_id} unattended: escalated to {alert['risk_level']} "
+                       f"(level {alert['escalation_level']}/{MAX_ESCALATIONS})")
+        return alert
+
+    def run_due(self, now=None):
+        """Fire every expired timer. Returns seconds until the next deadline (None if none)."""
+        now = time.time() if now is None else now
+        due, wait = self._pop_due(now)
+        for sos_id in due:
+            try:
+                self.fire(sos_id, now)
+            except Exception as e:
+                logger.error(f"⚠️ Escalation of SOS {sos_id} failed: {e}")
+                self.schedule(sos_id, now + MAX_SLEEP)  # Retry later
+        if due:
+            with self._lock:
+                wait = self._heap[0][0] - time.time() if self._heap else None
+        return wait
+
+    def _loop(self):
+        while True:
+            try:
+                read_model.refresh()  # Picks up other workers' assignments (reload -> rebuild)
+                wait = self.run_due()
+            except Exception as e:
+                logger.error(f"⚠️ Escalation scheduler pass failed: {e}")
+                wait = MAX_SLEEP
+            self._wakeup.wait(MAX_SLEEP if wait is None else min(max(wait, 0.0), MAX_SLEEP))
+            self._wakeup.clear()
+
+    def start(self):
+        """Load pending alerts and start the scheduler thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        read_model.refresh()
+        self.rebuild(read_model.active_alerts())
+        self._thread = threading.Thread(target=self._loop, name='sos-escalation', daemon=True)
+        self._thread.start()
+        logger.info(f"SOS escalation scheduler started: {len(self)} pending alerts armed")
+        return self._thread
+
+    def stats(self):
+        with self._lock:
+            next_deadline = self._heap[0][0] if self._heap else None
+            return {'armed': len(self._timers), 'exhausted': len(self._exhausted), 'heap': len(self._heap),
+                    'next_deadline': next_deadline, 'fired': self.fired, 'escalated': self.escalated,
+                    'skipped': self.skipped}
+
+    def __len__(self):
+        return len(self._timers)
+
+
+escalation_scheduler = EscalationScheduler()
+read_model.subscribe(escalation_scheduler.on_change)
+
+
+def start_escalations():
+    """Start the escalation scheduler (call once at app startup)."""
+    return escalation_scheduler.start()
@@ -0,0 +1,332 @@
+# sos_read_model.py - Process-local read model of SOS alerts
+#
+# Dashboards and map polls used to run the same `sos_requests JOIN users` query on
+# every request. This module keeps the rows in memory as parallel column lists
+# (structure of arrays) with secondary indexes by status, assignee, geocell and
+# region.
+#
+# Writers keep it in sync through a tiny change feed:
+#   version = bump_sos_version(cursor)      # inside the write transaction
+#   conn.commit()
+#   read_model.apply_change(sos_id, version)     # or apply_changes(ids, version)
+#
+# Other workers notice writes through the `sos_version` counter in the DB: if the
+# counter moved past what this process has applied, the model reloads. With
+# regional shards (shard_router.py) every shard has its own counter, the model
+# loads from all shards in parallel and `version` is the tuple of counters; an
+# apply_change() version is the one bumped in the SOS's own shard.
+#
+# Derived in-memory structures (e.g. the triage queue) can subscribe() to the
+# same feed: they receive ('upsert', alert_dict), ('remove', sos_id) or
+# ('reload', None) after each change is applied.
+import threading
+import time
+import logging
+from geo_utils import geocell
+from shard_router import fan_out, group_by_shard, shard_of_id
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) readers re-check the DB version counter for foreign writes
+VERSION_CHECK_INTERVAL = 0.5
+
+ACTIVE_STATUSES = ('pending', 'assigned', 'in_progress')
+ALERT_FIELDS = ('id', 'username', 'latitude', 'longitude', 'description',
+                'status', 'timestamp', 'assigned_to', 'risk_level', 'incident_id', 'region_id')
+
+_ALERT_SELECT = """
+    SELECT
+        sr.id,
+        sr.username,
+        CAST(sr.latitude AS REAL) as latitude,
+        CAST(sr.longitude AS REAL) as longitude,
+        sr.description,
+        sr.status,
+        sr.timestamp,
+        sr.assigned_to,
+        sr.risk_level,
+        sr.incident_id,
+        sr.region_id
+    FROM sos_requests sr
+"""  # username is stored on the row, so shard files need no users table
+
+
+def bump_sos_version(cursor):
+    """Increment the shared SOS change counter; call inside the write transaction."""
+    cursor.execute("UPDATE sos_version SET version = version + 1 WHERE id = 1")
+    cursor.execute("SELECT version FROM sos_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def read_sos_version(cursor):
+    cursor.execute("SELECT version FROM sos_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+# DB reads go through shard_router.fan_out(), which runs each shard's query via
+# run_blocking() so green-thread servers keep serving sockets while sqlite works.
+def _fetch_shard(conn, shard):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    version = read_sos_version(cursor)
+    cursor.execute(_ALERT_SELECT)
+    return version, cursor.fetchall()
+
+
+def _fetch_all():
+    results = fan_out(_fetch_shard)
+    return tuple(version for version, _ in results), [row for _, rows in results for row in rows]
+
+
+def _fetch_many(sos_ids, chunk=500):
+    """Alert rows for the given ids (ids without a row are simply absent)."""
+    groups = group_by_shard(sos_ids)
+
+    def fetch(conn, shard):
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        ids, rows = groups[shard], []
+        for start in range(0, len(ids), chunk):
+            part = ids[start:start + chunk]
+            cursor.execute(_ALERT_SELECT + f" WHERE sr.id IN ({', '.join('?' * len(part))})", part)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    return [row for rows in fan_out(fetch, groups) for row in rows]
+
+
+def _fetch_version():
+    return tuple(fan_out(lambda conn, shard: read_sos_version(conn.cursor())))
+
+
+class SOSReadModel:
+    """Column-oriented in-memory copy of sos_requests with secondary indexes."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None  # Tuple of per-shard counters; None = never loaded
+        self._last_check = 0.0
+        self._listeners = []
+        self._reset()
+
+    def _reset(self):
+        # Parallel columns; a slot index addresses one alert across all of them
+        self._cols = {field: [] for field in ALERT_FIELDS}
+        self._slot_by_id = {}
+        self._free_slots = []
+        self._by_status = {}
+        self._by_assignee = {}
+        self._by_cell = {}
+        self._by_region = {}
+
+    # ---- index maintenance -------------------------------------------------
+    @staticmethod
+    def _index_add(index, key, slot):
+        index.setdefault(key, set()).add(slot)
+
+    @staticmethod
+    def _index_remove(index, key, slot):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(slot)
+            if not bucket:
+                del index[key]
+
+    def _slot_cell(self, slot):
+        lat = self._cols['latitude'][slot]
+        lng = self._cols['longitude'][slot]
+        return geocell(lat or 0.0, lng or 0.0)
+
+    def _unindex(self, slot):
+        self._index_remove(self._by_status, self._cols['status'][slot], slot)
+        self._index_remove(self._by_assignee, self._cols['assigned_to'][slot], slot)
+        self._index_remove(self._by_cell, self._slot_cell(slot), slot)
+        self._index_remove(self._by_region, self._cols['region_id'][slot], slot)
+
+    def _index(self, slot):
+        self._index_add(self._by_status, self._cols['status'][slot], slot)
+        self._index_add(self._by_assignee, self._cols['assigned_to'][slot], slot)
+        self._index_add(self._by_cell, self._slot_cell(slot), slot)
+        self._index_add(self._by_region, self._cols['region_id'][slot], slot)
+
+    def _upsert(self, row):
+        sos_id = row[0]
+        slot = self._slot_by_id.get(sos_id)
+        if slot is not None:
+            self._unindex(slot)
+        elif self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_by_id[sos_id] = slot
+        else:
+            slot = len(self._cols['id'])
+            for field in ALERT_FIELDS:
+                self._cols[field].append(None)
+            self._slot_by_id[sos_id] = slot
+        for field, value in zip(ALERT_FIELDS, row):
+            self._cols[field][slot] = value
+        self._index(slot)
+
+    def _remove(self, sos_id):
+        slot = self._slot_by_id.pop(sos_id, None)
+        if slot is None:
+            return
+        self._unindex(slot)
+        for field in ALERT_FIELDS:
+            self._cols[field][slot] = None
+        self._free_slots.append(slot)
+
+    # ---- loading / change feed ---------------------------------------------
+    def reload(self):
+        version, rows = _fetch_all()
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._upsert(row)
+            self.version = version
+            self._last_check = time.monotonic()
+        logger.info(f"SOS read model loaded: {len(rows)} alerts at version {version}")
+        self._notify('reload', None)
+
+    def subscribe(self, listener):
+        """Register listener(event, payload) for changes applied to the model."""
+        self._listeners.append(listener)
+
+    def _notify(self, event, payload):
+        for listener in self._listeners:
+            try:
+                listener(event, payload)
+            except Exception as e:
+                logger.warning(f"SOS read model listener {listener} failed on {event}: {e}")
+
+    def apply_change(self, sos_id, version):
+        """Apply one committed write (insert or status change) from this process."""
+        self.apply_changes([sos_id], version)
+
+    def apply_changes(self, sos_ids, version):
+        """Apply several rows of one shard written under a single version bump (e.g. a batch insert)."""
+        sos_ids = list(sos_ids)
+        if not sos_ids:
+            return
+        shard = shard_of_id(sos_ids[0])
+        try:
+            with self._lock:
+                if self.version is None:
+                    return  # Not loaded yet; first read will load everything
+                if version is None or version != self.version[shard] + 1:
+                    # Missed another worker's write in between: rebuild
+                    self.version = None
+                    return
+            rows = {row[0]: row for row in _fetch_many(sos_ids)}
+            with self._lock:
+                if self.version is None or version != self.version[shard] + 1:
+                    self.version = None
+                    return
+                for sos_id in sos_ids:
+                    if sos_id in rows:
+                        self._upsert(rows[sos_id])
+                    else:
+                        self._remove(sos_id)
+                self.version = self.version[:shard] + (version,) + self.version[shard + 1:]
+            for sos_id in sos_ids:
+                if sos_id in rows:
+                    self._notify('upsert', dict(zip(ALERT_FIELDS, rows[sos_id])))
+                else:
+                    self._notify('remove', sos_id)
+        except Exception as e:
+            logger.warning(f"SOS read model change for {sos_ids[:5]} failed ({e}); forcing reload")
+            with self._lock:
+                self.version = None
+
+    def refresh(self):
+        """Reload if another worker has written since the last check."""
+        self._ensure_fresh()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        with self._lock:
+            loaded = self.version is not None
+            if loaded and now - self._last_check < VERSION_CHECK_INTERVAL:
+                return
+        if loaded:
+            db_version = _fetch_version()
+            with self._lock:
+                if db_version == self.version:
+                    self._last_check = now
+                    return
+        self.reload()
+
+    # ---- queries -------------------------------------------------------------
+    def _rows(self, slots, fields=ALERT_FIELDS):
+        cols = [self._cols[field] for field in fields]
+        ts = self._cols['timestamp']
+        ids = self._cols['id']
+        ordered = sorted(slots, key=lambda s: (ts[s] or '', ids[s]), reverse=True)
+        return [tuple(col[s] for col in cols) for s in ordered]
+
+    def _dicts(self, slots):
+        return [dict(zip(ALERT_FIELDS, row)) for row in self._rows(slots)]
+
+    def all_alerts(self):
+        """Every alert, newest first (admin dashboard / admin map)."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._dicts(self._slot_by_id.values())
+
+    def active_alerts(self):
+        self._ensure_fresh()
+        with self._lock:
+            slots = set()
+            for status in ACTIVE_STATUSES:
+                slots |= self._by_status.get(status, set())
+            return self._dicts(slots)
+
+    def _volunteer_slots(self, username):
+        return self._by_status.get('pending', set()) | self._by_assignee.get(username, set())
+
+    def alerts_for_volunteer(self, username):
+        """Pending alerts plus those assigned to `username`, newest first."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._dicts(self._volunteer_slots(username))
+
+    def alerts_in_cell(self, cell):
+        self._ensure_fresh()
+        with self._lock:
+            return self._dicts(self._by_cell.get(cell, set()))
+
+    def alerts_in_region(self, region_id):
+        """Alerts stamped with `region_id` (None = not resolved to any region), newest first."""
+        self._ensure_fresh()
+        with self._lock:
+            return self._dicts(self._by_region.get(region_id, set()))
+
+    def counts_by_region(self):
+        """{region_id: {status: count}} rollup straight from the indexes."""
+        self._ensure_fresh()
+        with self._lock:
+            status_of = self._cols['status']
+            rollup = {}
+            for region_id, slots in self._by_region.items():
+                counts = rollup[region_id] = {}
+                for slot in slots:
+                    counts[status_of[slot]] = counts.get(status_of[slot], 0) + 1
+            return rollup
+
+    def compact_rows(self, username=None, region_id=None):
+        """(id, lat, lng, status, risk) tuples for the sos_wire compact format (optionally one region's)."""
+        self._ensure_fresh()
+        with self._lock:
+            slots = self._slot_by_id.values() if username is None else self._volunteer_slots(username)
+            if region_id is not None:
+                slots = self._by_region.get(region_id, set()).intersection(slots)
+            return self._rows(slots, ('id', 'latitude', 'longitude', 'status', 'risk_level'))
+
+    def counts_by_status(self):
+        self._ensure_fresh()
+        with self._lock:
+            return {status: len(slots) for status, slots in self._by_status.items()}
+
+
+read_model = SOSReadModel()
@@ -1,51 +1,33 @@
-from flask import Blueprint, render_template, request, flash, session, redirect, url_for
+from flask import Blueprint, render_template, request, flash, session, redirect, url_for, jsonify
 from db_config import get_db_connection
-import logging
+from shard_router import connect_region, shard_for_region, allocate_sos_ids
+from sos_read_model import read_model, bump_sos_version
+from sos_clustering import assign_incident
+from ai_predict import predict_risk, predict_risk_batch
+from rate_limit import rate_limited
+from reverse_geocoder import region_for, regions_for
+from degradation import breaker, sos_spool, DatabaseUnavailable
+from extensions import run_blocking
 import os
-import numpy as np
+import logging
 import random
-import joblib
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
+import sqlite3
+from datetime import datetime, timedelta, timezone
 
 sos_bp = Blueprint('sos', __name__, url_prefix='/sos')
 logger = logging.getLogger(__name__)
 
+BATCH_MAX_RECORDS = 500                  # Per /sos/batch request
+MAX_CLIENT_KEY_LENGTH = 128
+DEVICE_CLOCK_SKEW = timedelta(minutes=5)  # Device times further ahead than this are clamped to now
+# Older device times (e.g. a phone reset to 1970) are clamped to now as well
+MAX_DEVICE_AGE = timedelta(seconds=float(os.environ.get('SOS_MAX_DEVICE_AGE', 7 * 24 * 3600)))
+RISK_LEVELS = ('Low', 'Medium', 'High')   # Predictions the sos_requests risk_level CHECK accepts (+ 'N/A')
+
 # --- AI Prediction Model Integration ---
-model_path = os.path.join("models", "disaster_model.pkl")
-prediction_model = None
-risk_level_labels = {0: 'Low', 1: 'Medium', 2: 'High'}
-
-def train_and_save_dummy_model_for_sos():
-    logger.warning("⚠️ No trained model found for SOS prediction. Training a dummy model.")
-    data = {
-        'rainfall': [10, 50, 100, 5, 80, 60, 20, 150, 30, 70],
-        'temperature': [25, 30, 35, 20, 40, 28, 32, 38, 27, 33],
-        'humidity': [60, 80, 90, 50, 95, 70, 65, 98, 75, 88],
-        'risk_level': ['Low', 'Medium', 'High', 'Low', 'High', 'Medium', 'Low', 'High', 'Medium', 'High']
-    }
-    df = pd.DataFrame(data)
-    risk_mapping = {'Low': 0, 'Medium': 1, 'High': 2}
-    df['risk_encoded'] = df['risk_level'].map(risk_mapping)
-    X = df[['rainfall', 'temperature', 'humidity']]
-    y = df['risk_encoded']
-    dummy_model = RandomForestClassifier(n_estimators=10, random_state=42)
-    dummy_model.fit(X, y)
-    os.makedirs(os.path.dirname(model_path), exist_ok=True)
-    joblib.dump(dummy_model, model_path)
-    logger.info("✅ Dummy disaster prediction model trained and saved for SOS.")
-    return dummy_model, {v: k for k, v in risk_mapping.items()}
-
-try:
-    if os.path.exists(model_path):
-        prediction_model = joblib.load(model_path)
-        risk_level_labels = {0: 'Low', 1: 'Medium', 2: 'High'}
-        logger.info("✅ Disaster prediction model loaded successfully for SOS.")
-    else:
-        prediction_model, risk_level_labels = train_and_save_dummy_model_for_sos()
-except Exception as e:
-    logger.error(f"⚠️ Error loading model for SOS prediction: {e}. Falling back to dummy mode.")
-    prediction_model = None
+# The model is trained offline (train_model.py) and served by ai_predict; nothing
+# is trained here. predict_risk() shares its prediction cache with every other
+# caller and returns None when no model is registered.
 
 def get_environmental_data(latitude, longitude):
     if 10 <= latitude <= 15 and 75 <= longitude <= 85:
@@ -62,7 +44,13 @@ def get_environmental_data(latitude, longitude):
         humidity = random.uniform(40, 90)
     return rainfall, temperature, humidity
 
+
+def _stored_risk_level(prediction):
+    """risk_level for sos_requests: the prediction, or 'N/A' when it failed / is not a known level."""
+    return prediction if prediction in RISK_LEVELS else 'N/A'
+
 @sos_bp.route('/', methods=['GET', 'POST'])  # URL: /sos (simple, no sub-path 404)
+@rate_limited('sos')
 def sos_form():
     if 'username' not in session:
         flash("Please login first.", "danger")
@@ -94,34 +82,48 @@ def sos_form():
             return render_template('sos_form.html', username=username)
         
         predicted_risk_level = 'Unknown'
+        rainfall = temperature = humidity = None
         try:
             rainfall, temperature, humidity = get_environmental_data(lat, lng)
-            if prediction_model:
-                X = np.array([[rainfall, temperature, humidity]])
-                prediction_encoded = prediction_model.predict(X)[0]
-                predicted_risk_level = risk_level_labels.get(prediction_encoded, 'Unknown')
+            prediction = predict_risk([rainfall, temperature, humidity])
+            if prediction is not None:
+                predicted_risk_level = prediction
                 logger.info(f"Auto-predicted risk for SOS at ({lat}, {lng}): {predicted_risk_level}")
             else:
-                predicted_risk_level = random.choice(['Low', 'Medium', 'High'])
+                predicted_risk_level = random.choice(RISK_LEVELS)
                 logger.warning(f"Dummy auto-prediction for SOS: {predicted_risk_level} (Model not loaded)")
         except Exception as e:
             logger.error(f"Error during auto-prediction for SOS: {e}")
             predicted_risk_level = 'Error'
+        predicted_risk_level = _stored_risk_level(predicted_risk_level)  # 'Error' / 'Unknown' violate the CHECK
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO sos_requests (user_id, username, latitude, longitude, description, status, risk_level, timestamp)
-            VALUES (?, ?, ?, ?, ?, 'pending', ?, datetime('now'))
-        """, (session['user_id'], username, lat, lng, description, predicted_risk_level))
-        conn.commit()
-        sos_id = cursor.lastrowid
+        region_id = region_for(lat, lng)  # Offline gazetteer lookup; None without one
         
-        # Fetch the timestamp from the newly inserted row for the emit
-        cursor.execute("SELECT timestamp FROM sos_requests WHERE id = ?", (sos_id,))
-        timestamp = cursor.fetchone()[0]
-        
-        conn.close()
+        try:
+            sos_id, version, timestamp, incident_id, report_count, is_new_incident = breaker.call(
+                run_blocking, _insert_sos, session['user_id'], username, lat, lng, description, predicted_risk_level,
+                (rainfall, temperature, humidity), region_id)
+        except (DatabaseUnavailable, sqlite3.OperationalError) as e:
+            # Database locked / degraded: keep the report locally, it is stored as soon as the DB recovers
+            logger.error(f"⚠️ Could not store SOS from {username} ({e}); spooling it")
+            try:
+                reference = sos_spool.add(session['user_id'], username, {
+                    'latitude': lat, 'longitude': lng, 'description': description,
+                    'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')})
+            except Exception as spool_e:
+                logger.error(f"❌ SOS spool failed for {username}: {spool_e}")
+                flash("Could not send your SOS right now. Please retry immediately or call emergency services.",
+                      "danger")
+                return render_template('sos_form.html', username=username)
+            flash(f"SOS received (reference {reference[-8:]}). The system is under heavy load: your alert is "
+                  f"queued and will reach responders within moments. Do not resend. 🚨", "warning")
+            return redirect(url_for('sos.sos_form'))
+        except sqlite3.Error as e:
+            # Not a capacity problem (e.g. a constraint violation): spooling would only fail again later
+            logger.error(f"Error storing SOS from {username}: {e}")
+            flash("Could not send your SOS. Please retry or call emergency services.", "danger")
+            return render_template('sos_form.html', username=username)
+        read_model.apply_change(sos_id, version)
         
         flash(f"SOS alert sent successfully! ID: {sos_id}. Predicted Risk: {predicted_risk_level}. Help is on the way! 🚨", "success")
         
@@ -129,7 +131,18 @@ def sos_form():
         try:
             # FIXED: Import socketio instance from app.py and use it explicitly
             from app import socketio
-            if socketio:
+            if socketio and not is_new_incident:
+                # Duplicate report: one small incident update instead of a full new alert
+                socketio.emit('incident_updated', {
+                    'incident_id': incident_id,
+                    'report_count': report_count,
+                    'sos_id': sos_id,
+                    'risk_level': predicted_risk_level,
+                    'timestamp': timestamp,
+                    'region_id': region_id
+                }, broadcast=True, include_self=False)
+                logger.info(f"✅ Incident {incident_id} update broadcasted for SOS {sos_id}")
+            elif socketio:
                 emitted_data = {
                     'id': sos_id,
                     'username': username,
@@ -139,7 +152,10 @@ def sos_form():
                     'status': 'pending',
                     'risk_level': predicted_risk_level,
                     'timestamp': timestamp,
-                    'assigned_to': None
+                    'assigned_to': None,
+                    'incident_id': incident_id,
+                    'report_count': report_count,
+                    'region_id': region_id
                 }
                 logger.debug(f"Emitting new_sos_alert: {emitted_data}")
                 socketio.emit('new_sos_alert', emitted_data, broadcast=True, include_self=False) # Use socketio.emit
@@ -155,3 +171,320 @@ def sos_form():
     
     # GET: Render SOS form (with optional SOS button for dashboard integration)
     return render_template('sos_form.html', username=username)
+
+
+def _insert_sos(user_id, username, lat, lng, description, risk_level, environment, region_id):
+    """Store one SOS in its region's shard in one transaction (SQL only: called through run_blocking).
+
+    Returns (sos_id, version, timestamp, incident_id, report_count, is_new_incident).
+    """
+    rainfall, temperature, humidity = environment
+    conn = connect_region(region_id)  # The region's shard (drms.db when unsharded)
+    try:
+        cursor = conn.cursor()
+        sos_id = allocate_sos_ids(cursor)
+        cursor.execute("""
+            INSERT INTO sos_requests (id, user_id, username, latitude, longitude, description, status, risk_level,
+                                      timestamp, rainfall, temperature, humidity, region_id)
+            VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, datetime('now'), ?, ?, ?, ?)
+        """, (sos_id, user_id, username, lat, lng, description, risk_level,
+              rainfall, temperature, humidity, region_id))
+        
+        # Attach near-duplicate reports (same area, similar wording, recent) to one incident
+        incident_id, report_count, is_new_incident = None, 1, True
+        try:
+            incident_id, report_count, is_new_incident = assign_incident(
+                cursor, sos_id, lat, lng, description, risk_level)
+            if not is_new_incident:
+                logger.info(f"SOS {sos_id} attached to incident {incident_id} ({report_count} reports)")
+        except sqlite3.OperationalError:
+            raise  # Locked / busy: the whole report is retried from the spool
+        except Exception as e:
+            logger.error(f"⚠️ Incident clustering failed for SOS {sos_id}: {e}")
+        
+        version = bump_sos_version(cursor)
+        conn.commit()
+        
+        # Fetch the timestamp from the newly inserted row for the emit
+        cursor.execute("SELECT timestamp FROM sos_requests WHERE id = ?", (sos_id,))
+        timestamp = cursor.fetchone()[0]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return sos_id, version, timestamp, incident_id, report_count, is_new_incident
+
+
+# ---------------------------------------------------------------------------
+# Store-and-forward batch ingest
+# ---------------------------------------------------------------------------
+# Field devices queue SOS reports while offline and flush them on reconnect:
+#
+#   POST /sos/batch  {"reports": [{"client_key": "dev42-0007", "latitude": 13.05,
+#                                  "longitude": 80.21, "description": "...",
+#                                  "device_timestamp": "2026-10-19T07:55:12Z"}, ...]}
+#
+# client_key is generated on the device and makes retries idempotent: a key this
+# user has already submitted returns the original SOS instead of a new one.
+# Every record gets its own result; invalid records never fail the batch.
+def _parse_device_timestamp(value, now):
+    """Device time (ISO-8601 or epoch seconds) -> SQLite UTC 'YYYY-MM-DD HH:MM:SS'."""
+    if isinstance(value, bool):
+        raise ValueError("device_timestamp must be a string or a number")  # bool is an int subclass
+    if value in (None, ''):
+        reported = now
+    elif isinstance(value, (int, float)):
+        reported = datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+    else:
+        reported = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        if reported.tzinfo is not None:
+            reported = reported.astimezone(timezone.utc).replace(tzinfo=None)
+    if reported > now + DEVICE_CLOCK_SKEW or reported < now - MAX_DEVICE_AGE:
+        reported = now  # Device clock is wrong; arrival time is the best we have
+    return reported.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _validate_batch_record(record, now):
+    """Normalised record dict, or ValueError with a client-facing message."""
+    if not isinstance(record, dict):
+        raise ValueError("Record must be an object")
+    client_key = record.get('client_key')
+    if not isinstance(client_key, str) or not client_key.strip() or len(client_key) > MAX_CLIENT_KEY_LENGTH:
+        raise ValueError(f"client_key must be a non-empty string of at most {MAX_CLIENT_KEY_LENGTH} characters")
+    description = str(record.get('description') or '').strip()
+    if len(description) < 10:
+        raise ValueError("Description must be at least 10 characters")
+    try:
+        lat = float(record.get('latitude'))
+        lng = float(record.get('longitude'))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid latitude/longitude. Use decimal degrees.")
+    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        raise ValueError("Invalid coordinates")
+    try:
+        timestamp = _parse_device_timestamp(record.get('device_timestamp'), now)
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError("Invalid device_timestamp")
+    return {'client_key': client_key.strip(), 'latitude': lat, 'longitude': lng,
+            'description': description, 'timestamp': timestamp}
+
+
+def _ids_for_keys(cursor, user_id, keys, chunk=500):
+    ids = {}
+    for start in range(0, len(keys), chunk):
+        part = keys[start:start + chunk]
+        cursor.execute(f"""
+            SELECT client_key, id, risk_level, incident_id FROM sos_requests
+            WHERE user_id = ? AND client_key IN ({', '.join('?' * len(part))})
+        """, [user_id] + part)
+        ids.update({row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()})
+    return ids
+
+
+def _predict_batch(records):
+    """Environmental inputs + one batched model call for record dicts; sets their risk_level."""
+    if not records:
+        return
+    env = [get_environmental_data(r['latitude'], r['longitude']) for r in records]
+    try:
+        predictions = predict_risk_batch(env)
+    except Exception as e:
+        logger.error(f"Error during batch auto-prediction for SOS: {e}")
+        predictions = ['Error'] * len(records)
+    for record, (rainfall, temperature, humidity), prediction in zip(records, env, predictions):
+        if prediction is None:  # No model registered: dummy mode, as in sos_form
+            prediction = random.choice(RISK_LEVELS)
+        record.update(rainfall=rainfall, temperature=temperature, humidity=humidity,
+                      risk_level=_stored_risk_level(prediction))
+
+
+def _ingest_shard_batch(shard, records, user_id, username, results):
+    """Store one shard's part of a batch in one transaction; fills results in place.
+
+    Records are already predicted (_predict_batch). SQL only: called through run_blocking.
+    Returns (new_ids, version, alerts, incident_updates); the events exist only
+    once the transaction has committed.
+    """
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    new_ids, alerts, incident_updates = [], [], []
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        existing = _ids_for_keys(cursor, user_id, [r['client_key'] for _, r in records])
+        fresh = [(i, r) for i, r in records if r['client_key'] not in existing]
+        inserted = {}
+        
+        if fresh:
+            # Plain INSERT: duplicates were filtered above under the write lock, and OR IGNORE would also
+            # silently drop rows failing a CHECK
+            first_id = allocate_sos_ids(cursor, len(fresh))
+            cursor.executemany("""
+                INSERT INTO sos_requests (id, user_id, username, latitude, longitude, description, status,
+                                          risk_level, timestamp, rainfall, temperature, humidity, client_key,
+                                          region_id)
+                VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?, ?, ?, ?, ?)
+            """, [(first_id + n, user_id, username, r['latitude'], r['longitude'], r['description'], r['risk_level'],
+                   r['timestamp'], r['rainfall'], r['temperature'], r['humidity'], r['client_key'], r['region_id'])
+                  for n, (_, r) in enumerate(fresh)])
+            inserted = _ids_for_keys(cursor, user_id, [r['client_key'] for _, r in fresh])
+        
+        for i, record in fresh:
+            sos_id = inserted[record['client_key']][0]
+            incident_id, report_count, is_new_incident = None, 1, True
+            try:
+                incident_id, report_count, is_new_incident = assign_incident(
+                    cursor, sos_id, record['latitude'], record['longitude'], record['description'], record['risk_level'])
+            except Exception as e:
+                logger.error(f"⚠️ Incident clustering failed for SOS {sos_id}: {e}")
+            new_ids.append(sos_id)
+            results[i] = {'index': i, 'client_key': record['client_key'], 'status': 'created', 'id': sos_id,
+                          'risk_level': record['risk_level'], 'incident_id': incident_id,
+                          'region_id': record['region_id']}
+            if is_new_incident:
+                alerts.append({
+                    'id': sos_id,
+                    'username': username,
+                    'description': record['description'],
+                    'latitude': record['latitude'],
+                    'longitude': record['longitude'],
+                    'status': 'pending',
+                    'risk_level': record['risk_level'],
+                    'timestamp': record['timestamp'],
+                    'assigned_to': None,
+                    'incident_id': incident_id,
+                    'report_count': report_count,
+                    'region_id': record['region_id']
+                })
+            else:
+                incident_updates.append({'incident_id': incident_id, 'report_count': report_count, 'sos_id': sos_id,
+                                         'risk_level': record['risk_level'], 'timestamp': record['timestamp'],
+                                         'region_id': record['region_id']})
+        
+        for i, record in records:
+            if record['client_key'] in existing:
+                sos_id, risk_level, incident_id = existing[record['client_key']]
+                results[i] = {'index': i, 'client_key': record['client_key'], 'status': 'duplicate', 'id': sos_id,
+                              'risk_level': risk_level, 'incident_id': incident_id}
+        
+        version = bump_sos_version(cursor) if new_ids else None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return new_ids, version, alerts, incident_updates
+
+
+@sos_bp.route('/batch', methods=['POST'])
+@rate_limited('sos')
+def sos_batch():
+    if 'username' not in session or session.get('role', 'user') != 'user':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    payload = request.get_json(silent=True)
+    records = payload.get('reports') if isinstance(payload, dict) else payload
+    if not isinstance(records, list) or not records:
+        return jsonify({'error': 'Expected a JSON list of reports'}), 400
+    if len(records) > BATCH_MAX_RECORDS:
+        return jsonify({'error': f'At most {BATCH_MAX_RECORDS} reports per batch'}), 413
+    
+    user_id, username = session['user_id'], session['username']
+    now = datetime.utcnow()
+    results = [None] * len(records)
+    first_index = {}  # client_key -> index of its first valid record in this batch
+    valid = []        # (index, record)
+    for i, raw in enumerate(records):
+        try:
+            record = _validate_batch_record(raw, now)
+        except ValueError as e:
+            key = raw.get('client_key') if isinstance(raw, dict) else None
+            results[i] = {'index': i, 'client_key': key, 'status': 'invalid', 'error': str(e)}
+            continue
+        if record['client_key'] in first_index:
+            results[i] = {'index': i, 'client_key': record['client_key'], 'status': 'duplicate'}
+            continue
+        first_index[record['client_key']] = i
+        valid.append((i, record))
+    
+    try:
+        alerts, incident_updates = _store_batch(valid, user_id, username, results, spool=True)
+    except Exception as e:
+        logger.error(f"Error ingesting SOS batch from {username}: {e}")
+        return jsonify({'error': 'Failed to store SOS batch'}), 500
+    
+    # In-batch repeats of a key point at the record that was stored for it
+    for i, result in enumerate(results):
+        if result['status'] == 'duplicate' and 'id' not in result:
+            original = results[first_index[result['client_key']]]
+            result.update({k: original.get(k) for k in ('id', 'risk_level', 'incident_id')})
+    
+    _broadcast_batch(username, alerts, incident_updates)
+    
+    counts = {'created': 0, 'duplicate': 0, 'invalid': 0, 'queued': 0}
+    for result in results:
+        counts[result['status']] += 1
+    logger.info(f"SOS batch from {username}: {counts}")
+    return jsonify(dict(counts, received=len(records), results=results))
+
+
+def _store_batch(valid, user_id, username, results, spool=False):
+    """Store validated (index, record) pairs, each in its region's shard. Returns (alerts, incident_updates).
+
+    Every shard commits its part on its own; a failure after some shards
+    committed is safe to retry (their keys come back as duplicates). With
+    spool=True a shard the database cannot take now (locked, circuit open) has
+    its records spooled and reported as 'queued' instead of failing the batch.
+    """
+    region_ids = regions_for([r['latitude'] for _, r in valid], [r['longitude'] for _, r in valid]) if valid else []
+    by_shard = {}
+    for (i, record), region_id in zip(valid, region_ids):
+        record['region_id'] = region_id
+        by_shard.setdefault(shard_for_region(region_id), []).append((i, record))
+    # Predicted here, before any transaction: the model's cache and reload locks belong to the hub
+    # (records that turn out to be retried keys just ignore theirs)
+    _predict_batch([record for _, record in valid])
+    
+    alerts, incident_updates = [], []
+    for shard, shard_records in by_shard.items():
+        try:
+            new_ids, version, shard_alerts, shard_updates = breaker.call(
+                run_blocking, _ingest_shard_batch, shard, shard_records, user_id, username, results)
+        except (DatabaseUnavailable, sqlite3.OperationalError) as e:
+            if not spool:
+                raise
+            logger.error(f"⚠️ Could not store SOS batch part from {username} (shard {shard}: {e}); spooling it")
+            for i, record in shard_records:
+                sos_spool.add(user_id, username, {k: record[k] for k in
+                                                  ('client_key', 'latitude', 'longitude', 'description', 'timestamp')})
+                results[i] = {'index': i, 'client_key': record['client_key'], 'status': 'queued'}
+            continue
+        alerts.extend(shard_alerts)
+        incident_updates.extend(shard_updates)
+        if new_ids:
+            read_model.apply_changes(new_ids, version)
+    return alerts, incident_updates
+
+
+def _broadcast_batch(username, alerts, incident_updates):
+    """One coalesced event for a whole batch instead of one per report."""
+    if not (alerts or incident_updates):
+        return
+    try:
+        from extensions import socketio
+        socketio.emit('new_sos_alerts', {'alerts': alerts, 'incident_updates': incident_updates})
+        logger.info(f"✅ SOS batch from {username} broadcasted: {len(alerts)} alerts, "
+                    f"{len(incident_updates)} incident updates")
+    except Exception as e:
+        logger.error(f"⚠️ SocketIO broadcast failed for SOS batch from {username}: {e}")
+
+
+def _replay_spooled(user_id, username, records):
+    """Spool drain (degradation.py): store reports queued while the database was unavailable."""
+    results = [None] * len(records)
+    alerts, incident_updates = _store_batch(list(enumerate(records)), user_id, username, results)
+    _broadcast_batch(username, alerts, incident_updates)
+
+
+sos_spool.set_ingest(_replay_spooled)
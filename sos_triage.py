@@ -0,0 +1,302 @@
+# sos_triage.py - Live triage priority queue for pending SOS alerts
+#
+# Pending alerts are kept in a binary heap ordered by triage score:
+#
+#   score(t) = RISK_WEIGHTS[risk] + CLUSTER_WEIGHT * log2(cluster_size)
+#              + AGING_PER_MINUTE * minutes_waiting(t)
+#
+# Aging is applied lazily: the waiting-time term grows at the same rate for
+# every alert, so the heap is keyed on score(t) - AGING_PER_MINUTE * t, a value
+# that never changes after insert. Nothing is ever rescored as time passes.
+#
+# The cluster term is kept per incident, not per alert: each incident (or lone
+# alert) has its own member heap keyed without it, and the top-level heap holds
+# one entry per incident keyed on its best member plus its cluster term. A new
+# report is one push into its incident's heap plus one top-level push, O(log n)
+# however large the incident; the term is added to members as they are read.
+#
+# Top-k walks the incident heap best-first and merges the member heaps of the
+# incidents it opens, so a query costs O(k log k) on top of the O(log n) heap
+# maintenance. Per-volunteer queries subtract a distance penalty; since that
+# penalty is never negative, the walk stops once no remaining alert can beat
+# the current k-th best.
+#
+# The queue is fed by the SOS read model change feed (see sos_read_model.py),
+# and changes to the global top-k are pushed over Socket.IO.
+import math
+import heapq
+import calendar
+import logging
+import threading
+import time
+from geo_utils import haversine_km
+from sos_read_model import read_model
+
+logger = logging.getLogger(__name__)
+
+RISK_WEIGHTS = {'High': 100.0, 'Medium': 60.0, 'Low': 30.0}
+DEFAULT_RISK_WEIGHT = 40.0     # Unknown / N/A risk sits between Low and Medium
+AGING_PER_MINUTE = 1.0         # One hour of waiting is worth +60
+CLUSTER_WEIGHT = 15.0          # Per doubling of reports in the same incident
+DISTANCE_PER_KM = 2.0          # Per-volunteer penalty for distance to the SOS
+PUSH_TOP_K = 10                # Size of the top list pushed over Socket.IO
+
+
+def _epoch_minutes(timestamp):
+    """SQLite 'YYYY-MM-DD HH:MM:SS' (UTC) -> minutes since the epoch."""
+    try:
+        return calendar.timegm(time.strptime(str(timestamp)[:19], '%Y-%m-%d %H:%M:%S')) / 60.0
+    except (TypeError, ValueError):
+        return time.time() / 60.0
+
+
+class TriageQueue:
+    """Heap of pending SOS alerts with lazy deletion and lazy aging."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+        self._built = False
+        self._last_pushed = None
+
+    def _clear(self):
+        self._heap = []          # (-group_key, group, group_seq): one live entry per group
+        self._entries = {}       # sos_id -> (seq, alert)
+        self._groups = {}        # group -> {'heap': [(-member_key, sos_id, seq)], 'members': set, 'seq': n}
+        self._seq = 0
+        self._stale = 0
+
+    # ---- scoring -------------------------------------------------------------
+    @staticmethod
+    def _group(alert):
+        """Alerts of one incident share a group; an alert without one is its own."""
+        incident_id = alert.get('incident_id')
+        return ('incident', incident_id) if incident_id is not None else ('sos', alert['id'])
+
+    @staticmethod
+    def _member_key(alert):
+        base = RISK_WEIGHTS.get(alert.get('risk_level'), DEFAULT_RISK_WEIGHT)
+        # score(t) = base + AGING * (t - created)  ->  key = base - AGING * created
+        return base - AGING_PER_MINUTE * _epoch_minutes(alert.get('timestamp'))
+
+    @staticmethod
+    def _cluster_bonus(size):
+        return CLUSTER_WEIGHT * math.log2(max(1, size))
+
+    @staticmethod
+    def score_at(key, now_minutes):
+        return key + AGING_PER_MINUTE * now_minutes
+
+    # ---- maintenance (caller holds the lock) -----------------------------------
+    def _live(self, sos_id, seq):
+        entry = self._entries.get(sos_id)
+        return entry is not None and entry[0] == seq
+
+    def _refresh_group(self, group):
+        """Re-key group in the top-level heap after its members changed."""
+        state = self._groups.get(group)
+        if state is None:
+            return
+        heap = state['heap']
+        while heap and not self._live(heap[0][1], heap[0][2]):
+            heapq.heappop(heap)
+            self._stale -= 1
+        if state['seq']:
+            self._stale += 1  # Its previous top-level entry
+        if not heap:
+            del self._groups[group]
+            return
+        self._seq += 1
+        state['seq'] = self._seq
+        key = -heap[0][0] + self._cluster_bonus(len(state['members']))
+        heapq.heappush(self._heap, (-key, group, self._seq))
+
+    def _push(self, alert):
+        sos_id = alert['id']
+        if sos_id in self._entries:
+            self._stale += 1
+        self._seq += 1
+        self._entries[sos_id] = (self._seq, alert)
+        group = self._group(alert)
+        state = self._groups.setdefault(group, {'heap': [], 'members': set(), 'seq': 0})
+        state['members'].add(sos_id)
+        heapq.heappush(state['heap'], (-self._member_key(alert), sos_id, self._seq))
+        self._refresh_group(group)
+
+    def _discard(self, sos_id):
+        entry = self._entries.pop(sos_id, None)
+        if entry is None:
+            return
+        self._stale += 1
+        group = self._group(entry[1])
+        state = self._groups.get(group)
+        if state is not None:
+            state['members'].discard(sos_id)
+            self._refresh_group(group)
+
+    def _compact(self):
+        # Drop lazily deleted entries once they dominate the heaps
+        if self._stale > 64 and self._stale > len(self._entries):
+            for state in self._groups.values():
+                state['heap'] = [item for item in state['heap'] if self._live(item[1], item[2])]
+                heapq.heapify(state['heap'])
+            self._heap = [(k, group, seq) for k, group, seq in self._heap
+                          if group in self._groups and self._groups[group]['seq'] == seq]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def _upsert(self, alert):
+        sos_id = alert['id']
+        if alert.get('status') != 'pending':
+            self._discard(sos_id)
+            return
+        old = self._entries.get(sos_id)
+        if old is not None and self._group(old[1]) != self._group(alert):
+            self._discard(sos_id)
+        self._push(alert)
+
+    def rebuild(self, alerts):
+        with self._lock:
+            self._clear()
+            for alert in alerts:
+                if alert.get('status') != 'pending':
+                    continue
+                self._seq += 1
+                self._entries[alert['id']] = (self._seq, alert)
+                state = self._groups.setdefault(self._group(alert), {'heap': [], 'members': set(), 'seq': 0})
+                state['members'].add(alert['id'])
+                state['heap'].append((-self._member_key(alert), alert['id'], self._seq))
+            for group, state in self._groups.items():
+                heapq.heapify(state['heap'])
+                self._seq += 1
+                state['seq'] = self._seq
+                key = -state['heap'][0][0] + self._cluster_bonus(len(state['members']))
+                self._heap.append((-key, group, self._seq))
+            heapq.heapify(self._heap)
+            self._stale = 0
+            self._built = True
+
+    # ---- change feed -------------------------------------------------------------
+    def on_change(self, event, payload):
+        if event == 'reload':
+            self.rebuild(read_model.active_alerts())
+        else:
+            with self._lock:
+                if event == 'upsert':
+                    self._upsert(payload)
+                elif event == 'remove':
+                    self._discard(payload)
+                self._compact()
+        self._push_top_k()
+
+    # ---- queries -------------------------------------------------------------------
+    @staticmethod
+    def _walk_heap(heap, live):
+        """Yield live items of a heap array best-first without popping (frontier over the array)."""
+        if not heap:
+            return
+        frontier = [(heap[0], 0)]
+        while frontier:
+            item, i = heapq.heappop(frontier)
+            if live(item):
+                yield item
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def _walk(self):
+        """Yield (key, alert) of live alerts best-first, cluster term included.
+
+        Groups come out of the top-level heap in order of their best member; a
+        member is yielded once no unopened group can beat it.
+        """
+        groups = self._walk_heap(self._heap, lambda item: self._groups.get(item[1], {}).get('seq') == item[2])
+        members = []  # (-key, sos_id, n, alert, member iterator, bonus)
+        opened = 0
+        next_group = next(groups, None)
+        while members or next_group is not None:
+            while next_group is not None and (not members or -next_group[0] >= -members[0][0]):
+                state = self._groups[next_group[1]]
+                bonus = self._cluster_bonus(len(state['members']))
+                walker = self._walk_heap(state['heap'], lambda item: self._live(item[1], item[2]))
+                first = next(walker, None)
+                if first is not None:
+                    opened += 1
+                    heapq.heappush(members, (first[0] - bonus, first[1], opened, walker, bonus))
+                next_group = next(groups, None)
+            if not members:
+                break
+            neg_key, sos_id, _, walker, bonus = heapq.heappop(members)
+            yield -neg_key, self._entries[sos_id][1]
+            following = next(walker, None)
+            if following is not None:
+                opened += 1
+                heapq.heappush(members, (following[0] - bonus, following[1], opened, walker, bonus))
+
+    def top_k(self, k=10, latitude=None, longitude=None):
+        """Top-k pending alerts by current score, optionally distance-adjusted."""
+        read_model.refresh()
+        if not self._built:
+            self.rebuild(read_model.active_alerts())
+        now = time.time() / 60.0
+        with self._lock:
+            if latitude is None or longitude is None:
+                result = []
+                for key, alert in self._walk():
+                    result.append(self._result(alert, self.score_at(key, now)))
+                    if len(result) >= k:
+                        break
+                return result
+
+            best = []  # min-heap of (adjusted_score, sos_id, alert, distance)
+            for key, alert in self._walk():
+                score = self.score_at(key, now)
+                if len(best) >= k and score <= best[0][0]:
+                    break  # Distance penalty >= 0: nothing further down can win
+                distance = haversine_km(latitude, longitude, alert['latitude'] or 0.0, alert['longitude'] or 0.0)
+                adjusted = score - DISTANCE_PER_KM * distance
+                item = (adjusted, alert['id'], alert, distance)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif adjusted > best[0][0]:
+                    heapq.heapreplace(best, item)
+            ranked = sorted(best, key=lambda item: (item[0], item[1]), reverse=True)
+            return [self._result(alert, adjusted, distance) for adjusted, _, alert, distance in ranked]
+
+    @staticmethod
+    def _result(alert, score, distance=None):
+        result = {
+            'id': alert['id'],
+            'username': alert.get('username'),
+            'latitude': alert.get('latitude'),
+            'longitude': alert.get('longitude'),
+            'risk_level': alert.get('risk_level'),
+            'incident_id': alert.get('incident_id'),
+            'timestamp': alert.get('timestamp'),
+            'score': round(score, 2)
+        }
+        if distance is not None:
+            result['distance_km'] = round(distance, 2)
+        return result
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ---- Socket.IO push ------------------------------------------------------------
+    def _push_top_k(self):
+        try:
+            top = self.top_k(PUSH_TOP_K)
+            ids = [item['id'] for item in top]
+            if ids == self._last_pushed:
+                return
+            self._last_pushed = ids
+            from extensions import socketio
+            for room in ('volunteer-room', 'admin-room'):
+                socketio.emit('triage_top_updated', {'top': top}, room=room)
+            logger.debug(f"Triage top-{PUSH_TOP_K} pushed: {ids}")
+        except Exception as e:
+            logger.warning(f"⚠️ Triage top-k push failed: {e}")
+
+
+triage_queue = TriageQueue()
+read_model.subscribe(triage_queue.on_change)
@@ -0,0 +1,70 @@
+// Compact SOS wire format decoder (pairs with sos_wire.py)
+// Save this as: static/js/sos_wire.js
+
+const SOS_WIRE_MAGIC = 'SOSC';
+const SOS_WIRE_HEADER_BYTES = 16;
+
+// Decode a binary SOS buffer into marker objects.
+// Columns are read zero-copy as typed-array views over the response buffer.
+function decodeSOSBinary(buffer, statusCodes, riskCodes) {
+    const header = new DataView(buffer, 0, SOS_WIRE_HEADER_BYTES);
+    const magic = String.fromCharCode(
+        header.getUint8(0), header.getUint8(1), header.getUint8(2), header.getUint8(3)
+    );
+    if (magic !== SOS_WIRE_MAGIC) {
+        throw new Error(`Unexpected SOS wire magic: ${magic}`);
+    }
+    const n = header.getUint32(8, true);
+
+    let offset = SOS_WIRE_HEADER_BYTES;
+    const ids = new Uint32Array(buffer, offset, n); offset += n * 4;
+    const lat = new Float32Array(buffer, offset, n); offset += n * 4;
+    const lng = new Float32Array(buffer, offset, n); offset += n * 4;
+    const status = new Uint8Array(buffer, offset, n); offset += n;
+    const risk = new Uint8Array(buffer, offset, n);
+
+    const sosData = new Array(n);
+    for (let i = 0; i < n; i++) {
+        sosData[i] = {
+            id: ids[i],
+            latitude: lat[i],
+            longitude: lng[i],
+            status: statusCodes[status[i]],
+            risk_level: riskCodes[risk[i]]
+        };
+    }
+    return sosData;
+}
+
+// Fetch SOS map data in binary format; falls back to the legacy JSON list
+function fetchSOSMapData(url) {
+    const sep = url.includes('?') ? '&' : '?';
+    return fetch(`${url}${sep}format=binary`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Failed to fetch SOS data: ${response.status} ${response.statusText}`);
+            }
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!contentType.includes('octet-stream')) {
+                return response.json();
+            }
+            const statusCodes = (response.headers.get('X-SOS-Status-Codes') || '').split(',');
+            const riskCodes = (response.headers.get('X-SOS-Risk-Codes') || '').split(',');
+            return response.arrayBuffer().then(buffer => decodeSOSBinary(buffer, statusCodes, riskCodes));
+        });
+}
+
+// Load popup details (username, description, ...) for one marker on first open
+function loadSOSDetails(url, sos) {
+    if (sos.description !== undefined) {
+        return Promise.resolve(sos);
+    }
+    return fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Failed to fetch SOS details: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(details => Object.assign(sos, details));
+}
@@ -0,0 +1,101 @@
+# sos_wire.py - Compact columnar wire format for SOS map payloads
+#
+# The default map APIs send one dict per SOS with repeated keys and the full
+# description. Clients that opt in (``?format=compact`` / ``?format=binary`` or the
+# matching Accept header) get column arrays instead:
+#   - compact: JSON arrays of ids, quantized lat/lng (int, 1e-5 deg), status and risk codes
+#   - binary:  little-endian typed-array buffer the JS reads straight into
+#              Uint32Array / Float32Array / Uint8Array views (see sos_wire.js)
+# Descriptions and other popup fields are fetched lazily per marker.
+import struct
+import logging
+import numpy as np
+from flask import jsonify, make_response
+
+logger = logging.getLogger(__name__)
+
+WIRE_VERSION = 1
+COORD_SCALE = 100000  # 1e-5 degrees (~1 m) per quantization step
+
+COMPACT_MIME = 'application/vnd.drms.sos+json'
+BINARY_MIME = 'application/vnd.drms.sos+octet-stream'
+
+# Code tables are sent alongside the data so clients never hard-code them
+STATUS_CODES = ['pending', 'assigned', 'in_progress', 'resolved']
+RISK_CODES = ['N/A', 'Low', 'Medium', 'High']
+_STATUS_INDEX = {name: i for i, name in enumerate(STATUS_CODES)}
+_RISK_INDEX = {name: i for i, name in enumerate(RISK_CODES)}
+
+# Binary header: magic, version, count, reserved (16 bytes keeps every column 4-byte aligned)
+_HEADER = struct.Struct('<4sIII')
+_MAGIC = b'SOSC'
+
+
+def requested_format(req):
+    """Return 'binary', 'compact' or None (legacy dict list) for a Flask request."""
+    fmt = (req.args.get('format') or '').lower()
+    if fmt in ('binary', 'compact'):
+        return fmt
+    accept = req.headers.get('Accept', '')
+    if BINARY_MIME in accept:
+        return 'binary'
+    if COMPACT_MIME in accept:
+        return 'compact'
+    return None
+
+
+def build_columns(rows, coord_dtype='<f4'):
+    """Build columnar arrays directly from (id, lat, lng, status, risk) tuples.
+    
+    Rows are plain tuples (see SOSReadModel.compact_rows), never sqlite3.Row dicts.
+    """
+    n = len(rows)
+    if n == 0:
+        return (np.empty(0, '<u4'), np.empty(0, coord_dtype), np.empty(0, coord_dtype),
+                np.empty(0, 'u1'), np.empty(0, 'u1'))
+    id_col, lat_col, lng_col, status_col, risk_col = zip(*rows)
+    ids = np.fromiter(id_col, dtype='<u4', count=n)
+    lat = np.fromiter((v or 0.0 for v in lat_col), dtype=coord_dtype, count=n)
+    lng = np.fromiter((v or 0.0 for v in lng_col), dtype=coord_dtype, count=n)
+    status = np.fromiter((_STATUS_INDEX.get(v, 0) for v in status_col), dtype='u1', count=n)
+    risk = np.fromiter((_RISK_INDEX.get(v, 0) for v in risk_col), dtype='u1', count=n)
+    return ids, lat, lng, status, risk
+
+
+def encode_compact(rows):
+    """Columnar JSON body (quantized integer coordinates)."""
+    # Quantize from full-precision coordinates, not the float32 binary columns
+    ids, lat, lng, status, risk = build_columns(rows, coord_dtype='<f8')
+    return {
+        'v': WIRE_VERSION,
+        'n': int(len(ids)),
+        'scale': COORD_SCALE,
+        'status_codes': STATUS_CODES,
+        'risk_codes': RISK_CODES,
+        'ids': ids.tolist(),
+        'lat': np.rint(lat * COORD_SCALE).astype(np.int64).tolist(),
+        'lng': np.rint(lng * COORD_SCALE).astype(np.int64).tolist(),
+        'status': status.tolist(),
+        'risk': risk.tolist(),
+    }
+
+
+def encode_binary(rows):
+    """Typed-array buffer: header | ids u32[n] | lat f32[n] | lng f32[n] | status u8[n] | risk u8[n]."""
+    ids, lat, lng, status, risk = build_columns(rows)
+    header = _HEADER.pack(_MAGIC, WIRE_VERSION, len(ids), 0)
+    return b''.join((header, ids.tobytes(), lat.tobytes(), lng.tobytes(), status.tobytes(), risk.tobytes()))
+
+
+def compact_response(rows, fmt):
+    """Flask response for a compact/binary request built from tuple rows."""
+    if fmt == 'binary':
+        response = make_response(encode_binary(rows))
+        response.headers['Content-Type'] = BINARY_MIME
+        response.headers['X-SOS-Status-Codes'] = ','.join(STATUS_CODES)
+        response.headers['X-SOS-Risk-Codes'] = ','.join(RISK_CODES)
+    else:
+        response = jsonify(encode_compact(rows))
+    response.headers['Vary'] = 'Accept'
+    logger.info(f"API: Returned {len(rows)} SOS rows in {fmt} wire format")
+    return response
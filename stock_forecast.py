@@ -0,0 +1,253 @@
+# stock_forecast.py - Per-item consumption rates, time-to-stockout and derived stock status
+#
+# resources.status used to be typed by hand, so nobody noticed an item running
+# out until request_resource turned a volunteer away. This module keeps an
+# hourly consumption histogram per item over the last FORECAST_WINDOW_HOURS,
+# built from resource_deliveries once (vectorized with pandas/NumPy) and then
+# updated incrementally on every delivery event:
+#
+#   rate (units/hour)  = exponentially weighted mean of the hourly buckets
+#                        (half-life FORECAST_HALF_LIFE_HOURS)
+#   hours_to_stockout  = quantity / rate
+#   status             = 'Out of Stock' at 0, 'Low' when stockout is projected
+#                        within LOW_STOCK_HOURS (or quantity <= LOW_STOCK_QUANTITY),
+#                        else 'Available'
+#
+# Stock is reserved when a volunteer requests it, so a request counts as
+# consumption at its timestamp and a cancellation takes it back out.
+# A 'stock_alert' goes to the admin room whenever an item gets worse (Available
+# -> Low -> Out of Stock), i.e. before it actually runs out.
+#
+# History is read on a connection of its own (committed rows only), never
+# through a writer's cursor. Writers derive statuses inside their transaction
+# from a snapshot() plus the consumption they are about to commit (`pending`),
+# and call record() only once the commit succeeded, so the in-memory histogram
+# never holds a change that was rolled back. A snapshot needs no lock: it can be
+# used inside a run_blocking() transaction.
+import os
+import math
+import logging
+import threading
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from db_config import get_db_connection
+from extensions import run_blocking
+
+logger = logging.getLogger(__name__)
+
+FORECAST_WINDOW_HOURS = int(os.environ.get('FORECAST_WINDOW_HOURS', 72))
+FORECAST_HALF_LIFE_HOURS = float(os.environ.get('FORECAST_HALF_LIFE_HOURS', 12))
+LOW_STOCK_HOURS = float(os.environ.get('LOW_STOCK_HOURS', 48))      # Projected stockout horizon for 'Low'
+LOW_STOCK_QUANTITY = int(os.environ.get('LOW_STOCK_QUANTITY', 5))   # 'Low' at or below this regardless of rate
+
+STATUS_SEVERITY = {'Available': 0, 'Low': 1, 'Out of Stock': 2}
+
+
+def derive_status(quantity, hours_to_stockout):
+    if quantity <= 0:
+        return 'Out of Stock'
+    if quantity <= LOW_STOCK_QUANTITY or hours_to_stockout <= LOW_STOCK_HOURS:
+        return 'Low'
+    return 'Available'
+
+
+def _hour_number(ts):
+    """Absolute hour index (UTC) for a datetime / SQLite timestamp string."""
+    if ts is None:
+        ts = datetime.now(timezone.utc)
+    elif isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)  # SQLite CURRENT_TIMESTAMP is UTC
+    return int(ts.timestamp() // 3600)
+
+
+class StockForecaster:
+    """Ring buffer of hourly consumption per item (rows) x hour slot (columns)."""
+
+    def __init__(self, window_hours=FORECAST_WINDOW_HOURS, half_life_hours=FORECAST_HALF_LIFE_HOURS):
+        self.window = window_hours
+        # Weight by age in hours: 0 = current hour
+        self._age_weights = 0.5 ** (np.arange(window_hours) / half_life_hours)
+        self._buckets = np.zeros((0, window_hours))
+        self._rows = {}            # item name -> row in _buckets
+        self._current_hour = None  # Absolute hour of the newest slot
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    # ---- loading ---------------------------------------------------------------------
+    @staticmethod
+    def _read_history(window):
+        """Committed deliveries of the window, on a connection of its own."""
+        conn = get_db_connection()
+        try:
+            return [tuple(row) for row in conn.execute("""
+                SELECT item, quantity, timestamp FROM resource_deliveries
+                WHERE status != 'cancelled' AND timestamp >= datetime('now', ?)
+            """, (f'-{window} hours',)).fetchall()]
+        finally:
+            conn.close()
+
+    def _ensure_loaded(self):
+        """Build the histogram from history on first use. Caller holds the lock."""
+        if self._loaded:
+            return
+        now_hour = _hour_number(None)
+        try:
+            df = pd.DataFrame(run_blocking(self._read_history, self.window),
+                              columns=['item', 'quantity', 'timestamp'])
+        except Exception as e:
+            logger.warning(f"⚠️ No delivery history for stock forecasting ({e}); starting empty")
+            df = pd.DataFrame(columns=['item', 'quantity', 'timestamp'])
+
+        items = sorted(df['item'].unique()) if len(df) else []
+        self._rows = {item: i for i, item in enumerate(items)}
+        self._buckets = np.zeros((len(items), self.window))
+        self._current_hour = now_hour
+        if len(df):
+            # Bucket every delivery into (item row, ring slot) in one pass
+            epoch = pd.Timestamp(0, tz='UTC')
+            hours = ((pd.to_datetime(df['timestamp'], utc=True) - epoch) // pd.Timedelta(hours=1)).to_numpy()
+            keep = (hours <= now_hour) & (hours > now_hour - self.window)
+            rows = df['item'].map(self._rows).to_numpy()[keep]
+            np.add.at(self._buckets, (rows, hours[keep] % self.window), df['quantity'].to_numpy(dtype=float)[keep])
+        self._loaded = True
+        logger.info(f"✅ Stock forecaster loaded: {len(items)} items, {len(df)} deliveries "
+                    f"in the last {self.window}h")
+
+    def _advance(self, now_hour):
+        """Zero the slots that fell out of the window since the last event."""
+        gap = now_hour - self._current_hour
+        if gap <= 0:
+            return
+        if gap >= self.window:
+            self._buckets[:] = 0
+        else:
+            stale = (np.arange(self._current_hour + 1, now_hour + 1)) % self.window
+            self._buckets[:, stale] = 0
+        self._current_hour = now_hour
+
+    def _row(self, item):
+        row = self._rows.get(item)
+        if row is None:
+            row = self._rows[item] = len(self._rows)
+            self._buckets = np.vstack([self._buckets, np.zeros((1, self.window))])
+        return row
+
+    def _slot_weights(self):
+        """Weight per ring slot for the current hour (slot of age a gets weight[a])."""
+        ages = (self._current_hour - np.arange(self.window)) % self.window
+        return self._age_weights[ages]
+
+    # ---- incremental updates ------------------------------------------------------------
+    def record(self, item, quantity, timestamp=None):
+        """Committed delivery event: +quantity when stock is reserved, -quantity when a request is cancelled."""
+        with self._lock:
+            self._ensure_loaded()
+            now_hour = _hour_number(None)
+            self._advance(now_hour)
+            hour = min(_hour_number(timestamp), now_hour)
+            if hour <= now_hour - self.window:
+                return  # Older than the window: no effect on the rate
+            row = self._row(item)
+            slot = hour % self.window
+            self._buckets[row, slot] = max(0.0, self._buckets[row, slot] + quantity)
+
+    def record_all(self, events):
+        for item, quantity, timestamp in events:
+            self.record(item, quantity, timestamp)
+
+    def snapshot(self):
+        """ForecastSnapshot of the current rates (loads history on first use)."""
+        with self._lock:
+            self._ensure_loaded()
+            self._advance(_hour_number(None))
+            weights = self._slot_weights()
+            norm = weights.sum()
+            items = list(self._rows)
+            values = self._buckets[[self._rows[item] for item in items]] @ weights / norm if items else []
+            return ForecastSnapshot({item: float(v) for item, v in zip(items, values)},
+                                    self._current_hour, self._age_weights / norm)
+
+    def rates(self, items=None):
+        """{item: units per hour} for the given items (all known items if None)."""
+        return self.snapshot().rates(items)
+
+    def forecast_rows(self, resources):
+        return self.snapshot().forecast_rows(resources)
+
+
+class ForecastSnapshot:
+    """Rates frozen at one moment, plus the weights to fold in not yet committed consumption."""
+
+    def __init__(self, base_rates, current_hour, age_weights):
+        self.base_rates = base_rates
+        self.current_hour = current_hour
+        self._age_weights = age_weights  # Normalised: units at age a add units * weight[a] per hour
+
+    def rates(self, items=None, pending=()):
+        """{item: units per hour}; pending = [(item, quantity, timestamp)] about to be committed."""
+        rates = dict(self.base_rates)
+        for item, quantity, timestamp in pending:
+            age = self.current_hour - min(_hour_number(timestamp), self.current_hour)
+            if age < len(self._age_weights):
+                rates[item] = max(0.0, rates.get(item, 0.0) + quantity * self._age_weights[age])
+        if items is None:
+            return rates
+        return {item: rates.get(item, 0.0) for item in items}
+
+    # ---- derived status -----------------------------------------------------------------
+    def forecast_rows(self, resources, pending=()):
+        """Add rate_per_hour / hours_to_stockout / derived_status to resource dicts."""
+        rates = self.rates([r['resource_name'] for r in resources], pending)
+        now = datetime.now(timezone.utc)
+        out = []
+        for r in resources:
+            rate = rates[r['resource_name']]
+            hours = r['quantity'] / rate if rate > 0 else math.inf
+            out.append(dict(r, rate_per_hour=round(rate, 3),
+                            hours_to_stockout=None if math.isinf(hours) else round(hours, 1),
+                            stockout_at=None if math.isinf(hours) or hours > 24 * 365 else
+                            (now + pd.Timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S'),
+                            derived_status=derive_status(r['quantity'], hours)))
+        return out
+
+    def refresh(self, cursor, names, pending=()):
+        """Re-derive status for the named resources (all if names is None) inside the caller's transaction.
+
+        Writes changed statuses and returns (changed_resources, alerts); emit both
+        after commit (inventory_ops.emit_inventory_changes) and record `pending`
+        on the forecaster then.
+        """
+        if names is None:
+            cursor.execute("SELECT id, resource_name, quantity, status FROM resources")
+        else:
+            names = list(set(names))
+            if not names:
+                return [], []
+            cursor.execute(f"SELECT id, resource_name, quantity, status FROM resources "
+                           f"WHERE resource_name IN ({','.join('?' * len(names))})", names)
+        forecasts = self.forecast_rows([dict(row) for row in cursor.fetchall()], pending)
+        changed, alerts = [], []
+        for f in forecasts:
+            old, new = f['status'], f['derived_status']
+            if old == new:
+                continue
+            changed.append({'id': f['id'], 'resource_name': f['resource_name'], 'quantity': f['quantity'],
+                            'status': new})
+            if STATUS_SEVERITY.get(new, 0) > STATUS_SEVERITY.get(old, 0):
+                alerts.append({'resource_id': f['id'], 'resource_name': f['resource_name'], 'quantity': f['quantity'],
+                               'status': new, 'previous_status': old, 'rate_per_hour': f['rate_per_hour'],
+                               'hours_to_stockout': f['hours_to_stockout'], 'stockout_at': f['stockout_at']})
+        if changed:
+            cursor.executemany("UPDATE resources SET status = ? WHERE id = ?",
+                               [(r['status'], r['id']) for r in changed])
+        for alert in alerts:
+            logger.warning(f"⚠️ Stock alert: {alert['resource_name']} is {alert['status']} "
+                           f"(qty {alert['quantity']}, {alert['rate_per_hour']}/h, "
+                           f"stockout in {alert['hours_to_stockout'] if alert['hours_to_stockout'] is not None else '-'}h)")
+        return changed, alerts
+
+
+stock_forecaster = StockForecaster()
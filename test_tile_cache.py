@@ -0,0 +1,150 @@
+# test_tile_cache.py - TileProxy against a local stand-in for the upstream tile server
+#
+# Run with: python -m pytest -q test_tile_cache.py   (or python -m unittest test_tile_cache)
+import os
+import time
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from tile_cache import TileProxy, TileUnavailable
+
+ERROR_TILE = (5, 1, 1)   # The stand-in answers 500 for this tile
+EMPTY_TILE = (5, 2, 2)   # ... and an empty body for this one
+
+
+def tile_bytes(z, x, y):
+    return f"png {z}/{x}/{y}".encode()
+
+
+class UpstreamStandIn:
+    """http.server tile upstream that counts requests per path; `gate` holds responses back until set."""
+
+    def __init__(self):
+        self.requests = {}
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.requests[self.path] = stand_in.requests.get(self.path, 0) + 1
+                stand_in.gate.wait(10)
+                z, x, y = (int(part) for part in self.path.strip('/').replace('.png', '').split('/'))
+                if (z, x, y) == ERROR_TILE:
+                    self.send_error(500, "upstream broke")
+                    return
+                body = b'' if (z, x, y) == EMPTY_TILE else tile_bytes(z, x, y)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/{{z}}/{{x}}/{{y}}.png"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def hits(self, z, x, y):
+        with self._lock:
+            return self.requests.get(f"/{z}/{x}/{y}.png", 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TileProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.upstream = UpstreamStandIn()
+        self.addCleanup(self.upstream.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_path = os.path.join(tmp.name, 'cache.mbtiles')
+
+    def proxy(self, offline=False):
+        return TileProxy(cache_path=self.cache_path, pack_path=None, upstream_url=self.upstream.url, offline=offline)
+
+    def test_miss_then_hit(self):
+        proxy = self.proxy()
+        self.assertEqual(proxy.get_tile(3, 4, 2), tile_bytes(3, 4, 2))
+        self.assertEqual(proxy.get_tile(3, 4, 2), tile_bytes(3, 4, 2))
+        self.assertEqual(self.upstream.hits(3, 4, 2), 1)
+        self.assertEqual((proxy.stats['fetches'], proxy.stats['cache_hits']), (1, 1))
+        self.assertTrue(proxy.cache.has(3, 4, 2))
+
+        # A fresh proxy on the same file (restart) serves it from the cache too
+        self.assertEqual(self.proxy().get_tile(3, 4, 2), tile_bytes(3, 4, 2))
+        self.assertEqual(self.upstream.hits(3, 4, 2), 1)
+
+    def test_concurrent_requests_share_one_fetch(self):
+        proxy = self.proxy()
+        self.upstream.gate.clear()
+        waiters = 5
+        results, errors = [], []
+
+        def get():
+            try:
+                results.append(proxy.get_tile(7, 10, 20))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get) for _ in range(waiters + 1)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while proxy.stats['shared_fetches'] < waiters and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.upstream.gate.set()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results, [tile_bytes(7, 10, 20)] * (waiters + 1))
+        self.assertEqual(self.upstream.hits(7, 10, 20), 1)
+        self.assertEqual((proxy.stats['fetches'], proxy.stats['shared_fetches']), (1, waiters))
+        self.assertEqual(proxy._inflight, {})
+
+    def test_offline_serves_only_cached_tiles(self):
+        self.proxy().get_tile(4, 3, 3)  # Cached while online
+        offline = self.proxy(offline=True)
+
+        self.assertEqual(offline.get_tile(4, 3, 3), tile_bytes(4, 3, 3))
+        with self.assertRaises(TileUnavailable):
+            offline.get_tile(4, 3, 4)
+        self.assertEqual(self.upstream.total(), 1)
+        self.assertFalse(offline.cache.has(4, 3, 4))
+
+        result = offline.warm(-10, -10, 10, 10, [1])
+        self.assertEqual((result['fetched'], result['failed']), (0, result['tiles']))
+        self.assertEqual(self.upstream.total(), 1)
+
+    def test_upstream_error_is_not_cached(self):
+        proxy = self.proxy()
+        for tile in (ERROR_TILE, EMPTY_TILE):
+            with self.assertRaises(TileUnavailable):
+                proxy.get_tile(*tile)
+            self.assertFalse(proxy.cache.has(*tile))
+        self.assertEqual(proxy.stats['errors'], 2)
+        self.assertEqual(proxy._inflight, {})
+
+        # Nothing was remembered: the next request asks upstream again
+        with self.assertRaises(TileUnavailable):
+            proxy.get_tile(*ERROR_TILE)
+        self.assertEqual(self.upstream.hits(*ERROR_TILE), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
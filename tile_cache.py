@@ -0,0 +1,263 @@
+# tile_cache.py - Caching map tile proxy backed by MBTiles
+#
+# The maps used to pull every tile straight from tile.openstreetmap.org on each
+# pan. Tiles are now served by map_bp (/map/tiles/<z>/<x>/<y>.png) from:
+#   1. TILE_PACK_PATH   optional pre-seeded, read-only MBTiles pack
+#   2. TILE_CACHE_PATH  MBTiles cache filled on demand (and by warming)
+#   3. TILE_UPSTREAM_URL, unless TILE_OFFLINE is set
+# Concurrent requests for the same missing tile share one upstream fetch, and
+# upstream fetches are capped at TILE_FETCH_CONCURRENCY (OSM's usage policy
+# asks for at most 2).
+#
+# Warm a bounding box before going into the field:
+#   python tile_cache.py --bbox 12.8 80.0 13.3 80.4 --zooms 10-15
+#
+# MBTiles stores rows in TMS order (y flipped); all public functions here take
+# XYZ coordinates as used by Leaflet.
+import os
+import math
+import sqlite3
+import logging
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from extensions import run_blocking
+
+logger = logging.getLogger(__name__)
+
+TILE_UPSTREAM_URL = os.environ.get('TILE_UPSTREAM_URL', 'https://tile.openstreetmap.org/{z}/{x}/{y}.png')
+TILE_CACHE_PATH = os.environ.get('TILE_CACHE_PATH', 'tiles.mbtiles')
+TILE_PACK_PATH = os.environ.get('TILE_PACK_PATH')          # Pre-seeded local tile pack (read-only)
+TILE_OFFLINE = os.environ.get('TILE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+TILE_FETCH_CONCURRENCY = int(os.environ.get('TILE_FETCH_CONCURRENCY', 2))
+TILE_FETCH_TIMEOUT = 10
+TILE_MAX_AGE = int(os.environ.get('TILE_MAX_AGE', 30 * 24 * 3600))  # Cache-Control max-age (seconds)
+MAX_ZOOM = 19
+MAX_WARM_TILES = 50000
+USER_AGENT = 'DisasterReliefManagementSystem/1.0 (tile cache)'
+
+
+class TileUnavailable(Exception):
+    """Tile is not cached and cannot be fetched (offline or upstream error)."""
+
+
+def tms_row(z, y):
+    return (1 << z) - 1 - y
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+def tile_range(min_lat, min_lng, max_lat, max_lng, z):
+    """XYZ tile x/y ranges (inclusive) covering a bounding box at zoom z."""
+    def to_tile(lat, lng):
+        lat = max(min(lat, 85.05112878), -85.05112878)
+        n = 1 << z
+        x = int((lng + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+    x0, y0 = to_tile(max_lat, min_lng)  # North-west corner has the smallest y
+    x1, y1 = to_tile(min_lat, max_lng)
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+class MBTiles:
+    """Minimal MBTiles reader/writer with one connection per thread."""
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            conn = self._conn()
+            conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tiles (
+                    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB
+                )
+            """)
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+            if not conn.execute("SELECT 1 FROM metadata WHERE name = 'name'").fetchone():
+                conn.executemany("INSERT INTO metadata (name, value) VALUES (?, ?)",
+                                 [('name', 'drms tile cache'), ('format', 'png'), ('type', 'baselayer')])
+            conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            else:
+                conn = sqlite3.connect(self.path, timeout=30)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, z, x, y):
+        row = self._conn().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, tms_row(z, y))).fetchone()
+        return bytes(row[0]) if row else None
+
+    def has(self, z, x, y):
+        return self._conn().execute(
+            "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, tms_row(z, y))).fetchone() is not None
+
+    def put(self, z, x, y, data):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                     (z, x, tms_row(z, y), sqlite3.Binary(data)))
+        conn.commit()
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+
+class TileProxy:
+    """Pack -> cache -> upstream lookup with per-tile fetch deduplication."""
+
+    def __init__(self, cache_path=TILE_CACHE_PATH, pack_path=TILE_PACK_PATH,
+                 upstream_url=TILE_UPSTREAM_URL, offline=TILE_OFFLINE):
+        self.cache = MBTiles(cache_path)
+        self.pack = MBTiles(pack_path, readonly=True) if pack_path and os.path.exists(pack_path) else None
+        self.upstream_url = upstream_url
+        self.offline = offline
+        self._inflight = {}  # (z, x, y) -> {'event', 'data', 'error'}
+        self._inflight_lock = threading.Lock()
+        self._fetch_slots = threading.BoundedSemaphore(TILE_FETCH_CONCURRENCY)
+        self.stats = {'pack_hits': 0, 'cache_hits': 0, 'fetches': 0, 'shared_fetches': 0, 'errors': 0}
+
+    def _local_tile(self, z, x, y):
+        if self.pack is not None:
+            data = run_blocking(self.pack.get, z, x, y)
+            if data is not None:
+                self.stats['pack_hits'] += 1
+                return data
+        data = run_blocking(self.cache.get, z, x, y)
+        if data is not None:
+            self.stats['cache_hits'] += 1
+        return data
+
+    def _fetch_upstream(self, z, x, y):
+        url = self.upstream_url.format(z=z, x=x, y=y)
+        req = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with self._fetch_slots:
+            with urllib.request.urlopen(req, timeout=TILE_FETCH_TIMEOUT) as resp:
+                data = resp.read()
+        if not data:
+            raise TileUnavailable(f"Empty tile from {url}")
+        return data
+
+    def get_tile(self, z, x, y):
+        """Tile bytes for XYZ coordinates; raises TileUnavailable."""
+        data = self._local_tile(z, x, y)
+        if data is not None:
+            return data
+        if self.offline:
+            raise TileUnavailable(f"Tile {z}/{x}/{y} not in local tiles (offline mode)")
+
+        key = (z, x, y)
+        with self._inflight_lock:
+            entry = self._inflight.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._inflight[key] = {'event': threading.Event(), 'data': None, 'error': None}
+        if not leader:
+            # Someone is already fetching this tile: wait for their result
+            self.stats['shared_fetches'] += 1
+            entry['event'].wait(TILE_FETCH_TIMEOUT * 2)
+            if entry['data'] is None:
+                raise TileUnavailable(entry['error'] or f"Tile {z}/{x}/{y} fetch timed out")
+            return entry['data']
+
+        try:
+            self.stats['fetches'] += 1
+            data = self._fetch_upstream(z, x, y)
+            run_blocking(self.cache.put, z, x, y, data)
+            entry['data'] = data
+            return data
+        except Exception as e:
+            self.stats['errors'] += 1
+            entry['error'] = str(e)
+            raise TileUnavailable(f"Tile {z}/{x}/{y} unavailable: {e}")
+        finally:
+            entry['event'].set()
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def warm(self, min_lat, min_lng, max_lat, max_lng, zooms, workers=TILE_FETCH_CONCURRENCY):
+        """Fetch every tile of a bounding box at the given zooms that is not yet local.
+
+        Returns {'tiles': total, 'cached': already local, 'fetched': n, 'failed': n}.
+        """
+        tiles = [(z, x, y) for z in zooms
+                 for xs, ys in [tile_range(min_lat, min_lng, max_lat, max_lng, z)]
+                 for x in xs for y in ys]
+        if len(tiles) > MAX_WARM_TILES:
+            raise ValueError(f"{len(tiles)} tiles requested; warm at most {MAX_WARM_TILES} at once")
+        missing = [t for t in tiles if not self.cache.has(*t) and not (self.pack and self.pack.has(*t))]
+        result = {'tiles': len(tiles), 'cached': len(tiles) - len(missing), 'fetched': 0, 'failed': 0}
+        if self.offline or not missing:
+            result['failed'] = len(missing) if self.offline else 0
+            return result
+
+        def fetch(tile):
+            try:
+                self.get_tile(*tile)
+                return True
+            except TileUnavailable as e:
+                logger.warning(f"⚠️ Tile warm failed: {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for ok in pool.map(fetch, missing):
+                result['fetched' if ok else 'failed'] += 1
+        logger.info(f"✅ Tile warm {min_lat},{min_lng} - {max_lat},{max_lng} z{list(zooms)}: {result}")
+        return result
+
+
+_proxy = None
+_proxy_lock = threading.Lock()
+
+
+def get_tile_proxy():
+    global _proxy
+    with _proxy_lock:
+        if _proxy is None:
+            _proxy = TileProxy()
+            logger.info(f"Tile proxy ready: cache {TILE_CACHE_PATH}, pack {TILE_PACK_PATH or '-'}, "
+                        f"{'offline' if TILE_OFFLINE else 'upstream ' + TILE_UPSTREAM_URL}")
+    return _proxy
+
+
+def parse_zooms(text):
+    """'10-14' or '10,12,14' -> list of zoom levels."""
+    zooms = []
+    for part in str(text).split(','):
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            zooms.extend(range(int(lo), int(hi) + 1))
+        elif part.strip():
+            zooms.append(int(part))
+    if not zooms or any(z < 0 or z > MAX_ZOOM for z in zooms):
+        raise ValueError(f"Zoom levels must be between 0 and {MAX_ZOOM}")
+    return sorted(set(zooms))
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Warm the local map tile cache for a bounding box")
+    parser.add_argument('--bbox', nargs=4, type=float, required=True, metavar=('MIN_LAT', 'MIN_LNG', 'MAX_LAT', 'MAX_LNG'))
+    parser.add_argument('--zooms', default='10-14', help="e.g. 10-14 or 8,10,12")
+    args = parser.parse_args(argv)
+    result = get_tile_proxy().warm(*args.bbox, parse_zooms(args.zooms))
+    print(f"✅ {result}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# traffic_capture.py - Sampled, PII-scrubbed capture of live requests for replay_traffic.py
+#
+# With CAPTURE_SAMPLE_RATE > 0, a sample of requests (SOS posts, dashboard GETs,
+# map polls, chatbot messages, ...) is appended to CAPTURE_FILE as one JSON line
+# each: arrival time, method, path, query, body, route template, the caller's
+# role and a pseudonymous actor id, plus the status and server time it got.
+#
+# Sampling is per actor (a keyed hash of the username), so a sampled user's
+# whole session is kept in order and the replay sees realistic per-user
+# sequences (rate limits, per-user caches). Anonymous requests are sampled
+# independently.
+#
+# Scrubbing happens before anything is queued:
+#   - usernames (the session's and fields such as volunteer_name) become actor
+#     ids (HMAC with CAPTURE_SALT: stable within one capture, not reversible
+#     without the salt)
+#   - fields named like passwords / contact details are replaced by a placeholder
+#   - in free text (FREE_TEXT_FIELDS: SOS descriptions, chatbot messages,
+#     search queries) e-mail addresses, phone numbers and other long digit runs
+#     are masked, the words are kept so replayed messages take the same code
+#     paths; other values (client_key, device_timestamp, SOS / region / delivery
+#     ids) are kept as they are, so replays hit the same rows and dedup keys
+#   - coordinates are rounded to CAPTURE_COORD_DECIMALS (3 = ~100 m)
+#   - cookies and headers are not recorded; /auth (credentials) and /static
+#     are not captured at all
+#
+# Lines are written by a background thread (the request only appends to a
+# bounded buffer); when the writer falls behind the oldest lines are dropped.
+#
+# Usage (in app.py, after the blueprints are registered):
+#   from traffic_capture import capture
+#   capture.init_app(app)
+import os
+import re
+import hmac
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import deque
+from flask import request, session, g
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_SAMPLE_RATE = float(os.environ.get('CAPTURE_SAMPLE_RATE', 0))  # 0 = off, 1 = every request
+CAPTURE_FILE = os.environ.get('CAPTURE_FILE', 'traffic_capture.jsonl')
+CAPTURE_SALT = os.environ.get('CAPTURE_SALT') or os.urandom(16).hex()  # Set it to link actors across restarts
+CAPTURE_EXCLUDE = tuple(p for p in os.environ.get('CAPTURE_EXCLUDE', '/auth,/static,/socket.io').split(',') if p)
+CAPTURE_COORD_DECIMALS = int(os.environ.get('CAPTURE_COORD_DECIMALS', 3))
+CAPTURE_MAX_BODY = int(os.environ.get('CAPTURE_MAX_BODY', 256 * 1024))  # Bytes; larger bodies are not captured
+CAPTURE_BUFFER = 10000        # Lines held for the writer thread (oldest dropped)
+CAPTURE_FLUSH_SECONDS = 1.0
+
+PII_FIELDS = ('password', 'phone', 'mobile', 'email', 'contact', 'address', 'token', 'secret')  # Substrings
+USER_FIELDS = ('username', 'volunteer_name', 'assigned_to', 'full_name', 'name')
+COORD_FIELDS = ('latitude', 'longitude', 'lat', 'lng', 'lon')
+FREE_TEXT_FIELDS = ('description', 'message', 'q')
+REDACTED = '[redacted]'
+_EMAIL = re.compile(r'[\w.+-]+@[\w-]+(\.[\w-]+)+')
+_DIGITS = re.compile(r'\+?\d[\d\s().-]{6,}\d')  # Phone numbers, ID / account numbers
+
+
+def actor_id(username):
+    """Pseudonym of username, stable for this CAPTURE_SALT."""
+    return hmac.new(CAPTURE_SALT.encode(), str(username).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def scrub_text(text):
+    text = _EMAIL.sub('user@example.org', text)
+    return _DIGITS.sub(lambda m: '0' * len(re.sub(r'\D', '', m.group())), text)
+
+
+def scrub(value, field=''):
+    """Copy of a form / JSON value with personal data masked (field: the key it was found under)."""
+    name = field.lower()
+    if isinstance(value, dict):
+        return {k: scrub(v, str(k)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [scrub(v, field) for v in value]
+    if any(p in name for p in PII_FIELDS):
+        return REDACTED
+    if name in USER_FIELDS and isinstance(value, str):
+        return actor_id(value)
+    if name in COORD_FIELDS:
+        try:
+            return round(float(value), CAPTURE_COORD_DECIMALS)
+        except (TypeError, ValueError):
+            return value
+    if name in FREE_TEXT_FIELDS and isinstance(value, str):
+        return scrub_text(value)
+    return value
+
+
+class TrafficCapture:
+    """Flask before/after request hooks that queue scrubbed request records for a JSONL file."""
+
+    def __init__(self, path=CAPTURE_FILE, sample_rate=CAPTURE_SAMPLE_RATE):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._buffer = deque(maxlen=CAPTURE_BUFFER)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.captured = self.dropped = self.written = 0
+
+    def init_app(self, app):
+        if self.sample_rate <= 0:
+            return
+        app.before_request(self._before)
+        app.after_request(self._after)
+        logger.info(f"✅ Traffic capture on: {self.sample_rate:.1%} of actors -> {self.path}")
+
+    def sampled(self, username):
+        """Keep this request? Whole sessions of a fixed share of users, or a random share of anonymous ones."""
+        if username is None:
+            return random.random() < self.sample_rate
+        return int(actor_id(username), 16) / 16 ** 16 < self.sample_rate
+
+    def _before(self):
+        if request.path.startswith(CAPTURE_EXCLUDE) or not self.sampled(session.get('username')):
+            return
+        g.capture_started = (time.time(), time.perf_counter())
+
+    def _after(self, response):
+        started = g.pop('capture_started', None)
+        if started is not None:
+            try:
+                self._queue(self.record(started, response))
+            except Exception as e:  # Capture must never break the request
+                logger.error(f"⚠️ Traffic capture failed for {request.path}: {e}")
+        return response
+
+    def record(self, started, response):
+        """The capture line for the current request."""
+        arrived, t0 = started
+        entry = {
+            'ts': round(arrived, 4),
+            'method': request.method,
+            'path': request.path,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'query': scrub(request.args.to_dict(flat=False)),
+            'role': session.get('role'),
+            'actor': actor_id(session['username']) if 'username' in session else None,
+            'status': response.status_code,
+            'ms': round(1000 * (time.perf_counter() - t0), 2),
+        }
+        if request.method in ('POST', 'PUT', 'PATCH', 'DELETE'):
+            if (request.content_length or 0) > CAPTURE_MAX_BODY:
+                entry['body_skipped'] = request.content_length
+            elif request.is_json:
+                entry['json'] = scrub(request.get_json(silent=True))
+            elif request.form:
+                entry['form'] = scrub(request.form.to_dict(flat=False))
+        return entry
+
+    def _queue(self, entry):
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(entry)
+            self.captured += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='traffic-capture', daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        """Append buffered lines to the capture file. Returns lines written."""
+        with self._lock:
+            entries = list(self._buffer)
+            self._buffer.clear()
+        if not entries:
+            return 0
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in entries))
+        self.written += len(entries)
+        return len(entries)
+
+    def _loop(self):
+        while True:
+            time.sleep(CAPTURE_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"⚠️ Traffic capture write failed: {e}")
+
+    def stats(self):
+        return {'sample_rate': self.sample_rate, 'file': self.path, 'captured': self.captured,
+                'written': self.written, 'dropped': self.dropped, 'buffered': len(self._buffer)}
+
+
+capture = TrafficCapture()
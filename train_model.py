@@ -0,0 +1,194 @@
+# train_model.py - Offline training CLI for the disaster risk model
+#
+# Builds a RandomForestClassifier from historical data and registers it as a new
+# versioned artifact (see ai_predict.py). Serving code picks it up automatically.
+#
+# Usage:
+#   python train_model.py --csv disaster_data.csv                   # CSV history
+#   python train_model.py --csv big.csv --chunksize 200000          # stream large CSVs
+#   python train_model.py --csv disaster_data.csv --sos-outcomes    # + resolved SOS, labelled by outcome
+#   python train_model.py --register disaster_model.pkl             # register an existing pickle
+#
+# CSV columns: rainfall, temperature, humidity, risk_level (Low/Medium/High)
+#
+# A resolved SOS row's stored risk_level is the model's own prediction at ingest,
+# so it is never used as a label (training on it would only reinforce past
+# errors). With --sos-outcomes, resolved SOS rows are labelled by what actually
+# happened instead: the size of the incident they were clustered into
+# (OUTCOME_HIGH_REPORTS+ reports = High, OUTCOME_MEDIUM_REPORTS+ = Medium,
+# a lone report = Low). Rows already moved to the SOS archive (sos_archive.py)
+# are read too.
+import os
+import json
+import logging
+import argparse
+import tempfile
+from datetime import datetime
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+from ai_predict import MODELS_DIR, REGISTRY_PATH, FEATURES, DEFAULT_LABELS, artifact_paths
+
+logger = logging.getLogger(__name__)
+
+LABEL_CODES = {label: code for code, label in DEFAULT_LABELS.items()}
+OUTCOME_HIGH_REPORTS = 5    # Reports in one incident for a High outcome label
+OUTCOME_MEDIUM_REPORTS = 2
+
+
+def _encode_frame(df):
+    """Keep valid rows and return (X float32 array, y int8 array)."""
+    df = df.dropna(subset=FEATURES + ['risk_level'])
+    y = df['risk_level'].map(LABEL_CODES)
+    mask = y.notna()
+    X = df.loc[mask, FEATURES].to_numpy(dtype=np.float32)
+    return X, y[mask].to_numpy(dtype=np.int8)
+
+
+def load_csv(path, chunksize=100000):
+    """Stream a CSV in chunks, keeping only the compact float32/int8 training arrays."""
+    xs, ys = [], []
+    for chunk in pd.read_csv(path, usecols=FEATURES + ['risk_level'], chunksize=chunksize):
+        X, y = _encode_frame(chunk)
+        xs.append(X)
+        ys.append(y)
+    if not xs:
+        return np.empty((0, len(FEATURES)), np.float32), np.empty(0, np.int8)
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+_OUTCOME_SQL = """
+    SELECT sr.rainfall, sr.temperature, sr.humidity,
+           CASE WHEN COALESCE(i.report_count, 1) >= ? THEN 'High'
+                WHEN COALESCE(i.report_count, 1) >= ? THEN 'Medium'
+                ELSE 'Low' END AS risk_level
+    FROM {table} sr LEFT JOIN incidents i ON i.id = sr.incident_id
+    WHERE sr.status = 'resolved' AND sr.rainfall IS NOT NULL{where}
+"""
+
+
+def load_resolved_sos():
+    """Resolved SOS rows with environmental inputs (every shard, hot and archived), labelled by incident size."""
+    from db_config import get_db_connection, SHARD_ID_SPAN
+    from shard_router import SHARD_COUNT, HOME_SHARD
+    from sos_archive import ARCHIVE_DB, _archive_table
+    labels = (OUTCOME_HIGH_REPORTS, OUTCOME_MEDIUM_REPORTS)
+    frames = []
+    for shard in range(SHARD_COUNT):
+        conn = get_db_connection(shard)
+        try:
+            frames.append(pd.read_sql_query(_OUTCOME_SQL.format(table='sos_requests', where=''), conn, params=labels))
+            table = _archive_table(conn)
+            where, params = '', labels
+            if ARCHIVE_DB:
+                # The shared archive holds every shard's rows: join each with the
+                # incidents of the shard its incident id was allocated on
+                last = SHARD_COUNT - 1
+                where = " AND (sr.incident_id BETWEEN ? AND ?"
+                where += " OR sr.incident_id IS NULL)" if shard == HOME_SHARD else ")"
+                params = labels + (shard * SHARD_ID_SPAN, (shard + 1) * SHARD_ID_SPAN - 1 if shard < last else 2 ** 63 - 1)
+            frames.append(pd.read_sql_query(_OUTCOME_SQL.format(table=table, where=where), conn, params=params))
+        finally:
+            conn.close()
+    return _encode_frame(pd.concat(frames, ignore_index=True))
+
+
+def _atomic_write(path, write):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def register_model(model, metadata):
+    """Write artifact + metadata, then atomically point the registry at the new version."""
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    version = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+    model_path, meta_path = artifact_paths(version)
+    metadata = dict(metadata, version=version, features=FEATURES,
+                    labels={str(k): v for k, v in DEFAULT_LABELS.items()},
+                    created_at=datetime.utcnow().isoformat() + 'Z')
+
+    _atomic_write(model_path, lambda tmp: joblib.dump(model, tmp))
+
+    def _dump_json(obj):
+        def write(tmp):
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                json.dump(obj, fh, indent=2)
+        return write
+
+    _atomic_write(meta_path, _dump_json(metadata))
+    # Registry last: readers only ever see fully written artifacts
+    _atomic_write(REGISTRY_PATH, _dump_json({'current': version}))
+    logger.info(f"✅ Registered disaster model {version} ({model_path})")
+    return version
+
+
+def train(X, y, n_estimators=100, random_state=42, n_jobs=-1):
+    if len(np.unique(y)) < 2:
+        raise ValueError("Training data needs at least two risk classes")
+    stratify = y if np.bincount(y).min() >= 2 else None
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=random_state, stratify=stratify)
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs)
+    model.fit(X_train, y_train)
+    accuracy = float(model.score(X_test, y_test)) if len(X_test) else None
+    # Refit on everything once the hold-out score has been recorded
+    model.fit(X, y)
+    return model, {'holdout_accuracy': accuracy, 'n_samples': int(len(y)),
+                   'class_counts': {DEFAULT_LABELS[int(c)]: int(n) for c, n in zip(*np.unique(y, return_counts=True))},
+                   'n_estimators': n_estimators}
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Train and register the disaster risk model")
+    parser.add_argument('--csv', action='append', default=[], help="historical CSV (repeatable)")
+    parser.add_argument('--chunksize', type=int, default=100000, help="rows per CSV chunk")
+    parser.add_argument('--sos-outcomes', action='store_true',
+                        help="add resolved SOS from the DB, labelled by incident size (not their predicted risk)")
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--n-jobs', type=int, default=-1, help="cores for fitting (-1 = all)")
+    parser.add_argument('--register', metavar='PKL', help="register an existing fitted pickle instead of training")
+    args = parser.parse_args(argv)
+
+    if args.register:
+        model = joblib.load(args.register)
+        version = register_model(model, {'source': {'pickle': args.register}})
+        print(f"✅ Registered {args.register} as model {version}")
+        return version
+
+    xs, ys, sources = [], [], {}
+    for path in args.csv:
+        X, y = load_csv(path, args.chunksize)
+        xs.append(X)
+        ys.append(y)
+        sources[path] = int(len(y))
+    if args.sos_outcomes:
+        try:
+            X, y = load_resolved_sos()
+            xs.append(X)
+            ys.append(y)
+            sources['sos_requests'] = int(len(y))  # Hot and archived
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load resolved SOS outcomes: {e}")
+    if not xs or sum(len(y) for y in ys) == 0:
+        parser.error("no training data (pass --csv and/or --sos-outcomes)")
+
+    X, y = np.concatenate(xs), np.concatenate(ys)
+    logger.info(f"Training on {len(y)} rows from {sources}")
+    model, metrics = train(X, y, n_estimators=args.n_estimators, n_jobs=args.n_jobs)
+    version = register_model(model, {'source': sources, 'metrics': metrics})
+    print(f"✅ Trained and registered model {version}: {metrics}")
+    return version
+
+
+if __name__ == "__main__":
+    main()
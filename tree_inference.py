@@ -0,0 +1,179 @@
+# tree_inference.py - Flat-array inference for the disaster risk forest
+#
+# sklearn's predict() spends most of a single-row call on input validation and
+# joblib dispatch rather than on walking ten small trees. At load time the
+# fitted forest is flattened into one set of NumPy node arrays
+# (feature, threshold, left, right, leaf probabilities) and evaluated directly:
+#   - single rows / small batches: a plain Python walk over list copies
+#   - medium batches: all (row, tree) pairs advanced one level per NumPy step
+#   - large batches (bulk scoring): handed back to sklearn, which is faster there
+#
+# A compiled forest is only served after verify() has shown its predictions
+# and probabilities match sklearn on probe inputs; otherwise the caller keeps
+# the original estimator (see ai_predict.get_model()).
+import logging
+import warnings
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SMALL_BATCH = 16        # Rows at or below this use the pure-Python walk
+LARGE_BATCH = 256       # Above this sklearn's threaded Cython predictor wins again
+VERIFY_RANDOM_ROWS = 2000
+PROBA_TOLERANCE = 1e-9
+
+
+class CompiledForest:
+    """Classifier forest flattened into contiguous node arrays."""
+
+    def __init__(self, model):
+        trees = [est.tree_ for est in getattr(model, 'estimators_', [model])]
+        if not trees or any(t.n_outputs != 1 for t in trees):
+            raise ValueError("Only single-output tree classifiers can be compiled")
+        self.model = model
+        self.classes_ = np.asarray(model.classes_)
+        self.n_features = int(model.n_features_in_)
+        self.n_trees = len(trees)
+
+        offsets = np.cumsum([0] + [t.node_count for t in trees])
+        self.roots = offsets[:-1].astype(np.intp)
+        left, right, values = [], [], []
+        for offset, t in zip(offsets, trees):
+            is_leaf = t.children_left == -1
+            left.append(np.where(is_leaf, -1, t.children_left + offset))
+            right.append(np.where(is_leaf, -1, t.children_right + offset))
+            value = t.value[:, 0, :].astype(np.float64)
+            # Older sklearn stores class counts, newer stores fractions: normalise both
+            totals = value.sum(axis=1, keepdims=True)
+            values.append(np.divide(value, totals, out=np.zeros_like(value), where=totals > 0))
+        self.feature = np.concatenate([t.feature for t in trees]).astype(np.intp)
+        self.threshold = np.concatenate([t.threshold for t in trees]).astype(np.float64)
+        self.left = np.concatenate(left).astype(np.intp)
+        self.right = np.concatenate(right).astype(np.intp)
+        self.value = np.concatenate(values)
+        self.feature[self.left == -1] = 0  # Leaves never compare; keep indices valid
+
+        # List copies for the scalar walk (indexing lists beats indexing arrays)
+        self._feature_l = self.feature.tolist()
+        self._threshold_l = self.threshold.tolist()
+        self._left_l = self.left.tolist()
+        self._right_l = self.right.tolist()
+        self._value_l = self.value.tolist()
+        self._roots_l = self.roots.tolist()
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    @staticmethod
+    def _as_rows(X):
+        # sklearn trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        return X.astype(np.float64)
+
+    # Both evaluators accumulate leaves tree by tree and divide once at the end,
+    # the same order sklearn uses, so argmax ties break identically.
+    def _proba_small(self, X):
+        feature, threshold = self._feature_l, self._threshold_l
+        left, right, value = self._left_l, self._right_l, self._value_l
+        n_classes = len(self.classes_)
+        out = []
+        for row in X.tolist():
+            proba = [0.0] * n_classes
+            for node in self._roots_l:
+                while left[node] != -1:
+                    node = left[node] if row[feature[node]] <= threshold[node] else right[node]
+                leaf = value[node]
+                for c in range(n_classes):
+                    proba[c] += leaf[c]
+            out.append(proba)
+        return np.array(out, dtype=np.float64).reshape(len(out), n_classes) / self.n_trees
+
+    def _proba_batch(self, X):
+        n = len(X)
+        nodes = np.tile(self.roots, n)                    # (row, tree) pairs, row-major
+        rows = np.repeat(np.arange(n), self.n_trees)
+        active = np.flatnonzero(self.left[nodes] != -1)
+        while len(active):
+            current = nodes[active]
+            go_left = X[rows[active], self.feature[current]] <= self.threshold[current]
+            nxt = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = nxt
+            active = active[self.left[nxt] != -1]         # Pairs that reached a leaf drop out
+        leaves = self.value[nodes.reshape(n, self.n_trees)]
+        proba = np.zeros((n, len(self.classes_)))
+        for t in range(self.n_trees):
+            proba += leaves[:, t]
+        return proba / self.n_trees
+
+    def predict_proba(self, X):
+        X = self._as_rows(X)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+        if len(X) > LARGE_BATCH or np.isnan(X).any():
+            # Missing-value routing differs across sklearn versions: let sklearn decide
+            return self._sklearn_proba(X)
+        return self._proba_small(X) if len(X) <= SMALL_BATCH else self._proba_batch(X)
+
+    def _sklearn_proba(self, X):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)  # Fitted with feature names, called with an array
+            return self.model.predict_proba(X.astype(np.float32))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def verify(self, n_random=VERIFY_RANDOM_ROWS, seed=0):
+        """True if predictions and probabilities match sklearn on probe inputs.
+
+        Probes are every split threshold (and the next float32 either side of it),
+        plus random rows spanning the threshold range of each feature.
+        """
+        rng = np.random.default_rng(seed)
+        internal = self.left != -1
+        lo = np.zeros(self.n_features)
+        hi = np.ones(self.n_features)
+        for f in range(self.n_features):
+            t = self.threshold[internal & (self.feature == f)]
+            if len(t):
+                span = max(t.max() - t.min(), 1.0)
+                lo[f], hi[f] = t.min() - 0.1 * span, t.max() + 0.1 * span
+        probes = [rng.uniform(lo, hi, size=(n_random, self.n_features))]
+        for node in np.flatnonzero(internal):
+            t32 = np.float32(self.threshold[node])
+            for v in (np.nextafter(t32, np.float32(-np.inf)), t32, np.nextafter(t32, np.float32(np.inf))):
+                row = rng.uniform(lo, hi).reshape(1, -1)
+                row[0, self.feature[node]] = v
+                probes.append(row)
+        X = np.vstack(probes).astype(np.float32)
+
+        expected_proba = self._sklearn_proba(X)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            expected = self.model.predict(X)
+        for evaluate in (self._proba_batch, self._proba_small):
+            proba = evaluate(X.astype(np.float64))
+            if not np.allclose(proba, expected_proba, rtol=0, atol=PROBA_TOLERANCE):
+                return False
+            if not np.array_equal(self.classes_[np.argmax(proba, axis=1)], expected):
+                return False
+        return True
+
+
+def compile_model(model):
+    """CompiledForest for `model` if it verifies against sklearn, else the model itself."""
+    try:
+        compiled = CompiledForest(model)
+    except Exception as e:
+        logger.info(f"Model not compiled ({e}); serving sklearn estimator.")
+        return model
+    try:
+        if compiled.verify():
+            logger.info(f"✅ Compiled {compiled.n_trees} trees / {compiled.node_count} nodes for fast inference.")
+            return compiled
+        logger.warning("⚠️ Compiled forest disagrees with sklearn; serving sklearn estimator.")
+    except Exception as e:
+        logger.warning(f"⚠️ Compiled forest verification failed ({e}); serving sklearn estimator.")
+    return model
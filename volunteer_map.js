@@ -5,6 +5,11 @@ let volunteerMap = null;
 let volunteerMarkers = {};
 let volunteerMapInitialized = false;
 let currentVolunteerUsername = ''; // To store the logged-in volunteer's username
+let volunteerRouteLayer = null; // Suggested visiting order (polyline + stop numbers)
+let pendingLocationPings = []; // GPS fixes not yet uploaded (kept while offline)
+let lastLocationPingAt = 0;
+const LOCATION_PING_INTERVAL_MS = 5000;
+const MAX_PENDING_LOCATION_PINGS = 500;
 
 // Initialize the map for volunteer dashboard
 function initVolunteerMap() {
@@ -22,7 +27,7 @@ function initVolunteerMap() {
     volunteerMap = L.map('volunteer-live-map').setView(defaultCenter, defaultZoom);
     
     // Add OpenStreetMap tiles
-    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    L.tileLayer('/map/tiles/{z}/{x}/{y}.png', {
         attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors',
         maxZoom: 19
     }).addTo(volunteerMap);
@@ -41,14 +46,8 @@ function loadVolunteerSOSMarkers() {
         return;
     }
     
-    fetch('/volunteer/api/sos_map_data')
-        .then(response => {
-            if (!response.ok) {
-                console.error(`Error fetching volunteer SOS data: ${response.status} ${response.statusText}`);
-                throw new Error('Failed to fetch SOS data');
-            }
-            return response.json();
-        })
+    // Binary columnar payload (see sos_wire.js); descriptions load lazily per popup
+    fetchSOSMapData('/volunteer/api/sos_map_data')
         .then(sosData => {
             console.log(`Loaded ${sosData.length} SOS alerts for volunteer map`);
             
@@ -75,6 +74,61 @@ function loadVolunteerSOSMarkers() {
         .catch(error => {
             console.error('Error loading volunteer SOS markers:', error);
         });
+    
+    loadVolunteerRoute();
+}
+
+// Draw the suggested visiting order over assigned SOS sites and the depot pickup
+function loadVolunteerRoute() {
+    const drawRoute = (position) => {
+        let url = '/volunteer/api/route';
+        if (position) {
+            url += `?lat=${position.coords.latitude}&lng=${position.coords.longitude}`;
+        }
+        fetch(url)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`Failed to fetch route: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(route => {
+                if (volunteerRouteLayer) {
+                    volunteerMap.removeLayer(volunteerRouteLayer);
+                    volunteerRouteLayer = null;
+                }
+                if (!route.stops || route.stops.length === 0) {
+                    return;
+                }
+                
+                const points = [[route.start.latitude, route.start.longitude]]
+                    .concat(route.stops.map(stop => [stop.latitude, stop.longitude]));
+                volunteerRouteLayer = L.layerGroup([
+                    L.polyline(points, { color: '#007bff', weight: 4, opacity: 0.7, dashArray: '8, 6' })
+                ]);
+                route.stops.forEach(stop => {
+                    L.marker([stop.latitude, stop.longitude], {
+                        icon: L.divIcon({
+                            className: 'route-stop',
+                            html: `<div style="background-color: #007bff; width: 20px; height: 20px; border-radius: 50%; color: white; font-size: 11px; font-weight: bold; display: flex; align-items: center; justify-content: center;">${stop.order}</div>`,
+                            iconSize: [20, 20],
+                            iconAnchor: [10, 28]
+                        })
+                    }).bindTooltip(`${stop.order}. ${stop.label} (${stop.leg_km} km)`).addTo(volunteerRouteLayer);
+                });
+                volunteerRouteLayer.addTo(volunteerMap);
+                console.log(`Route drawn: ${route.stops.length} stops, ${route.total_km} km`);
+            })
+            .catch(error => {
+                console.error('Error loading volunteer route:', error);
+            });
+    };
+    
+    if (navigator.geolocation) {
+        navigator.geolocation.getCurrentPosition(drawRoute, () => drawRoute(null), { timeout: 5000 });
+    } else {
+        drawRoute(null);
+    }
 }
 
 // Add a single SOS marker to volunteer map
@@ -125,7 +179,7 @@ function addVolunteerSOSMarker(sos) {
     const marker = L.marker([lat, lng], { icon: markerIcon }).addTo(volunteerMap);
     
     // Create popup content with "Get Directions"
-    const popupContent = `
+    const buildPopupContent = () => `
         <div style="min-width: 200px;">
             <h4 style="margin: 0 0 10px 0; color: #333;">SOS Alert #${sos.id}</h4>
             <p style="margin: 5px 0;"><strong>User:</strong> ${sos.username}</p>
@@ -139,7 +193,17 @@ function addVolunteerSOSMarker(sos) {
         </div>
     `;
     
-    marker.bindPopup(popupContent);
+    if (sos.description !== undefined) {
+        marker.bindPopup(buildPopupContent());
+    } else {
+        // Compact format: fetch popup details on first open
+        marker.bindPopup('<div style="min-width: 200px;">Loading SOS #' + sos.id + '...</div>');
+        marker.once('popupopen', () => {
+            loadSOSDetails(`/volunteer/api/sos/${sos.id}`, sos)
+                .then(() => marker.setPopupContent(buildPopupContent()))
+                .catch(error => console.error(`Error loading details for SOS #${sos.id}:`, error));
+        });
+    }
     
     // Store marker reference
     volunteerMarkers[sos.id] = marker;
@@ -163,6 +227,54 @@ function updateVolunteerSOSMarker(sos) {
     }
 }
 
+// Share this volunteer's position with the admin map (one ping per LOCATION_PING_INTERVAL_MS)
+function startLocationTracking() {
+    if (!navigator.geolocation) {
+        console.warn('Geolocation unavailable; location sharing disabled');
+        return;
+    }
+    navigator.geolocation.watchPosition(position => {
+        const now = Date.now();
+        if (now - lastLocationPingAt < LOCATION_PING_INTERVAL_MS) {
+            return;
+        }
+        lastLocationPingAt = now;
+        pendingLocationPings.push({
+            latitude: position.coords.latitude,
+            longitude: position.coords.longitude,
+            accuracy: position.coords.accuracy,
+            timestamp: position.timestamp
+        });
+        if (pendingLocationPings.length > MAX_PENDING_LOCATION_PINGS) {
+            pendingLocationPings.splice(0, pendingLocationPings.length - MAX_PENDING_LOCATION_PINGS);
+        }
+        sendLocationPings();
+    }, error => console.warn('Location watch error:', error.message), { enableHighAccuracy: true, maximumAge: 5000 });
+}
+
+// Upload buffered pings in one request; on failure they stay queued for the next fix
+function sendLocationPings() {
+    if (pendingLocationPings.length === 0 || !navigator.onLine) {
+        return;
+    }
+    const batch = pendingLocationPings;
+    pendingLocationPings = [];
+    fetch('/volunteer/api/location', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ pings: batch })
+    })
+        .then(response => {
+            if (response.status >= 500 || response.status === 429) {
+                throw new Error(`Location upload failed: ${response.status}`);
+            }
+        })
+        .catch(error => {
+            console.warn(error.message);
+            pendingLocationPings = batch.concat(pendingLocationPings);
+        });
+}
+
 // Refresh map data periodically (fallback if SocketIO fails)
 function startVolunteerMapPolling() {
     setInterval(() => {
@@ -180,8 +292,10 @@ document.addEventListener('DOMContentLoaded', function() {
         setTimeout(() => {
             initVolunteerMap();
             startVolunteerMapPolling();
+            startLocationTracking();
         }, 500);
     }
+    window.addEventListener('online', sendLocationPings);
     
     // SocketIO real-time updates (if available)
     if (typeof socket !== 'undefined') {
@@ -193,12 +307,32 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
         
+        // Store-and-forward batch uploads arrive as one coalesced event
+        socket.on('new_sos_alerts', function(data) {
+            console.log('SOS batch received via SocketIO:', data.alerts.length, 'alerts');
+            if (volunteerMap) {
+                data.alerts.forEach(function(alert) {
+                    if (alert.status === 'pending') {
+                        addVolunteerSOSMarker(alert);
+                    }
+                });
+            }
+        });
+        
         socket.on('sos_status_updated', function(data) {
             console.log('SOS status updated via SocketIO:', data);
             if (volunteerMap) {
                 updateVolunteerSOSMarker(data);
             }
         });
+        
+        // Unattended SOS re-broadcast with raised risk
+        socket.on('sos_escalated', function(data) {
+            console.log('SOS escalated via SocketIO:', data);
+            if (volunteerMap) {
+                updateVolunteerSOSMarker(data);
+            }
+        });
     }
 });
 
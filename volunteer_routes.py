@@ -1,53 +1,25 @@
 from flask import Blueprint, render_template, session, flash, redirect, url_for, request, jsonify
 from db_config import get_db_connection
+from shard_router import connect_sos
+from sos_wire import requested_format, compact_response
+from sos_read_model import read_model, bump_sos_version
+from sos_triage import triage_queue
+from route_planner import plan_volunteer_route, depot_stop
+from inventory_ops import (emit_inventory_changes, refresh_stock, VOLUNTEER_DELIVERY_TRANSITIONS,
+                           VOLUNTEER_DELIVERY_STATUSES)
+from stock_forecast import stock_forecaster
+from response_cache import response_cache, cache_key, cached_response, SOS_TOPIC, INVENTORY_TOPIC
+from volunteer_tracking import tracker
+from sla_metrics import record_transition
+from degradation import serve, stale_notice
+from rate_limit import rate_limited
+from extensions import socketio, run_blocking
 import logging
-import os
-import numpy as np
-import random
-import joblib
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
 
 volunteer_bp = Blueprint('volunteer', __name__)
 logger = logging.getLogger(__name__)
 
-# --- AI Prediction Model Integration ---
-model_path = os.path.join("models", "disaster_model.pkl")
-prediction_model = None
-risk_level_labels = {0: 'Low', 1: 'Medium', 2: 'High'}
-
-def train_and_save_dummy_model_for_volunteer():
-    logger.warning("⚠️ No trained model found for volunteer dashboard. Training a dummy model.")
-    data = {
-        'rainfall': [10, 50, 100, 5, 80, 60, 20, 150, 30, 70],
-        'temperature': [25, 30, 35, 20, 40, 28, 32, 38, 27, 33],
-        'humidity': [60, 80, 90, 50, 95, 70, 65, 98, 75, 88],
-        'risk_level': ['Low', 'Medium', 'High', 'Low', 'High', 'Medium', 'Low', 'High', 'Medium', 'High']
-    }
-    df = pd.DataFrame(data)
-    risk_mapping = {'Low': 0, 'Medium': 1, 'High': 2}
-    df['risk_encoded'] = df['risk_level'].map(risk_mapping)
-    X = df[['rainfall', 'temperature', 'humidity']]
-    y = df['risk_encoded']
-    dummy_model = RandomForestClassifier(n_estimators=10, random_state=42)
-    dummy_model.fit(X, y)
-    os.makedirs(os.path.dirname(model_path), exist_ok=True)
-    joblib.dump(dummy_model, model_path)
-    logger.info("✅ Dummy disaster prediction model trained and saved for volunteer.")
-    return dummy_model, {v: k for k, v in risk_mapping.items()}
-
-try:
-    if os.path.exists(model_path):
-        prediction_model = joblib.load(model_path)
-        risk_level_labels = {0: 'Low', 1: 'Medium', 2: 'High'}
-        logger.info("✅ Disaster prediction model loaded successfully for volunteer.")
-    else:
-        prediction_model, risk_level_labels = train_and_save_dummy_model_for_volunteer()
-except Exception as e:
-    logger.error(f"⚠️ Error loading model for volunteer prediction: {e}. Falling back to dummy mode.")
-    prediction_model = None
-
-
 @volunteer_bp.route('/dashboard')
 def volunteer_dashboard():
     if 'username' not in session or session.get('role') != 'volunteer':
@@ -56,31 +28,51 @@ def volunteer_dashboard():
     
     username = session['username']
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # While the database is locked or slow, the volunteer's last complete dashboard is shown marked as stale
+    try:
+        data, stale_since = serve(cache_key('volunteer_dashboard', per_user=True),
+                                  lambda: _volunteer_dashboard_data(username), good=lambda d: d['complete'])
+        if stale_since:
+            flash(stale_notice(stale_since), "warning")
+        alerts, resources, deliveries = data['alerts'], data['resources'], data['deliveries']
+    except Exception as e:
+        logger.error(f"Error loading volunteer dashboard for {username}: {e}")
+        flash("Error loading dashboard data. Please try again.", "danger")
+        alerts, resources, deliveries = [], [], []
+
+    logger.info(f"✅ Volunteer dashboard data ready for {username}: {len(alerts)} alerts, {len(resources)} resources, {len(deliveries)} deliveries")
+    
+    return render_template('volunteer_dashboard.html', alerts=alerts, resources=resources, deliveries=deliveries, username=username, role=session.get('role'))
+
 
-    # Fetch assigned or pending alerts for this volunteer
-    cursor.execute("""
-        SELECT 
-            sr.id, 
-            u.username, 
-            CAST(sr.latitude AS REAL) as latitude,
-            CAST(sr.longitude AS REAL) as longitude,
-            sr.description, 
-            sr.status, 
-            sr.timestamp, 
-            sr.assigned_to, 
-            sr.risk_level
-        FROM sos_requests sr
-        JOIN users u ON sr.user_id = u.id
-        WHERE (sr.assigned_to = ? OR sr.status = 'pending')
-        ORDER BY sr.timestamp DESC
-    """, (username,))
-    alerts_raw = cursor.fetchall()
-    alerts = [dict(row) for row in alerts_raw]
-
-    logger.info(f"Volunteer dashboard fetch for {username}: {len(alerts_raw)} raw alerts fetched from DB")
+def _volunteer_dashboard_data(username):
+    """Alerts, available resources and own pending deliveries; complete=False if a section fell back to empty."""
+    # Fetch assigned or pending alerts for this volunteer (served from the in-memory read model)
+    alerts = read_model.alerts_for_volunteer(username)
 
+    logger.info(f"Volunteer dashboard fetch for {username}: {len(alerts)} alerts from read model")
+
+    # Resources are the same for every volunteer, deliveries are per volunteer; both are cached until
+    # the next inventory event
+    # (a failed fetch is logged, shown as empty and not cached)
+    complete = True
+    try:
+        resources = response_cache.get_or_compute(cache_key('volunteer_resources'), (INVENTORY_TOPIC,),
+                                                  lambda: _available_resources(username))
+    except Exception:
+        resources, complete = [], False
+    try:
+        deliveries = response_cache.get_or_compute(cache_key('volunteer_deliveries', per_user=True),
+                                                   (INVENTORY_TOPIC,), lambda: _open_deliveries(username))
+    except Exception:
+        deliveries, complete = [], False
+    return {'alerts': alerts, 'resources': resources, 'deliveries': deliveries, 'complete': complete}
+
+
+def _available_resources(username):
+    """Resources with stock left (username is only used for logging)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
     # FIXED: Fetch ALL available resources (not just status='available')
     # The issue was the WHERE clause filtering too strictly
     try:
@@ -105,27 +97,33 @@ def volunteer_dashboard():
                 logger.info(f"  - {dict(res)}")
     except Exception as res_e:
         logger.error(f"❌ Error fetching resources for volunteer {username}: {res_e}")
-        resources = []
+        raise
+    finally:
+        conn.close()
+    return resources
+
 
-    # Fetch volunteer's own pending deliveries
+def _open_deliveries(username):
+    """The volunteer's own deliveries that are not delivered or cancelled yet."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Fetch volunteer's own open deliveries (pending, approved or dispatched)
     try:
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT delivery_id as id, volunteer_username, item, quantity, status 
             FROM resource_deliveries 
-            WHERE volunteer_username = ? AND status = 'pending'
+            WHERE volunteer_username = ? AND status IN ({','.join('?' * len(VOLUNTEER_DELIVERY_STATUSES))})
             ORDER BY timestamp DESC
-        """, (username,))
+        """, (username, *VOLUNTEER_DELIVERY_STATUSES))
         deliveries_raw = cursor.fetchall()
         deliveries = [dict(row) for row in deliveries_raw]
-        logger.info(f"Fetched {len(deliveries)} pending deliveries for volunteer {username}")
+        logger.info(f"Fetched {len(deliveries)} open deliveries for volunteer {username}")
     except Exception as del_e:
         logger.warning(f"No resource_deliveries table or error fetching deliveries: {del_e}. Using empty list.")
-        deliveries = []
-
-    conn.close()
-    logger.info(f"✅ Volunteer dashboard data ready for {username}: {len(alerts)} alerts, {len(resources)} resources, {len(deliveries)} deliveries")
-    
-    return render_template('volunteer_dashboard.html', alerts=alerts, resources=resources, deliveries=deliveries, username=username, role=session.get('role'))
+        raise
+    finally:
+        conn.close()
+    return deliveries
 
 
 @volunteer_bp.route('/request_resource', methods=['POST'])
@@ -150,42 +148,24 @@ def request_resource():
         if quantity <= 0:
             raise ValueError("Quantity must be positive")
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        forecast = stock_forecaster.snapshot()  # History as committed, before this request
+        delivery_id, available_quantity, changed_resources, stock_alerts = run_blocking(
+            _reserve_resource, username, item, quantity, forecast)
         
-        # FIXED: Check resource by resource_name, not just status
-        cursor.execute("SELECT id, quantity, status FROM resources WHERE resource_name = ?", (item,))
-        stock_result = cursor.fetchone()
-        
-        if not stock_result:
+        if available_quantity is None:
             flash(f"Resource '{item}' not found in inventory!", "danger")
             logger.warning(f"⚠️ Resource '{item}' not found for volunteer {username}")
-            conn.close()
             return redirect(url_for('volunteer.volunteer_dashboard'))
         
-        available_quantity = stock_result[1]
-        logger.info(f"📊 Resource '{item}' check: Available={available_quantity}, Requested={quantity}")
-        
-        if available_quantity < quantity:
+        if delivery_id is None:
             flash(f"Insufficient stock for '{item}'. Available: {available_quantity}, Requested: {quantity}", "danger")
             logger.warning(f"⚠️ Insufficient stock for '{item}': Available={available_quantity}, Requested={quantity}")
-            conn.close()
             return redirect(url_for('volunteer.volunteer_dashboard'))
         
-        # Create delivery request (don't reduce stock yet - admin will approve)
-        cursor.execute("""
-            INSERT INTO resource_deliveries (volunteer_username, item, quantity, status, timestamp)
-            VALUES (?, ?, ?, 'pending', CURRENT_TIMESTAMP)
-        """, (username, item, quantity))
-        delivery_id = cursor.lastrowid
-        
-        # OPTIONAL: Reduce stock immediately (or wait for admin approval)
-        # Comment out these lines if you want admin to approve first
-        cursor.execute("UPDATE resources SET quantity = quantity - ? WHERE resource_name = ?",
-                       (quantity, item))
-        
-        conn.commit()
-        conn.close()
+        # Reserved stock counts as consumption for the depletion forecast (once committed)
+        stock_forecaster.record(item, quantity)
+        emit_inventory_changes([{'id': delivery_id, 'volunteer_username': username, 'item': item,
+                                 'quantity': quantity, 'status': 'pending'}], changed_resources, stock_alerts)
         
         flash(f"✅ Resource request submitted! {quantity}x '{item}' (Request ID: {delivery_id})", "success")
         logger.info(f"✅ Resource request created: {username} requested {quantity}x {item} (Delivery ID: {delivery_id})")
@@ -211,13 +191,54 @@ def request_resource():
     except Exception as e:
         flash(f"Error requesting resource: {e}", "danger")
         logger.error(f"Error in request_resource by {username}: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
     
     return redirect(url_for('volunteer.volunteer_dashboard'))
 
 
+def _reserve_resource(username, item, quantity, forecast):
+    """Create a pending delivery and reserve its stock in one transaction (SQL only: called through run_blocking).
+
+    Returns (delivery_id, available_quantity, changed_resources, stock_alerts). delivery_id is
+    None when the item is not in inventory (available_quantity None too) or has too little stock.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        
+        # FIXED: Check resource by resource_name, not just status
+        cursor.execute("SELECT id, quantity, status FROM resources WHERE resource_name = ?", (item,))
+        stock_result = cursor.fetchone()
+        if not stock_result:
+            return None, None, [], []
+        
+        available_quantity = stock_result[1]
+        logger.info(f"📊 Resource '{item}' check: Available={available_quantity}, Requested={quantity}")
+        if available_quantity < quantity:
+            return None, available_quantity, [], []
+        
+        # Create delivery request (don't reduce stock yet - admin will approve)
+        cursor.execute("""
+            INSERT INTO resource_deliveries (volunteer_username, item, quantity, status, timestamp)
+            VALUES (?, ?, ?, 'pending', CURRENT_TIMESTAMP)
+        """, (username, item, quantity))
+        delivery_id = cursor.lastrowid
+        
+        # OPTIONAL: Reduce stock immediately (or wait for admin approval)
+        # Comment out these lines if you want admin to approve first
+        cursor.execute("UPDATE resources SET quantity = quantity - ? WHERE resource_name = ?",
+                       (quantity, item))
+        
+        # The reservation is still pending in the forecast snapshot
+        changed_resources, stock_alerts = refresh_stock(cursor, [item], forecast, [(item, quantity, None)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return delivery_id, available_quantity, changed_resources, stock_alerts
+
+
 @volunteer_bp.route('/update_delivery', methods=['POST'])
 def update_delivery():
     if 'username' not in session or session.get('role') != 'volunteer':
@@ -234,56 +255,83 @@ def update_delivery():
     
     try:
         delivery_id = int(delivery_id_str)
-        if status not in ['delivered', 'cancelled']:
+        if status not in VOLUNTEER_DELIVERY_TRANSITIONS:
             raise ValueError("Invalid status")
         
-        conn = get_db_connection()
+        forecast = stock_forecaster.snapshot()  # History still contains this delivery's reservation
+        delivery_info = run_blocking(_set_delivery_status, username, delivery_id, status, forecast)
+        
+        if not delivery_info:
+            flash("No delivery found with that ID.", "danger")
+            return redirect(url_for('volunteer.volunteer_dashboard'))
+        
+        item, quantity, changed_resources, stock_alerts, consumption = delivery_info
+        stock_forecaster.record_all(consumption)  # Once committed, and only what this change returned
+        emit_inventory_changes([{'id': delivery_id, 'volunteer_username': username, 'item': item,
+                                 'quantity': quantity, 'status': status}], changed_resources, stock_alerts)
+        
+        flash(f"Delivery {delivery_id} updated to '{status}'!", "success")
+        logger.info(f"Delivery {delivery_id} updated by {username} to '{status}'")
+        
+    except ValueError as ve:
+        flash(f"Invalid input: {ve}", "danger")
+        logger.warning(f"Invalid input in update_delivery by {username}: {ve}")
+    except Exception as e:
+        flash(f"Error updating delivery: {e}", "danger")
+        logger.error(f"Error in update_delivery by {username}: {e}")
+    
+    return redirect(url_for('volunteer.volunteer_dashboard'))
+
+
+def _set_delivery_status(username, delivery_id, status, forecast):
+    """Mark one of username's deliveries delivered / cancelled in one transaction (SQL only: called through run_blocking).
+
+    Returns (item, quantity, changed_resources, stock_alerts, consumption), or None when
+    username has no such delivery; raises ValueError when its current status does
+    not allow the change (only dispatched deliveries can be delivered, only
+    pending / approved ones cancelled). consumption holds the cancelled
+    reservation to record on stock_forecaster once committed.
+    """
+    conn = get_db_connection()
+    try:
         cursor = conn.cursor()
         
         # Fetch delivery details first
         cursor.execute("""
-            SELECT item, quantity FROM resource_deliveries 
+            SELECT item, quantity, timestamp, status FROM resource_deliveries 
             WHERE delivery_id = ? AND volunteer_username = ?
         """, (delivery_id, username))
         delivery_info = cursor.fetchone()
-        
         if not delivery_info:
-            flash("No delivery found with that ID.", "danger")
-            conn.close()
-            return redirect(url_for('volunteer.volunteer_dashboard'))
+            return None
         
-        item = delivery_info[0]
-        quantity = delivery_info[1]
+        item, quantity, requested_at = delivery_info[0], delivery_info[1], delivery_info[2]
         
-        # Update delivery status
-        cursor.execute("""
+        # Update delivery status, only from a status that allows it (a second cancel must not return stock twice)
+        allowed_from = VOLUNTEER_DELIVERY_TRANSITIONS[status]
+        cursor.execute(f"""
             UPDATE resource_deliveries 
             SET status = ? 
-            WHERE delivery_id = ? AND volunteer_username = ?
-        """, (status, delivery_id, username))
+            WHERE delivery_id = ? AND volunteer_username = ? AND status IN ({','.join('?' * len(allowed_from))})
+        """, (status, delivery_id, username, *allowed_from))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            raise ValueError(f"Cannot mark a '{delivery_info[3]}' delivery as '{status}'")
         
         # If cancelled, return stock
+        changed_resources, stock_alerts, consumption = [], [], []
         if status == 'cancelled':
             cursor.execute("UPDATE resources SET quantity = quantity + ? WHERE resource_name = ?", (quantity, item))
             logger.info(f"🔄 Returned {quantity}x {item} to inventory (cancelled)")
-        
+            consumption = [(item, -quantity, requested_at)]
+            changed_resources, stock_alerts = refresh_stock(cursor, [item], forecast, consumption)
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        
-        flash(f"Delivery {delivery_id} updated to '{status}'!", "success")
-        logger.info(f"Delivery {delivery_id} updated by {username} to '{status}'")
-        
-    except ValueError as ve:
-        flash(f"Invalid input: {ve}", "danger")
-        logger.warning(f"Invalid input in update_delivery by {username}: {ve}")
-    except Exception as e:
-        flash(f"Error updating delivery: {e}", "danger")
-        logger.error(f"Error in update_delivery by {username}: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
-    
-    return redirect(url_for('volunteer.volunteer_dashboard'))
+    return item, quantity, changed_resources, stock_alerts, consumption
 
 
 @volunteer_bp.route('/acknowledge_sos', methods=['POST'])
@@ -301,45 +349,21 @@ def acknowledge_sos():
     
     try:
         sos_id = int(sos_id_str)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE sos_requests 
-            SET status = 'resolved' 
-            WHERE id = ? AND assigned_to = ?
-        """, (sos_id, username))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+        version, updated_sos = run_blocking(_resolve_sos, sos_id, username)
         
-        if affected_rows > 0:
+        if version is not None:
+            read_model.apply_change(sos_id, version)
             flash(f"SOS {sos_id} marked as resolved!", "success")
             logger.info(f"SOS {sos_id} acknowledged/resolved by volunteer {username}")
             
             try:
                 from app import socketio
-                if socketio:
-                    conn_socket = get_db_connection()
-                    cursor_socket = conn_socket.cursor()
-                    cursor_socket.execute("""
-                        SELECT sr.id, u.username, sr.latitude, sr.longitude, sr.description, sr.status, sr.assigned_to, sr.risk_level, sr.timestamp
-                        FROM sos_requests sr JOIN users u ON sr.user_id = u.id
-                        WHERE sr.id = ?
-                    """, (sos_id,))
-                    updated_sos_raw = cursor_socket.fetchone()
-                    conn_socket.close()
-                    
-                    if updated_sos_raw:
-                        updated_sos = dict(zip([
-                            'id', 'username', 'latitude', 'longitude', 'description', 
-                            'status', 'assigned_to', 'risk_level', 'timestamp'
-                        ], updated_sos_raw))
-                        
-                        socketio.emit('sos_status_updated', updated_sos, 
-                                    room='admin-room', 
-                                    broadcast=True, 
-                                    include_self=False)
-                        logger.info(f"✅ Real-time SOS resolution broadcasted for ID {sos_id} to admin room")
+                if socketio and updated_sos:
+                    socketio.emit('sos_status_updated', updated_sos, 
+                                room='admin-room', 
+                                broadcast=True, 
+                                include_self=False)
+                    logger.info(f"✅ Real-time SOS resolution broadcasted for ID {sos_id} to admin room")
             except Exception as emit_e:
                 logger.error(f"⚠️ SocketIO broadcast failed for SOS resolution {sos_id}: {emit_e}")
         else:
@@ -351,13 +375,44 @@ def acknowledge_sos():
     except Exception as e:
         flash(f"Error acknowledging SOS: {e}", "danger")
         logger.error(f"Error in acknowledge_sos by {username}: {e}")
-        if 'conn' in locals():
-            conn.rollback()
-            conn.close()
     
     return redirect(url_for('volunteer.volunteer_dashboard'))
 
 
+def _resolve_sos(sos_id, username):
+    """Resolve an SOS assigned to username in one transaction (SQL only: called through run_blocking).
+
+    Returns (version, updated row dict), or (None, None) when no such SOS is assigned to username.
+    """
+    conn = connect_sos(sos_id)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE sos_requests 
+            SET status = 'resolved', resolved_at = datetime('now') 
+            WHERE id = ? AND assigned_to = ?
+        """, (sos_id, username))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return None, None
+        record_transition(cursor, sos_id, 'resolved', username)
+        version = bump_sos_version(cursor)
+        conn.commit()
+        
+        cursor.execute("""
+            SELECT sr.id, sr.username, sr.latitude, sr.longitude, sr.description, sr.status, sr.assigned_to, sr.risk_level, sr.timestamp
+            FROM sos_requests sr
+            WHERE sr.id = ?
+        """, (sos_id,))
+        row = cursor.fetchone()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return version, dict(row) if row else None
+
+
 @volunteer_bp.route('/api/sos_map_data', methods=['GET'])
 def get_sos_map_data():
     """Returns SOS requests for the logged-in volunteer (pending or assigned) for live map plotting"""
@@ -365,28 +420,18 @@ def get_sos_map_data():
         return jsonify({'error': 'Unauthorized'}), 401
     
     username = session['username']
-    
+    # Compact/binary columnar format (opt-in via ?format= or Accept header)
+    fmt = requested_format(request)
+    return cached_response('volunteer_sos_map_data', (SOS_TOPIC,), lambda: _sos_map_data(username, fmt),
+                           per_user=True, params=(fmt,))
+
+
+def _sos_map_data(username, fmt):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT 
-                sr.id,
-                u.username,
-                CAST(sr.latitude AS REAL) as latitude,
-                CAST(sr.longitude AS REAL) as longitude,
-                sr.description,
-                sr.status,
-                sr.risk_level,
-                sr.assigned_to,
-                sr.timestamp
-            FROM sos_requests sr
-            JOIN users u ON sr.user_id = u.id
-            WHERE (sr.assigned_to = ? OR sr.status = 'pending')
-            ORDER BY sr.timestamp DESC
-        """, (username,))
-        sos_data_raw = cursor.fetchall()
-        conn.close()
+        if fmt:
+            return compact_response(read_model.compact_rows(username), fmt)
+
+        sos_data_raw = read_model.alerts_for_volunteer(username)
         
         sos_data = [
             {
@@ -408,3 +453,138 @@ def get_sos_map_data():
     except Exception as e:
         logger.error(f"Error fetching volunteer SOS map data for {username}: {e}")
         return jsonify({'error': 'Failed to fetch map data'}), 500
+
+
+@volunteer_bp.route('/api/sos/<int:sos_id>', methods=['GET'])
+def get_sos_details(sos_id):
+    """Popup details for a single SOS marker (loaded lazily by the compact map format)"""
+    if 'username' not in session or session.get('role') != 'volunteer':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    username = session['username']
+    
+    try:
+        details = run_blocking(_sos_details, sos_id, username)
+        if details is None:
+            return jsonify({'error': 'SOS not found'}), 404
+        return jsonify(details)
+    except Exception as e:
+        logger.error(f"Error fetching SOS details {sos_id} for volunteer {username}: {e}")
+        return jsonify({'error': 'Failed to fetch SOS details'}), 500
+
+
+def _sos_details(sos_id, username):
+    """Popup fields of an SOS the volunteer may see, or None (SQL only: called through run_blocking)."""
+    conn = connect_sos(sos_id)
+    try:
+        row = conn.execute("""
+            SELECT sr.id, sr.username, sr.description, sr.assigned_to, sr.timestamp
+            FROM sos_requests sr
+            WHERE sr.id = ? AND (sr.assigned_to = ? OR sr.status = 'pending')
+        """, (sos_id, username)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+@volunteer_bp.route('/api/triage', methods=['GET'])
+def get_triage():
+    """Top-k pending SOS by triage score; pass lat/lng to rank by distance from the volunteer"""
+    if 'username' not in session or session.get('role') != 'volunteer':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), 500)
+        lat = request.args.get('lat', type=float)
+        lng = request.args.get('lng', type=float)
+        return jsonify(triage_queue.top_k(k, lat, lng))
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    except Exception as e:
+        logger.error(f"Error computing triage list for {session['username']}: {e}")
+        return jsonify({'error': 'Failed to compute triage list'}), 500
+
+
+@volunteer_bp.route('/api/route', methods=['GET'])
+def get_route():
+    """Suggested visiting order over the volunteer's assigned SOS sites and delivery pickup"""
+    if 'username' not in session or session.get('role') != 'volunteer':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    username = session['username']
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    start = (lat, lng) if lat is not None and lng is not None else None
+    
+    try:
+        stops = [
+            {
+                'type': 'sos',
+                'id': alert['id'],
+                'latitude': alert['latitude'],
+                'longitude': alert['longitude'],
+                'label': f"SOS #{alert['id']} ({alert['risk_level']})"
+            }
+            for alert in read_model.alerts_for_volunteer(username)
+            if alert['assigned_to'] == username and alert['status'] in ('assigned', 'in_progress')
+            and alert['latitude'] and alert['longitude']
+        ]
+        
+        try:
+            deliveries = run_blocking(_route_deliveries, username)
+        except Exception as del_e:
+            logger.warning(f"No resource_deliveries table or error fetching deliveries: {del_e}. Using empty list.")
+            deliveries = []
+        if deliveries:
+            stops.append(depot_stop(deliveries))
+        
+        route = plan_volunteer_route(username, stops, start)
+        logger.info(f"API: Route for {username}: {len(route['stops'])} stops, {route['total_km']} km (cached={route['cached']})")
+        return jsonify(route)
+    except Exception as e:
+        logger.error(f"Error planning route for volunteer {username}: {e}")
+        return jsonify({'error': 'Failed to plan route'}), 500
+
+
+def _route_deliveries(username):
+    """Deliveries the volunteer still has to pick up (SQL only: called through run_blocking)."""
+    conn = get_db_connection()
+    try:
+        return [dict(row) for row in conn.execute(f"""
+            SELECT item, quantity FROM resource_deliveries 
+            WHERE volunteer_username = ? AND status IN ({','.join('?' * len(VOLUNTEER_DELIVERY_STATUSES))})
+        """, (username, *VOLUNTEER_DELIVERY_STATUSES))]
+    finally:
+        conn.close()
+
+
+def _location_pings(data):
+    """A single ping object or {'pings': [...]} (offline buffer) -> list of raw pings."""
+    if isinstance(data, dict) and isinstance(data.get('pings'), list):
+        return data['pings']
+    return [data]
+
+
+@volunteer_bp.route('/api/location', methods=['POST'])
+@rate_limited('location')
+def post_location():
+    """GPS ping(s) from the volunteer's device: latest position for the admin map, downsampled trail"""
+    if 'username' not in session or session.get('role') != 'volunteer':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'JSON body required'}), 400
+    accepted, errors = tracker.ingest(session['username'], _location_pings(data))
+    if not accepted:
+        return jsonify({'accepted': 0, 'errors': errors}), 400
+    return jsonify({'accepted': accepted, 'errors': errors})
+
+
+@socketio.on('volunteer_location')
+def on_volunteer_location(data):
+    """Same as POST /volunteer/api/location over an open socket (no HTTP round trip per ping)"""
+    if 'username' not in session or session.get('role') != 'volunteer':
+        return {'error': 'Unauthorized'}
+    accepted, errors = tracker.ingest(session['username'], _location_pings(data))
+    return {'accepted': accepted, 'errors': errors}
@@ -0,0 +1,370 @@
+# volunteer_tracking.py - Volunteer GPS pings: latest positions, downsampled trails, live map deltas
+#
+# Volunteers' browsers send a location ping every few seconds (POST
+# /volunteer/api/location or the 'volunteer_location' socket event; offline
+# buffered pings arrive as one batch). Each ping costs a few dict / array
+# operations under one lock:
+#
+#   PositionStore   latest position per volunteer in parallel arrays (8 bytes
+#                   per coordinate instead of a dict per volunteer) plus a
+#                   geocell -> volunteers index for nearby() queries
+#   TrailRecorder   keeps a ping for the trail only if the volunteer moved
+#                   TRAIL_MIN_DISTANCE_M or TRAIL_MAX_INTERVAL passed since the
+#                   last kept point; kept points are written in batches
+#                   (one executemany transaction per TRAIL_FLUSH_SECONDS)
+#
+# Admin maps get 'volunteer_positions' deltas at most every
+# POSITION_PUSH_INTERVAL seconds: only volunteers that moved since the last
+# push (many pings coalesce into one entry), plus those that went silent for
+# POSITION_TTL. The push / flush loop starts with the first ping.
+#
+# Positions are per worker process; with several workers, put location traffic
+# on one of them (or use sticky sessions) so admins see every volunteer.
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+from geo_utils import geocell, haversine_km, GEOCELL_DEG
+from db_config import get_db_connection
+from extensions import socketio, run_blocking, native_lock
+
+logger = logging.getLogger(__name__)
+
+POSITION_TTL = float(os.environ.get('POSITION_TTL', 300))  # Seconds without a ping before a volunteer is offline
+POSITION_PUSH_INTERVAL = float(os.environ.get('POSITION_PUSH_INTERVAL', 2.0))
+TRAIL_MIN_DISTANCE_M = float(os.environ.get('TRAIL_MIN_DISTANCE_M', 50))
+TRAIL_MAX_INTERVAL = float(os.environ.get('TRAIL_MAX_INTERVAL', 60))  # Seconds
+TRAIL_FLUSH_SECONDS = float(os.environ.get('TRAIL_FLUSH_SECONDS', 5))
+TRAIL_MAX_BUFFER = 200000  # Trail points held while the database is unavailable (oldest dropped)
+MAX_CLOCK_SKEW = 60        # Seconds a ping timestamp may be ahead of the server
+MAX_PING_AGE = float(os.environ.get('MAX_PING_AGE', 7 * 24 * 3600))  # Older (or negative) timestamps: clock is wrong
+MAX_PINGS_PER_REQUEST = 500
+KM_PER_DEG = 111.32
+
+
+class PingError(ValueError):
+    """Malformed location ping."""
+
+
+def parse_ping(raw, now=None):
+    """{'latitude', 'longitude', 'timestamp'?, 'accuracy'?} -> (lat, lng, ts, accuracy)."""
+    now = time.time() if now is None else now
+    if not isinstance(raw, dict):
+        raise PingError("Ping must be an object")
+    try:
+        lat = float(raw['latitude'])
+        lng = float(raw['longitude'])
+        ts = float(raw.get('timestamp') or now)
+        accuracy = float(raw.get('accuracy') or 0.0)
+    except (KeyError, TypeError, ValueError):
+        raise PingError("Ping needs numeric latitude and longitude")
+    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        raise PingError("Invalid coordinates")
+    if not math.isfinite(ts) or not math.isfinite(accuracy) or accuracy < 0:
+        raise PingError("Ping timestamp and accuracy must be finite (accuracy >= 0)")
+    if ts > 1e11:
+        ts /= 1000.0  # Milliseconds (Date.now())
+    if ts < now - MAX_PING_AGE:
+        ts = now  # Device clock is wrong; arrival time is the best we have
+    return lat, lng, min(ts, now + MAX_CLOCK_SKEW), accuracy
+
+
+class PositionStore:
+    """Latest position per volunteer, column-oriented, with a geocell index."""
+
+    def __init__(self, cell_deg=GEOCELL_DEG):
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._slots = {}               # username -> slot
+        self._names = []               # slot -> username
+        self._cell_of = []             # slot -> geocell
+        self._lat = array('d')
+        self._lng = array('d')
+        self._ts = array('d')
+        self._accuracy = array('f')
+        self._cells = {}               # geocell -> set(username)
+        self._changed = set()          # usernames updated since the last drain
+        self.updates = self.out_of_order = 0
+
+    def update(self, username, lat, lng, ts, accuracy=0.0):
+        """Record a ping; False if it is older than the stored position."""
+        cell = geocell(lat, lng, self.cell_deg)
+        with self._lock:
+            slot = self._slots.get(username)
+            if slot is None:
+                slot = self._slots[username] = len(self._names)
+                self._names.append(username)
+                self._cell_of.append(cell)
+                self._lat.append(lat)
+                self._lng.append(lng)
+                self._ts.append(ts)
+                self._accuracy.append(accuracy)
+                self._cells.setdefault(cell, set()).add(username)
+            else:
+                if ts < self._ts[slot]:
+                    self.out_of_order += 1
+                    return False
+                old_cell = self._cell_of[slot]
+                if old_cell != cell:
+                    self._discard_from_cell(old_cell, username)
+                    self._cells.setdefault(cell, set()).add(username)
+                    self._cell_of[slot] = cell
+                self._lat[slot] = lat
+                self._lng[slot] = lng
+                self._ts[slot] = ts
+                self._accuracy[slot] = accuracy
+            self._changed.add(username)
+            self.updates += 1
+            return True
+
+    def _discard_from_cell(self, cell, username):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(username)
+            if not members:
+                del self._cells[cell]
+
+    def _remove(self, username):
+        """Drop a volunteer, moving the last slot into its place. Caller holds the lock."""
+        slot = self._slots.pop(username)
+        self._discard_from_cell(self._cell_of[slot], username)
+        last = len(self._names) - 1
+        if slot != last:
+            moved = self._names[last]
+            self._names[slot] = moved
+            self._cell_of[slot] = self._cell_of[last]
+            for column in (self._lat, self._lng, self._ts, self._accuracy):
+                column[slot] = column[last]
+            self._slots[moved] = slot
+        self._names.pop()
+        self._cell_of.pop()
+        for column in (self._lat, self._lng, self._ts, self._accuracy):
+            column.pop()
+
+    def _raw(self, slot):
+        return self._names[slot], self._lat[slot], self._lng[slot], self._ts[slot], self._accuracy[slot]
+
+    @staticmethod
+    def _format(raw):
+        name, lat, lng, ts, accuracy = raw
+        return [name, round(lat, 6), round(lng, 6), round(ts, 1), round(accuracy, 1)]
+
+    def _row(self, slot):
+        return self._format(self._raw(slot))
+
+    def get(self, username):
+        with self._lock:
+            slot = self._slots.get(username)
+            return None if slot is None else self._row(slot)
+
+    def snapshot(self):
+        """[[username, lat, lng, ts, accuracy]] for every tracked volunteer."""
+        with self._lock:
+            raw = [self._raw(slot) for slot in range(len(self._names))]
+        return [self._format(r) for r in raw]
+
+    def drain(self, now=None, ttl=POSITION_TTL):
+        """(moved rows since the last drain, usernames that went offline and were dropped)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            offline = [name for slot, name in enumerate(self._names) if now - self._ts[slot] > ttl]
+            for name in offline:
+                self._remove(name)
+            changed, self._changed = self._changed, set()
+            slots = self._slots
+            raw = [self._raw(slots[name]) for name in changed if name in slots]
+        return [self._format(r) for r in raw], offline  # Rounding outside the lock
+
+    def nearby(self, latitude, longitude, radius_km=10.0, limit=10, max_age=POSITION_TTL, now=None):
+        """Volunteers within radius_km, nearest first: [{'username', ..., 'distance_km'}]."""
+        now = time.time() if now is None else now
+        row, col = geocell(latitude, longitude, self.cell_deg)
+        cell_km = self.cell_deg * KM_PER_DEG
+        rings_lat = int(radius_km // cell_km) + 1
+        rings_lng = int(radius_km // max(cell_km * abs(math.cos(math.radians(latitude))), 1e-3)) + 1
+        found = []
+        with self._lock:
+            if (2 * rings_lat + 1) * (2 * rings_lng + 1) > len(self._cells):
+                cells = self._cells.values()  # Sparse index: cheaper to scan what exists
+            else:
+                cells = [self._cells.get((row + dr, col + dc), ())
+                         for dr in range(-rings_lat, rings_lat + 1) for dc in range(-rings_lng, rings_lng + 1)]
+            for members in cells:
+                for name in members:
+                    slot = self._slots[name]
+                    if now - self._ts[slot] > max_age:
+                        continue
+                    distance = haversine_km(latitude, longitude, self._lat[slot], self._lng[slot])
+                    if distance <= radius_km:
+                        found.append((distance, slot))
+            found.sort()
+            rows = [(distance, self._row(slot)) for distance, slot in found[:limit]]
+        return [{'username': r[0], 'latitude': r[1], 'longitude': r[2], 'timestamp': r[3], 'accuracy': r[4],
+                 'distance_km': round(distance, 3)} for distance, r in rows]
+
+    def __len__(self):
+        return len(self._names)
+
+
+class TrailRecorder:
+    """Distance / time downsampling of pings into batched volunteer_trails inserts."""
+
+    def __init__(self, min_distance_m=TRAIL_MIN_DISTANCE_M, max_interval=TRAIL_MAX_INTERVAL,
+                 max_buffer=TRAIL_MAX_BUFFER):
+        self.min_distance_km = min_distance_m / 1000.0
+        self.max_interval = max_interval
+        self.max_buffer = max_buffer
+        self._lock = native_lock()  # flush() runs through run_blocking()
+        self._last = {}     # username -> (lat, lng, ts) of the last kept point
+        self._buffer = []   # (username, lat, lng, ts, accuracy) waiting for the next flush
+        self.kept = self.skipped = self.written = self.dropped = 0
+
+    def offer(self, username, lat, lng, ts, accuracy=0.0):
+        """Keep the ping if it is far enough (in space or time) from the last kept point."""
+        with self._lock:
+            last = self._last.get(username)
+            if last is not None:
+                if ts <= last[2]:
+                    self.skipped += 1
+                    return False
+                if ts - last[2] < self.max_interval and \
+                        haversine_km(last[0], last[1], lat, lng) < self.min_distance_km:
+                    self.skipped += 1
+                    return False
+            self._last[username] = (lat, lng, ts)
+            self._buffer.append((username, lat, lng, ts, accuracy))
+            if len(self._buffer) > self.max_buffer:
+                overflow = len(self._buffer) - self.max_buffer
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            self.kept += 1
+            return True
+
+    def forget(self, username):
+        with self._lock:
+            self._last.pop(username, None)
+
+    def flush(self):
+        """Write buffered points in one transaction. Returns rows written.
+
+        A locked / busy database keeps the points for the next flush; any other
+        error drops the batch, since it would fail every retry and hold back
+        newer points.
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        try:
+            conn = get_db_connection()
+            try:
+                conn.executemany("""
+                    INSERT INTO volunteer_trails (username, latitude, longitude, recorded_at, accuracy)
+                    VALUES (?, ?, ?, ?, ?)
+                """, batch)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            with self._lock:  # Keep the points for the next flush
+                self._buffer[:0] = batch
+                overflow = len(self._buffer) - self.max_buffer
+                if overflow > 0:
+                    del self._buffer[:overflow]
+                    self.dropped += overflow
+            raise
+        except Exception:
+            with self._lock:
+                self.dropped += len(batch)
+            logger.error(f"❌ Dropped {len(batch)} volunteer trail points the database rejected")
+            raise
+        with self._lock:
+            self.written += len(batch)
+        return len(batch)
+
+    def pending(self):
+        return len(self._buffer)
+
+
+class VolunteerTracker:
+    """Ingestion entry point: position store + trail recorder + throttled admin pushes."""
+
+    def __init__(self):
+        self.positions = PositionStore()
+        self.trails = TrailRecorder()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.pings = self.rejected = self.pushes = 0
+
+    def ingest(self, username, pings, now=None):
+        """Apply a list of raw pings from one volunteer. Returns (accepted, errors)."""
+        self._ensure_started()
+        now = time.time() if now is None else now
+        accepted, errors = 0, []
+        for i, raw in enumerate(pings[:MAX_PINGS_PER_REQUEST]):
+            try:
+                lat, lng, ts, accuracy = parse_ping(raw, now)
+            except PingError as e:
+                errors.append({'index': i, 'error': str(e)})
+                continue
+            self.trails.offer(username, lat, lng, ts, accuracy)
+            if now - ts <= POSITION_TTL:  # Old buffered pings only feed the trail
+                self.positions.update(username, lat, lng, ts, accuracy)
+            accepted += 1
+        if len(pings) > MAX_PINGS_PER_REQUEST:
+            errors.append({'index': MAX_PINGS_PER_REQUEST, 'error': f"At most {MAX_PINGS_PER_REQUEST} pings per request"})
+        self.pings += accepted
+        self.rejected += len(pings) - accepted
+        return accepted, errors
+
+    # ---- background push / flush -----------------------------------------------------
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._loop, name='volunteer-tracking', daemon=True).start()
+
+    def push_deltas(self):
+        rows, offline = self.positions.drain()
+        for name in offline:
+            self.trails.forget(name)
+        if rows or offline:
+            socketio.emit('volunteer_positions', {'positions': rows, 'offline': offline}, room='admin-room')
+            self.pushes += 1
+
+    def _loop(self):
+        next_flush = time.monotonic() + TRAIL_FLUSH_SECONDS
+        while True:
+            time.sleep(POSITION_PUSH_INTERVAL)
+            try:
+                self.push_deltas()
+            except Exception as e:
+                logger.warning(f"⚠️ Volunteer position push failed: {e}")
+            if time.monotonic() >= next_flush:
+                next_flush = time.monotonic() + TRAIL_FLUSH_SECONDS
+                try:
+                    run_blocking(self.trails.flush)  # Native thread under eventlet/gevent
+                except Exception as e:
+                    logger.error(f"⚠️ Volunteer trail flush failed ({self.trails.pending()} points kept): {e}")
+
+    def stats(self):
+        return {
+            'tracked': len(self.positions),
+            'pings': self.pings,
+            'rejected': self.rejected,
+            'out_of_order': self.positions.out_of_order,
+            'pushes': self.pushes,
+            'trail_kept': self.trails.kept,
+            'trail_skipped': self.trails.skipped,
+            'trail_written': self.trails.written,
+            'trail_pending': self.trails.pending(),
+            'trail_dropped': self.trails.dropped,
+        }
+
+
+tracker = VolunteerTracker()